@@ -0,0 +1,178 @@
+""" 模型文件格式
+模型保存为一个目录，包含`meta.json`和若干`.npy`扁平数组：
+    neighbor_*      近邻索引(ID、ID排序下标、CSR的indptr/indices/scores)
+    user_*          用户ID及其排序下标
+    history_*       用户历史交互物品的CSR数组，indices为物品在item_keys中的位置
+    item_*          物品ID、排序下标及交互次数(热门推荐)
+加载时所有数组都以`numpy.memmap`只读映射，多个进程共享同一份页缓存，加载耗时与模型大小无关
+"""
+import argparse
+import json
+import os
+import pickle
+import shutil
+import time
+
+import numpy as np
+from loguru import logger
+
+from .keys import ArrayMapping, CSRMapping, KeyIndex
+from .neighbors import NeighborIndex
+
+FORMAT_VERSION = 1
+META_FILE = "meta.json"
+
+
+def _model_classes():
+    from .item_cf import ItemCF
+    from .user_cf import UserCF
+    return {"ItemCF": ItemCF, "UserCF": UserCF}
+
+
+def _index_dtype(bound):
+    """ 下标小于2^31时使用int32保存 """
+    return np.int32 if bound < 2 ** 31 else np.int64
+
+
+def _compact(array, bound):
+    return np.asarray(array, dtype=_index_dtype(bound))
+
+
+def _key_arrays(prefix, key_index):
+    arrays = {f"{prefix}_keys": key_index.keys}
+    if key_index.sorter is not None:
+        arrays[f"{prefix}_sorter"] = _compact(key_index.sorter, len(key_index))
+    return arrays
+
+
+def _load_key_index(arrays, prefix):
+    return KeyIndex(arrays[f"{prefix}_keys"], arrays.get(f"{prefix}_sorter"))
+
+
+def save_model(model, path):
+    """ 将训练好的ItemCF/UserCF保存为数组格式，写入临时目录后再替换，读取方不会看到写了一半的模型
+    :param model: 已经计算过相似度的模型
+    :param path: 模型目录
+    """
+    if getattr(model, "neighbor_index", None) is None:
+        # 旧版本的pickle缓存中没有近邻索引
+        model.build_neighbor_index()
+
+    neighbor_index = model.neighbor_index
+    # 设置了max_items/window时，窗口之外的历史物品没有计数，交互次数记为0，仍然保存在历史中用于排除
+    uncounted = dict.fromkeys(
+        item for items in model.user_item_dict.values() for item in items if item not in model.item_interacted_num)
+    item_index = KeyIndex(list(model.item_interacted_num.keys()) + list(uncounted))
+    item_counts = list(model.item_interacted_num.values()) + [0] * len(uncounted)
+    user_index = KeyIndex(list(model.user_item_dict.keys()))
+
+    item_position = {item: i for i, item in enumerate(item_index.keys.tolist())}
+    history_indptr, history_indices = [0], []
+    for user in user_index.keys.tolist():
+        history_indices.extend(item_position[item] for item in model.user_item_dict[user])
+        history_indptr.append(len(history_indices))
+
+    arrays = {
+        **_key_arrays("neighbor", neighbor_index.key_index),
+        "neighbor_indptr": np.asarray(neighbor_index.indptr, dtype=np.int64),
+        "neighbor_indices": _compact(neighbor_index.indices, len(neighbor_index)),
+        "neighbor_scores": np.asarray(neighbor_index.scores, dtype=np.float64),
+        **_key_arrays("user", user_index),
+        "history_indptr": np.asarray(history_indptr, dtype=np.int64),
+        "history_indices": _compact(history_indices, len(item_index)),
+        **_key_arrays("item", item_index),
+        "item_counts": np.asarray(item_counts, dtype=np.int64),
+    }
+    write_arrays(path, arrays, type(model).__name__, neighbor_index.size)
+
+
+def write_arrays(path, arrays, model_name, neighbor_size):
+    """ 把模型数组写入目录，写入临时目录后再替换，读取方不会看到写了一半的模型
+    :param arrays: `{name: array}`，数组可以是`numpy.memmap`
+    :param model_name: `ItemCF`或`UserCF`
+    :param neighbor_size: 近邻索引中每一行最多保存的邻居数
+    """
+    meta = {
+        "format_version": FORMAT_VERSION,
+        "model": model_name,
+        "neighbor_size": neighbor_size,
+        "created_at": time.time(),
+        "arrays": sorted(arrays),
+    }
+
+    path = os.path.abspath(path)
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_path, f"{name}.npy"), array, allow_pickle=array.dtype == object)
+    with open(os.path.join(tmp_path, META_FILE), "w", encoding="utf-8") as file:
+        json.dump(meta, file)
+
+    # 已经映射了旧文件的进程不受影响，继续使用旧版本直到重新加载
+    old_path = f"{path}.old-{os.getpid()}"
+    if os.path.exists(path):
+        os.replace(path, old_path)
+    os.replace(tmp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+    logger.info(f"Saved {meta['model']} to {path}")
+
+
+def _load_array(path, name):
+    file = os.path.join(path, f"{name}.npy")
+    try:
+        return np.load(file, mmap_mode="r")
+    except ValueError:
+        # object类型的ID无法映射，只能完整读入
+        return np.load(file, allow_pickle=True)
+
+
+def load_model(path):
+    """ 加载模型，目录为数组格式，文件为旧版本的pickle缓存 """
+    if not os.path.isdir(path):
+        with open(path, "rb") as file:
+            return pickle.loads(file.read())
+
+    with open(os.path.join(path, META_FILE), encoding="utf-8") as file:
+        meta = json.load(file)
+    if meta["format_version"] > FORMAT_VERSION:
+        raise ValueError(f"Unsupported model format version {meta['format_version']} in {path}")
+
+    arrays = {name: _load_array(path, name) for name in meta["arrays"]}
+    item_index = _load_key_index(arrays, "item")
+    user_index = _load_key_index(arrays, "user")
+
+    cls = _model_classes()[meta["model"]]
+    model = cls.__new__(cls)
+    model.neighbor_index = NeighborIndex(
+        _load_key_index(arrays, "neighbor"),
+        arrays["neighbor_indptr"],
+        arrays["neighbor_indices"],
+        arrays["neighbor_scores"],
+        meta["neighbor_size"],
+    )
+    model.user_item_dict = CSRMapping(user_index, arrays["history_indptr"], arrays["history_indices"], item_index.keys)
+    model.user_set = user_index
+    model.item_interacted_num = ArrayMapping(item_index, arrays["item_counts"])
+    if meta["model"] == "ItemCF":
+        model.item2cate = None
+        model.item_sim_dict = None
+    else:
+        model.item_set = item_index
+        model.item_user_dict = None
+        model.user_sim_dict = None
+        model.user_interacted_num = None
+    return model
+
+
+def convert_pickle(pickle_path, path):
+    """ 将旧版本的pickle缓存转换为数组格式 """
+    save_model(load_model(pickle_path), path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a pickled ItemCF/UserCF cache to the array format")
+    parser.add_argument("pickle_path")
+    parser.add_argument("path")
+    args = parser.parse_args()
+    convert_pickle(args.pickle_path, args.path)
@@ -0,0 +1,52 @@
+import math
+from collections import defaultdict
+
+
+def accumulate_cooccurrence(co_dict, entities, sign=1, related_score=None):
+    """ 将一个篮子(用户的物品列表/物品的用户列表)的共现贡献累加到`co_dict`
+    :param co_dict: `{i: {j: c_ij}}`
+    :param entities: 篮子内的实体列表
+    :param sign: 1为加上贡献，-1为减去贡献
+    :param related_score: 两个实体之间的额外权重函数，例如类别因子
+    """
+    if not entities:
+        return
+    # 活跃用户(热门物品)的贡献小于非活跃用户(冷门物品)
+    weight = sign / math.log(1 + len(entities))
+    for i in entities:
+        row = co_dict[i]
+        for j in entities:
+            if i == j:
+                continue
+            row[j] += weight if related_score is None else weight * related_score(i, j)
+
+
+def apply_cooccurrence_delta(sim_dict, delta, counts, old_counts):
+    """ 将共现次数的增量应用到已经归一化的相似度上，只处理受影响的元素
+    s_ij = c_ij / sqrt(N_i * N_j)，先用旧的交互次数还原c_ij，加上增量后再用新的交互次数归一化
+    :param sim_dict: `{i: {j: s_ij}}`，原地更新
+    :param delta: 共现次数的增量`{i: {j: Δc_ij}}`
+    :param counts: 更新后的交互次数N
+    :param old_counts: 交互次数发生变化的实体在更新前的交互次数
+    :return: 相似度发生变化的行
+    """
+    pairs = {(i, j) for i, row in delta.items() for j in row}
+    # 交互次数变化后，所在行和所在列的相似度都要重新归一化
+    for i in old_counts:
+        for j in sim_dict.get(i, {}):
+            pairs.add((i, j))
+            pairs.add((j, i))
+
+    empty = {}
+    for i, j in pairs:
+        row = sim_dict.setdefault(i, {})
+        raw = delta.get(i, empty).get(j, 0)
+        if j in row:
+            raw += row[j] * math.sqrt(old_counts.get(i, counts[i]) * old_counts.get(j, counts[j]))
+        row[j] = raw / math.sqrt(counts[i] * counts[j])
+
+    return {i for i, _ in pairs}
+
+
+def new_cooccurrence_delta():
+    return defaultdict(lambda: defaultdict(float))
@@ -1,13 +1,30 @@
 import math
 import os
-import pickle
 from collections import defaultdict
 from operator import itemgetter
 
+import numpy as np
 import pandas as pd
 from loguru import logger
 from tqdm import tqdm
 
+from ..metrics import metrics, record_model_size
+from ..popularity import RankedCounter
+from .artifact import load_model, save_model
+from .incremental import accumulate_cooccurrence, apply_cooccurrence_delta, new_cooccurrence_delta
+from .neighbors import NeighborIndex
+from .parallel import parallel_cooccurrence
+from .sparse import (
+    build_interaction_matrix,
+    category_factor,
+    cooccurrence_matrix,
+    inverse_log_weights,
+    matrix_to_dict,
+    normalize_cooccurrence,
+    topk_rows,
+)
+from .temporal import decayed_cooccurrence, recent_history
+
 
 class ItemCF:
     """ 基于物品的协同过滤
@@ -17,43 +34,113 @@ class ItemCF:
     4.根据⽤户的历史记录，给⽤户推荐物品
     """
 
-    def __init__(self, data, user_col: str = None, item_col: str = None, item2cate: dict = None):
+    def __init__(self, data, user_col: str = None, item_col: str = None, item2cate: dict = None,
+                 time_col: str = None):
         """ data为`DataFrame`或者字典`{user_id: items}`
         :param data: 用户的历史行为数据
         :param user_col: 用户ID所在列名
         :param item_col: 物品ID所在列名
         :param item2cate: 物品的类型字典
+        :param time_col: 交互时间戳(秒)所在列名，时间衰减和时间窗口需要该列
         """
         self.item2cate = item2cate
+        self.user_col, self.item_col = user_col, item_col
 
         self.user_set = set()
         self.item_sim_dict = dict()
+        self.neighbor_index = None
         self.item_interacted_num = defaultdict(int)
+        self.popularity = None  # 热门物品索引，第一次召回时由item_interacted_num建立
+        self.tag_index = None  # 标签索引，给没有交互的物品打分，见`use_tags`
+        self.tag_weight = 1.0
+        self.tag_slots = 2
+        self._cold_items = None
+        self.user_time_dict = None
+        self.time_options = None
 
         if isinstance(data, pd.DataFrame):
             user_item = data.groupby(user_col)[item_col].apply(list).reset_index()
             self.user_item_dict = dict(zip(user_item[user_col], user_item[item_col]))
+            if time_col:
+                user_time = data.groupby(user_col)[time_col].apply(list)
+                self.user_time_dict = user_time.to_dict()
         else:
             self.user_item_dict = data
 
-    def calculate_similarity_matrix(self):
-        """ 计算物品相似度 """
+    def calculate_similarity_matrix(self, engine: str = "python", neighbor_num: int = 50, workers: int = None,
+                                    half_life: float = None, max_items: int = None, window: float = None):
+        """ 计算物品相似度，并构建每个物品的近邻索引
+        :param engine: 计算方式，`python`为逐用户循环，`sparse`为稀疏矩阵运算，`parallel`为多进程分片的稀疏矩阵运算
+        :param neighbor_num: 近邻索引中每个物品保存的相似物品数
+        :param workers: `parallel`使用的进程数，默认为CPU核数
+        :param half_life: 时间衰减的半衰期(秒)，同一用户两次交互的共现权重为 0.5 ^ (间隔 / half_life)，
+            `parallel`不支持
+        :param max_items: 每个用户只用最近的max_items次交互计算相似度
+        :param window: 每个用户只用最后一次交互之前window秒内的交互计算相似度
+        """
+        if engine not in ("python", "sparse", "parallel"):
+            raise ValueError(f"Unknown similarity engine: {engine}")
+        if half_life and engine == "parallel":
+            raise ValueError("Time decay is supported by the python and sparse engines")
+        if (half_life or window) and self.user_time_dict is None:
+            raise ValueError("Time decay and time windows require time_col")
+        if any((half_life, max_items, window)):
+            self.time_options = {"half_life": half_life, "max_items": max_items, "window": window}
+
+        self.popularity = None
+        self._cold_items = None
+        with metrics.timer("ItemCF", "similarity"):
+            if engine == "sparse":
+                self._calculate_similarity_matrix_sparse()
+            elif engine == "parallel":
+                self._calculate_similarity_matrix_parallel(workers)
+            else:
+                self._calculate_similarity_matrix()
+
+        self.build_neighbor_index(neighbor_num)
+
+    def build_neighbor_index(self, neighbor_num: int = 50):
+        """ 预先截取每个物品相似度最高的`neighbor_num`个物品，召回时不再对相似度整行排序 """
+        with metrics.timer("ItemCF", "neighbor_index"):
+            self.neighbor_index = NeighborIndex.from_dict(self.item_sim_dict, neighbor_num)
+        record_model_size(
+            "ItemCF", rows=len(self.neighbor_index), neighbors=len(self.neighbor_index.indices),
+            bytes=self.neighbor_index.nbytes,
+        )
+
+    def _histories(self):
+        """ 参与相似度计算的用户历史`{user: (items, times)}`，按`time_options`截取最近的交互 """
+        options = getattr(self, "time_options", None) or {}
+        user_time_dict = getattr(self, "user_time_dict", None)
+        max_items, window = options.get("max_items"), options.get("window")
+        histories = {}
+        for user, items in self.user_item_dict.items():
+            times = user_time_dict[user] if user_time_dict is not None else None
+            if max_items or window:
+                items, times = recent_history(items, times, max_items, window)
+            histories[user] = (items, times)
+        return histories
+
+    def _calculate_similarity_matrix(self):
+        """ 逐用户循环计算物品相似度 """
         logger.info("Calculating Item Similarity Matrix")
-        for user, items in tqdm(self.user_item_dict.items()):
+        half_life = (getattr(self, "time_options", None) or {}).get("half_life")
+        for user, (items, times) in tqdm(self._histories().items()):
             self.user_set.add(user)
-            for item in items:
+            for i, item in enumerate(items):
                 self.item_interacted_num[item] += 1
                 self.item_sim_dict.setdefault(item, {})
-                for related_item in items:
+                for j, related_item in enumerate(items):
                     if item == related_item:
                         continue
                     self.item_sim_dict[item].setdefault(related_item, 0)
 
                     related_score = 1
                     if self.item2cate:
-                        # 如果二者类别相同相似度更高
-                        related_score *= 1 if self.item2cate.get(
-                            item, None) == self.item2cate.get(related_item, None) else 0.8
+                        related_score *= self._category_factor(item, related_item)
+                    if half_life:
+                        # 两次交互间隔越久，共现的贡献越小
+                        related_score *= 0.5 ** (abs(times[i] - times[j]) / half_life)
 
                     # 活跃用户在计算物品之间相似度时，贡献小于非活跃用户
                     self.item_sim_dict[item][related_item] += related_score / math.log(1 + len(items))
@@ -64,48 +151,241 @@ class ItemCF:
                 self.item_sim_dict[i][j] = \
                     cij / math.sqrt(self.item_interacted_num[i] * self.item_interacted_num[j])
 
-    def __call__(self, users, n=50, topk=20, hot_fill=False):
-        """ 物品召回 """
-        logger.info(f"Starting ItemCF: ecall@{topk}-Near@{n}")
-        popular_items = [val[0] for val in sorted(
-            self.item_interacted_num.items(), key=lambda x: x[1], reverse=True)[:topk]]
+    def _category_factor(self, item, related_item):
+        """ 如果二者类别相同相似度更高 """
+        return 1 if self.item2cate.get(item, None) == self.item2cate.get(related_item, None) else 0.8
+
+    def update(self, new_interactions):
+        """ 增量更新：只累加新交互带来的共现变化，并只重新归一化受影响的行，结果与全量重新计算一致
+        :param new_interactions: 新的交互数据，`DataFrame`或者字典`{user_id: items}`
+        """
+        if self.item_sim_dict is None:
+            raise ValueError("Models loaded from the array format cannot be updated")
+        if getattr(self, "time_options", None):
+            raise ValueError("Models built with time decay or history limits cannot be updated incrementally")
+        if isinstance(new_interactions, pd.DataFrame):
+            user_item = new_interactions.groupby(self.user_col)[self.item_col].apply(list).reset_index()
+            new_interactions = dict(zip(user_item[self.user_col], user_item[self.item_col]))
+
+        related_score = self._category_factor if self.item2cate else None
+        delta, old_counts = new_cooccurrence_delta(), {}
+        for user, new_items in new_interactions.items():
+            his_items = self.user_item_dict.get(user, [])
+            items = list(his_items) + list(new_items)
+            # 用户的历史变长后，原有共现的权重1 / log(1 + len(items))也随之变小
+            accumulate_cooccurrence(delta, his_items, -1, related_score)
+            accumulate_cooccurrence(delta, items, 1, related_score)
+            for item in new_items:
+                old_counts.setdefault(item, self.item_interacted_num[item])
+                self.item_interacted_num[item] += 1
+                if self.popularity is not None:
+                    self.popularity.add(item)
+                self.item_sim_dict.setdefault(item, {})
+            self.user_item_dict[user] = items
+            self.user_set.add(user)
+        self._cold_items = None
+
+        rows = apply_cooccurrence_delta(self.item_sim_dict, delta, self.item_interacted_num, old_counts)
+        if getattr(self, "neighbor_index", None) is not None:
+            self.neighbor_index = self.neighbor_index.update_rows(self.item_sim_dict, rows | set(old_counts))
+        logger.info(f"Updated ItemCF with {len(new_interactions)} users, {len(rows)} rows renormalised")
+
+    def _calculate_similarity_matrix_sparse(self):
+        """ 以稀疏矩阵运算计算物品相似度，结果与逐用户循环一致
+        C = X^T diag(1 / log(1 + |N(u)|)) X，再乘以类别因子并除以 sqrt(N_i * N_j)
+        """
+        logger.info("Calculating Item Similarity Matrix (sparse)")
+        self.user_set.update(self.user_item_dict.keys())
+
+        histories = self._histories()
+        matrix, _, items = build_interaction_matrix({user: items for user, (items, _) in histories.items()})
+        counts = np.asarray(matrix.sum(axis=0)).ravel()
+        for item, count in zip(items, counts.tolist()):
+            self.item_interacted_num[item] += int(count)
+
+        half_life = (getattr(self, "time_options", None) or {}).get("half_life")
+        if half_life:
+            # 时间衰减的权重取决于两次交互，不能写成 X^T W X，改为逐用户展开物品对
+            item_index = {item: i for i, item in enumerate(items)}
+            co = decayed_cooccurrence(
+                [item_index[item] for items, _ in histories.values() for item in items],
+                [time for _, times in histories.values() for time in times],
+                [len(items) for items, _ in histories.values()],
+                len(items), half_life,
+            )
+        else:
+            co = cooccurrence_matrix(matrix, inverse_log_weights(matrix))
+        if self.item2cate:
+            # 如果二者类别相同相似度更高
+            co = category_factor(co, items, self.item2cate)
+
+        self.item_sim_dict = matrix_to_dict(normalize_cooccurrence(co, counts), items)
+
+    def _calculate_similarity_matrix_parallel(self, workers=None):
+        """ 按用户分片，多进程计算部分共现矩阵后合并，结果与`sparse`一致 """
+        logger.info("Calculating Item Similarity Matrix (parallel)")
+        self.user_set.update(self.user_item_dict.keys())
+
+        co, counts, items = parallel_cooccurrence(
+            {user: items for user, (items, _) in self._histories().items()}, workers)
+        for item, count in zip(items, counts.tolist()):
+            self.item_interacted_num[item] += int(count)
 
+        if self.item2cate:
+            # 如果二者类别相同相似度更高
+            co = category_factor(co, items, self.item2cate)
+
+        self.item_sim_dict = matrix_to_dict(normalize_cooccurrence(co, counts), items)
+
+    def use_tags(self, tag_index, weight: float = 1.0, slots: int = 2):
+        """ 用标签相似度给模型中没有的物品(没有交互的新物品)打分
+        对用户的每个历史物品，在这些物品中取标签相似度最高的n个，Jaccard相似度按历史物品数取平均，
+        再乘以 weight * 该用户协同过滤的最高得分，与物品相似度的得分处于同一量级
+        :param tag_index: `TagIndex`，可以在模型之外继续增量更新
+        :param weight: 标签得分相对于协同过滤最高得分的比例，为1时与全部历史物品标签相同的物品得分与最高得分相同
+        :param slots: 每个用户的推荐结果中最多有几个没有交互的物品
+        """
+        self.tag_index, self.tag_weight, self.tag_slots = tag_index, weight, slots
+        self._cold_items = None
+
+    def cold_items(self):
+        """ 有标签但没有交互的物品，标签索引更新后重新计算 """
+        tag_index = getattr(self, "tag_index", None)
+        if tag_index is None:
+            return set()
+        cached = getattr(self, "_cold_items", None)
+        if cached is None or cached[0] != tag_index.version:
+            cold = {item for item in list(tag_index.item_tags) if item not in self.item_interacted_num}
+            cached = self._cold_items = (tag_index.version, cold)
+        return cached[1]
+
+    def _cold_scores(self, his_items, n):
+        """ 历史物品在没有交互的物品中的标签近邻得分，按历史物品数取平均，在[0, 1]之间 """
+        scores = defaultdict(float)
+        cold = self.cold_items()
+        if cold and his_items:
+            for his_item in his_items:
+                for item, score in self.tag_index.neighbors(his_item, n, among=cold):
+                    scores[item] += score / len(his_items)
+        return scores
+
+    def _merge_cold(self, rank, his_items, n, topk):
+        """ 把标签得分最高的tag_slots个没有交互的物品并入协同过滤的得分，返回前topk个物品
+        没有交互的物品不在近邻索引中，不会与rank中的物品重复；
+        rank只需包含协同过滤的前topk个物品，结果与传入全部得分时相同
+        """
+        cold = sorted(self._cold_scores(his_items, n).items(), key=itemgetter(1), reverse=True)[:self.tag_slots]
+        # 没有协同过滤结果时只按标签得分排序
+        scale = self.tag_weight * max(rank.values(), default=1.0)
+        rank = {**rank, **{item: scale * score for item, score in cold}}
+        return [item[0] for item in sorted(rank.items(), key=itemgetter(1), reverse=True)[:topk]]
+
+    def popular_items(self, topk):
+        """ 交互数最多的topk个物品，索引建立后增量维护，每次召回只需O(topk) """
+        if getattr(self, "popularity", None) is None:
+            self.popularity = RankedCounter.from_counts(self.item_interacted_num)
+        return self.popularity.top(topk)
+
+    def _fill_popular(self, rec_items, seen, topk):
+        """ 用热门物品把推荐结果补足topk个，跳过用户交互过的和已经推荐的物品 """
+        if len(rec_items) >= topk:
+            return rec_items
+        exclude = seen.union(rec_items)
+        popular_items = [item for item in self.popular_items(topk + len(exclude)) if item not in exclude]
+        return rec_items + popular_items[:topk - len(rec_items)]
+
+    def __call__(self, users, n=50, topk=20, hot_fill=False, batch_size=None):
+        """ 物品召回
+        :param batch_size: 不为空时按块批量计算，每块`batch_size`个用户
+        """
+        logger.debug(f"Starting ItemCF: ecall@{topk}-Near@{n}")
+        with metrics.timer("ItemCF", "popular"):
+            popular_items = self.popular_items(topk)
+        if getattr(self, "neighbor_index", None) is None or self.neighbor_index.size < n:
+            if self.item_sim_dict is None:
+                # 数组格式的模型只保存了近邻索引
+                logger.warning(f"Neighbor index holds {self.neighbor_index.size} neighbors, truncating n={n}")
+            else:
+                # 旧版本缓存中没有近邻索引，或者需要的近邻数超过了索引的大小
+                self.build_neighbor_index(n)
+
+        with metrics.timer("ItemCF", "recall"):
+            if batch_size:
+                return self._recommend_batch(users, n, topk, hot_fill, popular_items, batch_size)
+            return self._recommend(users, n, topk, hot_fill, popular_items)
+
+    def _recommend(self, users, n, topk, hot_fill, popular_items):
+        """ 逐用户召回 """
         user_rec = {}
-        for user_id in tqdm(users):
+        for user_id in users:
             # 新用户，直接推荐热门物品
             if user_id not in self.user_set:
                 user_rec[user_id] = popular_items
             else:
                 rank = defaultdict(int)
                 his_items = self.user_item_dict[user_id]
+                seen = set(his_items)
                 # 遍历用户历史交互物品
                 for his_item in his_items:
-                    # 选取与his_item相似度最高的n个物品
-                    for candidate_item, item_smi_score in sorted(
-                            self.item_sim_dict[his_item].items(), key=itemgetter(1), reverse=True)[:n]:
-                        rank[candidate_item] += item_smi_score
-
-                rec_items = [item[0] for item in sorted(rank.items(), key=itemgetter(1), reverse=True)[:topk]]
+                    # 选取与his_item相似度最高的n个物品，用户已经交互过的物品不再推荐
+                    for candidate_item, item_smi_score in self.neighbor_index.get(his_item, n):
+                        if candidate_item not in seen:
+                            rank[candidate_item] += item_smi_score
+                if getattr(self, "tag_index", None) is not None:
+                    rec_items = self._merge_cold(rank, his_items, n, topk)
+                else:
+                    rec_items = [item[0] for item in sorted(rank.items(), key=itemgetter(1), reverse=True)[:topk]]
                 if hot_fill:
                     # 如果推荐的物品不够，用热门物品进行填充
-                    rec_items += popular_items[:topk - len(rec_items)]
+                    rec_items = self._fill_popular(rec_items, seen, topk)
                 user_rec[user_id] = rec_items
 
         return user_rec
 
+    def _recommend_batch(self, users, n, topk, hot_fill, popular_items, batch_size):
+        """ 批量召回，与逐用户召回的结果一致
+        每块用户的历史构成稀疏矩阵H，得分矩阵为 H @ S，S为截断到n个邻居的物品近邻矩阵
+        """
+        keys = self.neighbor_index.keys.tolist()
+        item_index = {item: i for i, item in enumerate(keys)}
+        neighbor_matrix = self.neighbor_index.to_matrix(n)
+
+        user_rec = {}
+        known_users = [user_id for user_id in dict.fromkeys(users) if user_id in self.user_set]
+        for start in range(0, len(known_users), batch_size):
+            block = known_users[start:start + batch_size]
+            # 设置了max_items/window时，窗口之外的历史物品可能不在近邻索引中，这些物品没有近邻，也不会被召回
+            history, _, _ = build_interaction_matrix(
+                {user_id: [item for item in self.user_item_dict[user_id] if item in item_index] for user_id in block},
+                item_index)
+            scores = (history @ neighbor_matrix).tocsr()
+            # 用户已经交互过的物品不再推荐
+            scores = scores - scores.multiply(history > 0)
+            scores.eliminate_zeros()
+            indptr, indices, scores = topk_rows(scores, topk)
+            for i, user_id in enumerate(block):
+                rec_items = [keys[j] for j in indices[indptr[i]:indptr[i + 1]].tolist()]
+                if getattr(self, "tag_index", None) is not None:
+                    # 没有交互的物品不在近邻矩阵中，与前topk个结果合并后重新排序即可
+                    rank = dict(zip(rec_items, scores[indptr[i]:indptr[i + 1]].tolist()))
+                    rec_items = self._merge_cold(rank, self.user_item_dict[user_id], n, topk)
+                if hot_fill:
+                    # 如果推荐的物品不够，用热门物品进行填充
+                    rec_items = self._fill_popular(rec_items, set(self.user_item_dict[user_id]), topk)
+                user_rec[user_id] = rec_items
+
+        # 新用户，直接推荐热门物品
+        return {user_id: user_rec.get(user_id, popular_items) for user_id in users}
+
 
-def recommend_by_item_cf(users, data, n=50, topk=20, hot_fill=False, cache_path=None, save=False, **kwargs):
+def recommend_by_item_cf(users, data, n=50, topk=20, hot_fill=False, cache_path=None, save=False,
+                         engine="python", batch_size=None, **kwargs):
     if cache_path and os.path.exists(cache_path):
-        with open(cache_path, 'rb') as file:
-            item_cf = pickle.loads(file.read())
-            file.close()
+        item_cf = load_model(cache_path)
     else:
         item_cf = ItemCF(data, **kwargs)
-        item_cf.calculate_similarity_matrix()
+        item_cf.calculate_similarity_matrix(engine)
         if save and cache_path:
-            item_cf_pkl = pickle.dumps(item_cf)
-            output = open(cache_path, 'wb')
-            output.write(item_cf_pkl)
-            output.close()
+            save_model(item_cf, cache_path)
 
-    return item_cf(users, n, topk, hot_fill)
+    return item_cf(users, n, topk, hot_fill, batch_size)
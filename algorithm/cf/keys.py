@@ -0,0 +1,116 @@
+from collections.abc import Mapping
+
+import numpy as np
+
+
+def as_key_array(keys):
+    """ 将ID列表转换为numpy数组，ID类型不一致时使用object数组以保留原始类型 """
+    keys = list(keys)
+    array = np.asarray(keys)
+    if array.dtype.kind in "iufb" or (array.dtype.kind == "U" and all(isinstance(key, str) for key in keys)):
+        return array
+    array = np.empty(len(keys), dtype=object)
+    array[:] = keys
+    return array
+
+
+class KeyIndex:
+    """ ID到位置的映射
+    ID保存在数组中，通过排序后的二分查找定位，数组可以直接来自`numpy.memmap`，无需在加载时构建字典
+    """
+
+    def __init__(self, keys, sorter=None):
+        """
+        :param keys: ID数组
+        :param sorter: 使`keys`有序的下标，为空时重新计算
+        """
+        self.keys = keys if isinstance(keys, np.ndarray) else as_key_array(keys)
+        self._lookup = None
+        if sorter is not None:
+            self.sorter = sorter
+        else:
+            try:
+                self.sorter = np.argsort(self.keys, kind="stable")
+            except TypeError:
+                # ID之间无法比较大小时退化为字典查找
+                self.sorter, self._lookup = None, {key: i for i, key in enumerate(self.keys.tolist())}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return self.position(key) is not None
+
+    def __iter__(self):
+        return iter(self.keys.tolist())
+
+    def position(self, key):
+        """ key所在的位置，不存在时返回None """
+        if self._lookup is not None:
+            return self._lookup.get(key)
+        if len(self.keys) == 0:
+            return None
+        try:
+            i = np.searchsorted(self.keys, key, sorter=self.sorter)
+        except TypeError:
+            return None
+        if i < len(self.keys) and self.keys[self.sorter[i]] == key:
+            return int(self.sorter[i])
+        return None
+
+
+class ArrayMapping(Mapping):
+    """ 只读的`{key: value}`映射，键和值都保存在数组中 """
+
+    def __init__(self, key_index: KeyIndex, values):
+        self.key_index = key_index
+        self.values_array = values
+
+    def __getitem__(self, key):
+        i = self.key_index.position(key)
+        if i is None:
+            raise KeyError(key)
+        return self.values_array[i].item()
+
+    def __contains__(self, key):
+        return key in self.key_index
+
+    def __iter__(self):
+        return iter(self.key_index)
+
+    def __len__(self):
+        return len(self.key_index)
+
+    def items(self):
+        return zip(self.key_index.keys.tolist(), self.values_array.tolist())
+
+
+class CSRMapping(Mapping):
+    """ 只读的`{key: [value, ...]}`映射，列表以CSR数组保存 """
+
+    def __init__(self, key_index: KeyIndex, indptr, indices, value_keys):
+        """
+        :param key_index: 每一行对应的ID
+        :param indptr: 第i行的值位于`indices[indptr[i]:indptr[i + 1]]`
+        :param indices: 值在`value_keys`中的位置
+        :param value_keys: 值的ID数组
+        """
+        self.key_index = key_index
+        self.indptr = indptr
+        self.indices = indices
+        self.value_keys = value_keys
+
+    def __getitem__(self, key):
+        i = self.key_index.position(key)
+        if i is None:
+            raise KeyError(key)
+        return self.value_keys[self.indices[self.indptr[i]:self.indptr[i + 1]]].tolist()
+
+    def __contains__(self, key):
+        return key in self.key_index
+
+    def __iter__(self):
+        return iter(self.key_index)
+
+    def __len__(self):
+        return len(self.key_index)
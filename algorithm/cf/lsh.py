@@ -0,0 +1,112 @@
+""" MinHash-LSH近邻候选
+UserCF逐物品枚举用户对，热门物品的用户数为n时需要n²次更新。近似模式下：
+    1.对每个用户的物品集合计算MinHash签名，两个签名在某一位相同的概率等于两个集合的Jaccard相似度
+    2.签名分为bands段、每段rows位，任意一段完全相同的两个用户成为候选，
+      Jaccard相似度为s的用户对成为候选的概率为 1 - (1 - s^rows)^bands
+    3.只对候选用户对计算精确的相似度
+bands越多、rows越少，召回越高，候选也越多
+"""
+import numpy as np
+import scipy.sparse as sp
+from loguru import logger
+
+# 2^31 - 1，哈希值与乘积都在int64范围内
+_PRIME = 2147483647
+
+
+def minhash_signatures(matrix, num_perm: int = 128, seed: int = 0):
+    """ 每一行非零列集合的MinHash签名
+    :param matrix: 稀疏矩阵，行为集合，列为元素
+    :param num_perm: 签名长度(哈希函数个数)
+    :return: `(行数, num_perm)`的int64数组，空行的签名为`_PRIME`
+    """
+    matrix = sp.csr_matrix(matrix)
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, _PRIME, size=num_perm, dtype=np.int64)
+    b = rng.integers(0, _PRIME, size=num_perm, dtype=np.int64)
+
+    rows, nnz = matrix.shape[0], matrix.nnz
+    signatures = np.full((rows, num_perm), _PRIME, dtype=np.int64)
+    nonempty = np.flatnonzero(np.diff(matrix.indptr))
+    if not nnz:
+        return signatures
+    columns = np.arange(matrix.shape[1], dtype=np.int64)
+    # 每次处理若干个哈希函数，中间数组控制在约128MB
+    step = max(1, (1 << 24) // max(nnz, matrix.shape[1]))
+    for start in range(0, num_perm, step):
+        end = min(start + step, num_perm)
+        hashed = (np.outer(columns, a[start:end]) + b[start:end]) % _PRIME
+        signatures[nonempty, start:end] = np.minimum.reduceat(
+            hashed[matrix.indices], matrix.indptr[nonempty], axis=0)
+    return signatures
+
+
+def lsh_candidates(signatures, bands: int, rows: int, max_bucket: int = 1000):
+    """ 分段LSH，返回候选行对
+    :param signatures: `minhash_signatures`的结果，长度至少为`bands * rows`
+    :param bands: 段数
+    :param rows: 每段的位数
+    :param max_bucket: 桶内的行数超过该值时跳过这个桶，避免退化为两两枚举
+    :return: (左行号数组, 右行号数组, 跳过的桶数)，每对满足左 < 右且不重复
+    """
+    if signatures.shape[1] < bands * rows:
+        raise ValueError(f"Signatures of length {signatures.shape[1]} are shorter than bands * rows")
+    size = len(signatures)
+    pairs, skipped = [], 0
+    for band in range(bands):
+        block = np.ascontiguousarray(signatures[:, band * rows:(band + 1) * rows])
+        _, buckets = np.unique(block.view(np.dtype((np.void, block.dtype.itemsize * rows))).ravel(),
+                               return_inverse=True)
+        order = np.argsort(buckets, kind="stable")
+        bounds = np.flatnonzero(np.diff(buckets[order])) + 1
+        for group in np.split(order, bounds):
+            if len(group) < 2:
+                continue
+            if len(group) > max_bucket:
+                skipped += 1
+                continue
+            left, right = np.triu_indices(len(group), 1)
+            left, right = group[left], group[right]
+            pairs.append(np.minimum(left, right) * size + np.maximum(left, right))
+    if not pairs:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, skipped
+    pairs = np.unique(np.concatenate(pairs))
+    return pairs // size, pairs % size, skipped
+
+
+def pair_similarity(weighted, matrix, left, right, batch_size: int = 1 << 16):
+    """ 逐对计算行向量的内积 weighted[left] · matrix[right] """
+    scores = np.empty(len(left))
+    for start in range(0, len(left), batch_size):
+        end = start + batch_size
+        product = weighted[left[start:end]].multiply(matrix[right[start:end]])
+        scores[start:end] = np.asarray(product.sum(axis=1)).ravel()
+    return scores
+
+
+def candidate_stats(bands: int, rows: int, similarities=(0.1, 0.2, 0.3, 0.5, 0.8)):
+    """ Jaccard相似度为s的用户对成为候选的理论概率 """
+    return {s: 1 - (1 - s ** rows) ** bands for s in similarities}
+
+
+def neighbor_recall(exact, approx, keys, k: int):
+    """ 近似近邻对精确近邻的召回率
+    近似模式下候选的相似度是精确值，相似度不低于精确结果中第k个相似度的近邻都算命中，边界上的并列不影响召回率
+    :param exact: `{key: [(related_key, score), ...]}`，按相似度降序
+    :param approx: 近似的`NeighborIndex`
+    :param keys: 参与统计的key
+    :param k: 每个key比较前k个近邻
+    """
+    hit, total = 0, 0
+    for key in keys:
+        expected = exact[key][:k]
+        if not expected:
+            continue
+        threshold = expected[-1][1] * (1 - 1e-9)
+        found = sum(1 for _, score in approx.get(key, k) if score >= threshold)
+        hit += min(found, len(expected))
+        total += len(expected)
+    recall = hit / total if total else 1.0
+    logger.info(f"LSH neighbor recall@{k}: {recall:.4f} over {len(keys)} keys")
+    return recall
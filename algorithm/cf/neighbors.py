@@ -0,0 +1,126 @@
+import heapq
+from operator import itemgetter
+
+import numpy as np
+import scipy.sparse as sp
+
+from .keys import KeyIndex
+
+
+class NeighborIndex:
+    """ 截断的近邻索引
+    以CSR形式保存每个key相似度最高的`size`个邻居及其相似度，邻居按相似度降序排列，
+    查询时直接读取对应区间，无需再对整行相似度排序
+    """
+
+    def __init__(self, keys, indptr, indices, scores, size: int, sorter=None):
+        """
+        :param keys: 每一行对应的ID，邻居与行共享同一套ID
+        :param indptr: 第i行的邻居位于`indices[indptr[i]:indptr[i + 1]]`
+        :param indices: 邻居在`keys`中的位置
+        :param scores: 邻居的相似度
+        :param size: 每一行最多保存的邻居数
+        :param sorter: 使`keys`有序的下标，为空时重新计算
+        """
+        self.key_index = keys if isinstance(keys, KeyIndex) else KeyIndex(keys, sorter)
+        self.indptr = np.asarray(indptr)
+        self.indices = np.asarray(indices)
+        self.scores = np.asarray(scores)
+        self.size = size
+
+    @property
+    def keys(self):
+        return self.key_index.keys
+
+    @classmethod
+    def from_dict(cls, sim_dict, size: int):
+        """ 由`{key: {related_key: score}}`构建索引，每行保留相似度最高的`size`个邻居 """
+        keys = list(sim_dict.keys())
+        position = {key: i for i, key in enumerate(keys)}
+
+        indptr, indices, scores = [0], [], []
+        for key in keys:
+            # 与 sorted(..., reverse=True)[:size] 等价，相似度相同时保持原有顺序
+            for related_key, score in heapq.nlargest(size, sim_dict[key].items(), key=itemgetter(1)):
+                indices.append(position[related_key])
+                scores.append(score)
+            indptr.append(len(indices))
+
+        return cls(
+            keys,
+            np.asarray(indptr, dtype=np.int64),
+            np.asarray(indices, dtype=np.int64),
+            np.asarray(scores, dtype=np.float64),
+            size,
+        )
+
+    def __len__(self):
+        return len(self.key_index)
+
+    @property
+    def nbytes(self):
+        """ 近邻数组占用的字节数 """
+        return self.indptr.nbytes + self.indices.nbytes + self.scores.nbytes + getattr(self.keys, "nbytes", 0)
+
+    def __contains__(self, key):
+        return key in self.key_index
+
+    def position(self, key):
+        """ key所在的行号，不存在时返回None """
+        return self.key_index.position(key)
+
+    def get(self, key, n: int = None):
+        """ 与key最相似的n个邻居`[(related_key, score), ...]` """
+        row = self.position(key)
+        if row is None:
+            return []
+        start, end = self.indptr[row], self.indptr[row + 1]
+        if n is not None:
+            end = min(end, start + n)
+        return list(zip(self.keys[self.indices[start:end]].tolist(), self.scores[start:end].tolist()))
+
+    def to_matrix(self, n: int = None):
+        """ 转换为稀疏的近邻矩阵，每一行只保留前n个邻居 """
+        lengths = np.diff(self.indptr)
+        rows = np.repeat(np.arange(len(self.keys)), lengths)
+        indices, scores = self.indices, self.scores
+        if n is not None and n < self.size:
+            rank = np.arange(len(indices)) - np.repeat(self.indptr[:-1], lengths)
+            mask = rank < n
+            rows, indices, scores = rows[mask], indices[mask], scores[mask]
+        return sp.csr_matrix((scores, (rows, indices)), shape=(len(self.keys), len(self.keys)))
+
+    def update_rows(self, sim_dict, rows):
+        """ 根据`sim_dict`重新截取`rows`中各行的邻居，新出现的ID追加在末尾
+        :return: 更新后的新索引，原索引保持不变
+        """
+        keys = self.keys.tolist()
+        position = {key: i for i, key in enumerate(keys)}
+        for key in sim_dict:
+            if key not in position:
+                position[key] = len(keys)
+                keys.append(key)
+
+        changed = np.fromiter((position[key] for key in rows), dtype=np.int64, count=len(rows))
+        new_rows, new_indices, new_scores = [], [], []
+        for key in rows:
+            for related_key, score in heapq.nlargest(self.size, sim_dict[key].items(), key=itemgetter(1)):
+                new_rows.append(position[key])
+                new_indices.append(position[related_key])
+                new_scores.append(score)
+
+        # 保留未变化的行，变化的行整体替换，稳定排序保证行内仍按相似度降序
+        old_rows = np.repeat(np.arange(len(self.indptr) - 1), np.diff(self.indptr))
+        keep = ~np.isin(old_rows, changed)
+        all_rows = np.concatenate([old_rows[keep], np.asarray(new_rows, dtype=np.int64)])
+        order = np.argsort(all_rows, kind="stable")
+        indptr = np.zeros(len(keys) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(all_rows, minlength=len(keys)), out=indptr[1:])
+
+        return NeighborIndex(
+            keys,
+            indptr,
+            np.concatenate([np.asarray(self.indices)[keep], np.asarray(new_indices, dtype=np.int64)])[order],
+            np.concatenate([np.asarray(self.scores)[keep], np.asarray(new_scores, dtype=np.float64)])[order],
+            self.size,
+        )
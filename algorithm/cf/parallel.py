@@ -0,0 +1,97 @@
+""" 多进程分片计算共现矩阵
+把`{篮子: 实体列表}`(ItemCF为用户的物品，UserCF为物品的用户)按计算量切成若干片，
+每个进程只处理自己的分片，得到部分共现矩阵 M_k^T diag(w_k) M_k 和实体计数，
+由于每个篮子的权重只取决于篮子自身的长度，各分片的结果直接相加即为全量结果
+"""
+import multiprocessing
+import os
+from contextlib import nullcontext
+from itertools import chain
+
+import numpy as np
+import scipy.sparse as sp
+from loguru import logger
+
+from .sparse import inverse_log_weights
+
+# fork出的子进程直接继承这些数据，不需要序列化
+_shared = {}
+
+
+def _partial_cooccurrence(bounds):
+    """ 计算一片篮子的部分共现矩阵(去掉对角线)和实体计数 """
+    start, end = bounds
+    baskets, index = _shared["baskets"], _shared["index"]
+
+    indptr, indices = [0], []
+    for basket in baskets[start:end]:
+        indices.extend(index[key] for key in basket)
+        indptr.append(len(indices))
+    dtype = np.int32 if len(index) < 2 ** 31 else np.int64
+    matrix = sp.csr_matrix(
+        (np.ones(len(indices)), np.asarray(indices, dtype=dtype), np.asarray(indptr, dtype=np.int64)),
+        shape=(end - start, len(index)),
+    )
+    matrix.sum_duplicates()
+
+    counts = np.asarray(matrix.sum(axis=0)).ravel()
+    co = (matrix.T @ (sp.diags(inverse_log_weights(matrix)) @ matrix)).tocoo()
+    mask = co.row != co.col
+    return co.row[mask].astype(dtype), co.col[mask].astype(dtype), co.data[mask], counts
+
+
+def shard_bounds(lengths, shards: int):
+    """ 按计算量(篮子长度的平方)把篮子切成连续的若干片
+    :return: `[(start, end), ...]`
+    """
+    cost = np.cumsum(np.asarray(lengths, dtype=np.float64) ** 2)
+    if not len(cost):
+        return []
+    cuts = np.searchsorted(cost, cost[-1] * np.arange(1, shards) / shards, side="right")
+    edges = np.unique(np.concatenate([[0], cuts, [len(cost)]]))
+    return [(int(start), int(end)) for start, end in zip(edges[:-1], edges[1:]) if end > start]
+
+
+def parallel_cooccurrence(basket_dict, workers: int = None, shards_per_worker: int = 4):
+    """ 多进程计算加权共现矩阵，与`cooccurrence_matrix(M, inverse_log_weights(M))`去掉对角线的结果一致
+    :param basket_dict: `{basket: keys}`
+    :param workers: 进程数，默认为CPU核数
+    :param shards_per_worker: 每个进程平均处理的分片数，分片越多负载越均衡
+    :return: (共现矩阵, 每个实体的出现次数, 行列对应的实体ID列表)
+    """
+    workers = workers or os.cpu_count() or 1
+    baskets = list(basket_dict.values())
+    # 实体按首次出现的顺序编码，与`build_interaction_matrix`一致
+    keys = list(dict.fromkeys(chain.from_iterable(baskets)))
+    index = {key: i for i, key in enumerate(keys)}
+    bounds = shard_bounds([len(basket) for basket in baskets], workers * shards_per_worker)
+    logger.info(f"Building co-occurrence of {len(keys)} keys from {len(baskets)} baskets "
+                f"in {len(bounds)} shards on {workers} processes")
+
+    co = sp.csr_matrix((len(keys), len(keys)))
+    counts = np.zeros(len(keys))
+    buffer, buffered = [], 0
+    _shared.update(baskets=baskets, index=index)
+    try:
+        with multiprocessing.get_context("fork").Pool(workers) if workers > 1 else nullcontext() as pool:
+            partials = pool.imap(_partial_cooccurrence, bounds) if pool else map(_partial_cooccurrence, bounds)
+            # 按分片顺序合并，浮点数相加的顺序固定，结果可以复现
+            for row, col, values, partial_counts in partials:
+                counts += partial_counts
+                buffer.append((row, col, values))
+                buffered += len(values)
+                # 缓冲的部分结果超过已合并结果的大小时再合并，合并的总代价与分片数无关
+                if buffered > max(co.nnz, 2 ** 20):
+                    co = co + _merge(buffer, co.shape)
+                    buffer, buffered = [], 0
+    finally:
+        _shared.clear()
+    if buffer:
+        co = co + _merge(buffer, co.shape)
+    return co, counts, keys
+
+
+def _merge(partials, shape):
+    """ 把若干部分结果合并为CSR矩阵，重复的(行, 列)相加 """
+    rows, cols, data = zip(*partials)
+    return sp.csr_matrix((np.concatenate(data), (np.concatenate(rows), np.concatenate(cols))), shape=shape)
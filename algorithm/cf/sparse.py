@@ -0,0 +1,92 @@
+import numpy as np
+import scipy.sparse as sp
+
+
+def build_interaction_matrix(user_item_dict, item_index: dict = None):
+    """ 将`{user: items}`转换为稀疏的用户-物品计数矩阵
+    :param user_item_dict: 用户的历史行为数据
+    :param item_index: 物品ID到列号的映射，为空时按物品首次出现的顺序编码
+    :return: (用户-物品矩阵, 行对应的用户ID列表, 列对应的物品ID列表)
+    """
+    users = list(user_item_dict.keys())
+
+    indptr, indices = [0], []
+    if item_index is None:
+        item_index = {}
+        for user in users:
+            for item in user_item_dict[user]:
+                indices.append(item_index.setdefault(item, len(item_index)))
+            indptr.append(len(indices))
+    else:
+        for user in users:
+            indices.extend(item_index[item] for item in user_item_dict[user])
+            indptr.append(len(indices))
+
+    matrix = sp.csr_matrix(
+        (np.ones(len(indices)), np.asarray(indices, dtype=np.int64), np.asarray(indptr, dtype=np.int64)),
+        shape=(len(users), len(item_index)),
+    )
+    # 同一用户重复交互的物品计数累加
+    matrix.sum_duplicates()
+    return matrix, users, list(item_index)
+
+
+def inverse_log_weights(matrix):
+    """ 每一行的权重`1 / log(1 + 行内交互次数)`，活跃用户(热门物品)的贡献更小 """
+    lengths = np.asarray(matrix.sum(axis=1)).ravel()
+    return np.divide(1.0, np.log1p(lengths), out=np.zeros_like(lengths), where=lengths > 0)
+
+
+def cooccurrence_matrix(matrix, weights=None):
+    """ 加权共现矩阵 C = M^T diag(w) M，去掉对角线
+    :param matrix: 形如`篮子 x 实体`的计数矩阵(ItemCF为用户x物品，UserCF为物品x用户)
+    :param weights: 每个篮子的权重
+    """
+    weighted = matrix if weights is None else sp.diags(weights) @ matrix
+    co = (matrix.T @ weighted).tocoo()
+    mask = co.row != co.col
+    return sp.csr_matrix((co.data[mask], (co.row[mask], co.col[mask])), shape=co.shape)
+
+
+def category_factor(matrix, keys, key2cate, cate_weight=0.8):
+    """ 类别不同的两个实体之间的共现乘以`cate_weight` """
+    codes = {}
+    cates = np.fromiter((codes.setdefault(key2cate.get(key, None), len(codes)) for key in keys),
+                        dtype=np.int64, count=len(keys))
+    matrix = matrix.tocoo()
+    data = matrix.data * np.where(cates[matrix.row] == cates[matrix.col], 1.0, cate_weight)
+    return sp.csr_matrix((data, (matrix.row, matrix.col)), shape=matrix.shape)
+
+
+def normalize_cooccurrence(matrix, counts):
+    """ C_ij / sqrt(N_i * N_j) """
+    matrix = matrix.tocoo()
+    data = matrix.data / np.sqrt(counts[matrix.row] * counts[matrix.col])
+    return sp.csr_matrix((data, (matrix.row, matrix.col)), shape=matrix.shape)
+
+
+def matrix_to_dict(matrix, keys):
+    """ 将方阵转换为`{key: {related_key: score}}`的字典 """
+    matrix = matrix.tocsr()
+    indptr, indices, data = matrix.indptr, matrix.indices, matrix.data
+    result = {}
+    for i, key in enumerate(keys):
+        start, end = indptr[i], indptr[i + 1]
+        result[key] = dict(zip([keys[j] for j in indices[start:end].tolist()], data[start:end].tolist()))
+    return result
+
+
+def topk_rows(matrix, k: int):
+    """ 选出每一行得分最高的k个元素
+    :return: (indptr, indices, data)，第i行的结果按得分降序位于`indices[indptr[i]:indptr[i + 1]]`
+    """
+    matrix = matrix.tocsr()
+    lengths = np.diff(matrix.indptr)
+    rows = np.repeat(np.arange(matrix.shape[0]), lengths)
+    # 先按行、再按得分降序排列，行内的排名小于k的元素即为结果
+    order = np.lexsort((-matrix.data, rows))
+    rank = np.arange(len(order)) - np.repeat(matrix.indptr[:-1], lengths)
+    keep = order[rank < k]
+    indptr = np.zeros(matrix.shape[0] + 1, dtype=np.int64)
+    np.cumsum(np.minimum(lengths, k), out=indptr[1:])
+    return indptr, matrix.indices[keep], matrix.data[keep]
@@ -0,0 +1,338 @@
+""" 内存外的分块构建
+交互记录分块读入(CSV/Parquet/DataFrame迭代器)，整个构建过程中不需要把全部交互放进内存：
+    1.分区：按篮子(ItemCF为用户，UserCF为物品)的哈希值把每块交互写入磁盘上的若干分区，
+      同一个篮子的交互全部落在同一分区，篮子的长度(IUF权重)在分区内即可确定
+    2.累加：逐个分区计算部分共现矩阵并累加，累加结果超过内存预算时排序后写入磁盘
+    3.合并：按行块读取各个溢写文件并相加，归一化后截取每行的前k个邻居，直接写出模型数组
+输出为`artifact`的目录格式，可以用`load_model`加载
+
+    python -m algorithm.cf.streaming interactions.csv model_dir --model ItemCF --user-col user_id --item-col item_id
+"""
+import argparse
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from loguru import logger
+
+from .artifact import _index_dtype, _key_arrays, write_arrays
+from .keys import KeyIndex, as_key_array
+from .sparse import cooccurrence_matrix, inverse_log_weights, topk_rows
+
+
+def read_interactions(source, columns, chunksize: int = 10 ** 6):
+    """ 分块读取交互记录
+    :param source: CSV/Parquet文件路径，或者`DataFrame`的迭代器
+    :param columns: 需要读取的列
+    :param chunksize: 每块的行数
+    """
+    if not isinstance(source, (str, os.PathLike)):
+        for chunk in source:
+            yield chunk[columns]
+        return
+
+    if str(source).endswith((".parquet", ".pq")):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Reading parquet files requires pyarrow: pip install pyarrow")
+        for batch in pq.ParquetFile(source).iter_batches(batch_size=chunksize, columns=columns):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(source, usecols=columns, chunksize=chunksize)
+
+
+class _Encoder:
+    """ 把ID编码为从0开始的连续整数，按首次出现的顺序编号 """
+
+    def __init__(self):
+        self.index = {}
+
+    def __len__(self):
+        return len(self.index)
+
+    def encode(self, values):
+        index = self.index
+        return np.fromiter((index.setdefault(value, len(index)) for value in values.tolist()),
+                           dtype=np.int64, count=len(values))
+
+    @property
+    def keys(self):
+        return list(self.index)
+
+
+class _Partitioner:
+    """ 把交互按键的哈希值写入磁盘分区，每个分区由若干`.npz`分片组成 """
+
+    def __init__(self, directory, partitions: int):
+        self.directory = directory
+        self.partitions = partitions
+        self.pieces = [[] for _ in range(partitions)]
+        self.sizes = np.zeros(partitions, dtype=np.int64)
+        os.makedirs(directory, exist_ok=True)
+
+    def add(self, keys, **columns):
+        """ 按`keys`分区写入一块交互
+        :param keys: 分区键
+        :param columns: 与`keys`等长的数组
+        """
+        if np.issubdtype(keys.dtype, np.integer):
+            buckets = keys % self.partitions
+        else:
+            buckets = pd.util.hash_array(keys) % np.uint64(self.partitions)
+        order = np.argsort(buckets, kind="stable")
+        bounds = np.searchsorted(buckets[order], np.arange(self.partitions + 1))
+        for p in range(self.partitions):
+            rows = order[bounds[p]:bounds[p + 1]]
+            if not len(rows):
+                continue
+            file = os.path.join(self.directory, f"{p}-{len(self.pieces[p])}.npz")
+            np.savez(file, **{name: array[rows] for name, array in columns.items()})
+            self.pieces[p].append(file)
+            self.sizes[p] += len(rows)
+
+    def read(self, p):
+        """ 读取一个分区，分片按写入顺序拼接 """
+        parts = []
+        for file in self.pieces[p]:
+            with np.load(file, allow_pickle=True) as data:
+                parts.append({name: data[name] for name in data.files})
+        if not parts:
+            return None
+        return {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+
+
+class _ArrayWriter:
+    """ 分段写入磁盘的一维数组，完成后以只读memmap读出 """
+
+    def __init__(self, path, dtype):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.length = 0
+        self.file = open(path, "wb")
+
+    def append(self, array):
+        np.ascontiguousarray(array, dtype=self.dtype).tofile(self.file)
+        self.length += len(array)
+
+    def finish(self):
+        self.file.close()
+        if not self.length:
+            return np.zeros(0, dtype=self.dtype)
+        return np.memmap(self.path, dtype=self.dtype, mode="r", shape=(self.length,))
+
+
+class _SpillingAccumulator:
+    """ 在内存预算内累加共现矩阵，超出预算时把当前结果写入磁盘 """
+
+    def __init__(self, size: int, directory, memory_budget: int):
+        self.size = size
+        self.directory = directory
+        self.memory_budget = memory_budget
+        self.matrix = sp.csr_matrix((size, size))
+        self.runs = []
+
+    def add(self, partial):
+        self.matrix = self.matrix + partial
+        if self._nbytes(self.matrix) > self.memory_budget:
+            self.spill()
+
+    @staticmethod
+    def _nbytes(matrix):
+        return matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes
+
+    def spill(self):
+        if not self.matrix.nnz:
+            return
+        run = os.path.join(self.directory, f"run-{len(self.runs)}")
+        os.makedirs(run)
+        for name in ("indptr", "indices", "data"):
+            np.save(os.path.join(run, f"{name}.npy"), getattr(self.matrix, name))
+        logger.info(f"Spilled {self.matrix.nnz} co-occurrence entries to {run}")
+        self.runs.append(run)
+        self.matrix = sp.csr_matrix((self.size, self.size))
+
+    def row_blocks(self):
+        """ 按行块依次给出合并后的共现矩阵，每块的大小不超过内存预算 """
+        if not self.runs:
+            yield 0, self.matrix
+            return
+        self.spill()
+        runs = [{name: np.load(os.path.join(run, f"{name}.npy"), mmap_mode="r")
+                 for name in ("indptr", "indices", "data")} for run in self.runs]
+        # 每个元素按行列下标和数值共约16字节估算
+        nnz = np.sum([run["indptr"] for run in runs], axis=0)
+        start = 0
+        while start < self.size:
+            end = int(np.searchsorted(nnz, nnz[start] + self.memory_budget // 16, side="right")) - 1
+            end = min(max(end, start + 1), self.size)
+            block = sp.csr_matrix((end - start, self.size))
+            for run in runs:
+                lo, hi = run["indptr"][start], run["indptr"][end]
+                block = block + sp.csr_matrix(
+                    (run["data"][lo:hi], run["indices"][lo:hi], run["indptr"][start:end + 1] - lo),
+                    shape=(end - start, self.size),
+                )
+            yield start, block
+            start = end
+
+
+def _basket_matrix(baskets, entities, size):
+    """ 一个分区内`篮子 x 实体`的计数矩阵 """
+    _, rows = np.unique(baskets, return_inverse=True)
+    matrix = sp.csr_matrix((np.ones(len(rows)), (rows, entities)), shape=(rows.max() + 1, size))
+    matrix.sum_duplicates()
+    return matrix
+
+
+def _write_histories(partitioner, item_writer):
+    """ 逐个分区写出用户的历史交互，返回(用户ID数组, indptr, indices) """
+    users, lengths = [], []
+    for p in range(partitioner.partitions):
+        part = partitioner.read(p)
+        if part is None:
+            continue
+        # 分区内按用户稳定排序，同一用户的交互保持原有顺序
+        user_keys, codes = np.unique(part["user"], return_inverse=True)
+        order = np.argsort(codes, kind="stable")
+        users.append(user_keys)
+        lengths.append(np.bincount(codes, minlength=len(user_keys)))
+        item_writer.append(part["item"][order])
+    users = np.concatenate(users) if users else np.zeros(0, dtype=np.int64)
+    indptr = np.zeros(len(users) + 1, dtype=np.int64)
+    if lengths:
+        np.cumsum(np.concatenate(lengths), out=indptr[1:])
+    return users, indptr, item_writer.finish()
+
+
+def build_streaming(source, path, model: str = "ItemCF", user_col: str = "user_id", item_col: str = "item_id",
+                    neighbor_num: int = 50, chunksize: int = 10 ** 6, partitions: int = 64,
+                    memory_budget: int = 1 << 30, item2cate: dict = None, tmp_dir: str = None):
+    """ 分块读取交互记录，在内存预算内构建ItemCF/UserCF并保存为数组格式的模型
+    与内存中构建的`sparse`/`parallel`引擎结果一致，只有相似度相同的邻居之间顺序可能不同
+    :param source: CSV/Parquet文件路径，或者`DataFrame`的迭代器
+    :param path: 模型目录
+    :param model: `ItemCF`或`UserCF`
+    :param neighbor_num: 每一行保存的邻居数
+    :param chunksize: 每次读取的行数
+    :param partitions: 磁盘分区数，每个分区需要能放进内存
+    :param memory_budget: 共现矩阵累加和合并时使用的内存上限(字节)
+    :param item2cate: 物品的类型字典，仅用于ItemCF
+    :param tmp_dir: 临时文件所在目录，默认为系统临时目录
+    """
+    if model not in ("ItemCF", "UserCF"):
+        raise ValueError(f"Unknown model: {model}")
+    workdir = tempfile.mkdtemp(prefix="cf-streaming-", dir=tmp_dir)
+    try:
+        items, users = _Encoder(), _Encoder()
+        item_counts, user_counts = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        # ItemCF以用户为篮子，UserCF以物品为篮子；用户的历史记录总是按用户分区
+        baskets = _Partitioner(os.path.join(workdir, "baskets"), partitions)
+        histories = baskets if model == "ItemCF" else _Partitioner(os.path.join(workdir, "histories"), partitions)
+
+        # 1 分区
+        total = 0
+        for chunk in read_interactions(source, [user_col, item_col], chunksize):
+            chunk = chunk.dropna()
+            item_codes = items.encode(chunk[item_col].to_numpy())
+            item_counts = _grow_bincount(item_counts, item_codes, len(items))
+            user_values = as_key_array(chunk[user_col].to_numpy())
+            if model == "ItemCF":
+                baskets.add(user_values, user=user_values, item=item_codes)
+            else:
+                user_codes = users.encode(user_values)
+                user_counts = _grow_bincount(user_counts, user_codes, len(users))
+                baskets.add(item_codes, basket=item_codes, entity=user_codes)
+                histories.add(user_values, user=user_values, item=item_codes)
+            total += len(chunk)
+        logger.info(f"Partitioned {total} interactions of {len(items)} items into {partitions} partitions")
+        largest = int(baskets.sizes.max()) * 16 if total else 0
+        if largest > memory_budget:
+            logger.warning(f"The largest partition needs about {largest} bytes, more than the memory budget, "
+                           f"consider more partitions")
+
+        if model == "ItemCF":
+            keys, counts, basket_field, entity_field = items.keys, item_counts, "user", "item"
+        else:
+            keys, counts, basket_field, entity_field = users.keys, user_counts, "basket", "entity"
+
+        # 2 累加
+        accumulator = _SpillingAccumulator(len(keys), os.path.join(workdir, "runs"), memory_budget)
+        os.makedirs(accumulator.directory)
+        for p in range(partitions):
+            part = baskets.read(p)
+            if part is None:
+                continue
+            matrix = _basket_matrix(part[basket_field], part[entity_field], len(keys))
+            accumulator.add(cooccurrence_matrix(matrix, inverse_log_weights(matrix)))
+
+        # 3 合并、归一化并截取前k个邻居
+        cates = None
+        if model == "ItemCF" and item2cate:
+            codes = {}
+            cates = np.fromiter((codes.setdefault(item2cate.get(key, None), len(codes)) for key in keys),
+                                dtype=np.int64, count=len(keys))
+        counts = counts.astype(np.float64)
+        neighbor_indptr = [np.zeros(1, dtype=np.int64)]
+        indices_writer = _ArrayWriter(os.path.join(workdir, "neighbor_indices.bin"), _index_dtype(len(keys)))
+        scores_writer = _ArrayWriter(os.path.join(workdir, "neighbor_scores.bin"), np.float64)
+        for start, block in accumulator.row_blocks():
+            block = block.tocoo()
+            rows = block.row + start
+            data = block.data
+            if cates is not None:
+                # 如果二者类别相同相似度更高
+                data = data * np.where(cates[rows] == cates[block.col], 1.0, 0.8)
+            data = data / np.sqrt(counts[rows] * counts[block.col])
+            normalized = sp.csr_matrix((data, (block.row, block.col)), shape=block.shape)
+            indptr, indices, scores = topk_rows(normalized, neighbor_num)
+            neighbor_indptr.append(indptr[1:] + neighbor_indptr[-1][-1])
+            indices_writer.append(indices)
+            scores_writer.append(scores)
+
+        user_keys, history_indptr, history_indices = _write_histories(
+            histories, _ArrayWriter(os.path.join(workdir, "history_indices.bin"), _index_dtype(len(items))))
+
+        neighbor_index = KeyIndex(keys)
+        arrays = {
+            **_key_arrays("neighbor", neighbor_index),
+            "neighbor_indptr": np.concatenate(neighbor_indptr),
+            "neighbor_indices": indices_writer.finish(),
+            "neighbor_scores": scores_writer.finish(),
+            **_key_arrays("user", KeyIndex(user_keys)),
+            "history_indptr": history_indptr,
+            "history_indices": history_indices,
+            **_key_arrays("item", KeyIndex(items.keys)),
+            "item_counts": item_counts,
+        }
+        write_arrays(path, arrays, model, neighbor_num)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _grow_bincount(counts, codes, size):
+    """ 把新一块的计数累加到已有的计数上，编码数增加时扩展数组 """
+    if len(counts) < size:
+        counts = np.concatenate([counts, np.zeros(size - len(counts), dtype=counts.dtype)])
+    counts += np.bincount(codes, minlength=size)
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build an ItemCF/UserCF model from interactions larger than RAM")
+    parser.add_argument("source", help="CSV or Parquet file")
+    parser.add_argument("path", help="model directory")
+    parser.add_argument("--model", choices=("ItemCF", "UserCF"), default="ItemCF")
+    parser.add_argument("--user-col", default="user_id")
+    parser.add_argument("--item-col", default="item_id")
+    parser.add_argument("--neighbor-num", type=int, default=50)
+    parser.add_argument("--chunksize", type=int, default=10 ** 6)
+    parser.add_argument("--partitions", type=int, default=64)
+    parser.add_argument("--memory-budget", type=int, default=1 << 30, help="bytes")
+    parser.add_argument("--tmp-dir", default=None)
+    args = parser.parse_args()
+    build_streaming(args.source, args.path, args.model, args.user_col, args.item_col, args.neighbor_num,
+                    args.chunksize, args.partitions, args.memory_budget, tmp_dir=args.tmp_dir)
@@ -0,0 +1,71 @@
+""" 带时间信息的共现
+    时间衰减：同一用户的两次交互间隔越久，共现的贡献越小，权重为 0.5 ^ (|t_i - t_j| / half_life)
+    长度限制：每个用户只取最近的max_items次交互，或者最后一次交互之前window秒内的交互，
+             每个用户的计算量不超过max_items²，很久以前的长历史不再决定耗时和结果
+"""
+import numpy as np
+import scipy.sparse as sp
+
+
+def recent_history(items, times=None, max_items: int = None, window: float = None):
+    """ 截取用户最近的交互，保持时间顺序
+    :param items: 交互的物品
+    :param times: 每次交互的时间戳(秒)，为空时以列表顺序作为时间顺序
+    :param max_items: 最多保留的交互数
+    :param window: 只保留最后一次交互之前window秒内的交互
+    :return: (物品列表, 时间列表或None)
+    """
+    if times is None:
+        if window is not None:
+            raise ValueError("A time window requires interaction times")
+        return (list(items[-max_items:]) if max_items else list(items)), None
+
+    order = np.argsort(np.asarray(times, dtype=np.float64), kind="stable")
+    times = np.asarray(times, dtype=np.float64)[order]
+    if window is not None and len(times):
+        recent = times >= times[-1] - window
+        order, times = order[recent], times[recent]
+    if max_items:
+        order, times = order[-max_items:], times[-max_items:]
+    return [items[i] for i in order.tolist()], times.tolist()
+
+
+def decay_weights(delta, half_life: float):
+    """ 时间间隔为delta时共现的权重 """
+    return np.power(0.5, np.abs(delta) / half_life)
+
+
+def decayed_cooccurrence(codes, times, lengths, size: int, half_life: float, max_pairs: int = 1 << 24):
+    """ 带时间衰减的加权共现矩阵，与逐用户两两枚举的结果一致
+    每个用户的交互两两展开成物品对，权重为 1 / log(1 + 用户交互数) * 时间衰减，同一物品之间不计
+    :param codes: 按用户依次排列的交互物品编号
+    :param times: 每次交互的时间戳(秒)
+    :param lengths: 每个用户的交互数
+    :param size: 物品数
+    :param half_life: 半衰期(秒)
+    :param max_pairs: 每批展开的物品对上限，控制内存
+    """
+    codes = np.asarray(codes, dtype=np.int64)
+    times = np.asarray(times, dtype=np.float64)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    starts = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=starts[1:])
+    weights = np.divide(1.0, np.log1p(lengths), out=np.zeros(len(lengths)), where=lengths > 0)
+
+    co = sp.csr_matrix((size, size))
+    user = 0
+    while user < len(lengths):
+        # 一批用户展开的物品对不超过max_pairs，至少包含一个用户
+        pairs = np.cumsum(lengths[user:] ** 2)
+        end = user + max(1, int(np.searchsorted(pairs, max_pairs, side="right")))
+        owner = np.repeat(np.arange(user, end), lengths[user:end])
+        first = np.arange(starts[user], starts[end])
+        left = np.repeat(first, lengths[owner])
+        offsets = np.arange(len(left)) - np.repeat(np.cumsum(lengths[owner]) - lengths[owner], lengths[owner])
+        right = starts[np.repeat(owner, lengths[owner])] + offsets
+        keep = codes[left] != codes[right]
+        left, right = left[keep], right[keep]
+        data = weights[np.repeat(owner, lengths[owner])[keep]] * decay_weights(times[left] - times[right], half_life)
+        co = co + sp.csr_matrix((data, (codes[left], codes[right])), shape=(size, size))
+        user = end
+    return co
@@ -1,12 +1,28 @@
 import math
 import os
-import pickle
 from collections import defaultdict
 from operator import itemgetter
 
+import numpy as np
+import scipy.sparse as sp
 from loguru import logger
 from tqdm import tqdm
 
+from ..metrics import metrics, record_model_size
+from ..popularity import RankedCounter
+from .artifact import load_model, save_model
+from .incremental import accumulate_cooccurrence, apply_cooccurrence_delta, new_cooccurrence_delta
+from .lsh import candidate_stats, lsh_candidates, minhash_signatures, neighbor_recall, pair_similarity
+from .neighbors import NeighborIndex
+from .parallel import parallel_cooccurrence
+from .sparse import (
+    build_interaction_matrix,
+    inverse_log_weights,
+    matrix_to_dict,
+    normalize_cooccurrence,
+    topk_rows,
+)
+
 
 class UserCF:
     """ 基于用户的协同过滤
@@ -37,11 +53,15 @@ class UserCF:
         :param user_col: 用户ID所在列名
         :param item_col: 物品ID所在列名
         """
+        self.user_col, self.item_col = user_col, item_col
+
         self.user_set = set()
         self.item_set = set()
         self.user_sim_dict = dict()
+        self.neighbor_index = None
         self.user_interacted_num = defaultdict(int)
         self.item_interacted_num = defaultdict(int)  # 热门推荐时会用到
+        self.popularity = None  # 热门物品索引，第一次召回时由item_interacted_num建立
 
         item_user = data.groupby(item_col)[user_col].apply(list).reset_index()
         self.item_user_dict = dict(zip(item_user[item_col], item_user[user_col]))
@@ -49,8 +69,106 @@ class UserCF:
         user_item = data.groupby(user_col)[item_col].apply(list).reset_index()
         self.user_item_dict = dict(zip(user_item[user_col], user_item[item_col]))
 
-    def calculate_similarity_matrix(self):
-        """ 计算物品相似度 """
+    def calculate_similarity_matrix(self, engine: str = "python", neighbor_num: int = 50, workers: int = None,
+                                    bands: int = 32, rows: int = 4, max_bucket: int = 1000):
+        """ 计算用户相似度，并构建每个用户的近邻索引，参数顺序与`ItemCF.calculate_similarity_matrix`一致
+        :param engine: 计算方式，`python`为逐物品循环，`parallel`为按物品分片的多进程稀疏矩阵运算，
+            `lsh`为MinHash-LSH筛选候选用户后只计算候选之间的相似度(近似)
+        :param neighbor_num: 近邻索引中每个用户保存的相似用户数
+        :param workers: `parallel`使用的进程数，默认为CPU核数
+        :param bands: `lsh`的段数
+        :param rows: `lsh`每段的签名位数
+        :param max_bucket: `lsh`中超过该大小的桶不产生候选
+        """
+        if engine not in ("python", "parallel", "lsh"):
+            raise ValueError(f"Unknown similarity engine: {engine}")
+        self.popularity = None
+        with metrics.timer("UserCF", "similarity"):
+            if engine == "parallel":
+                self._calculate_similarity_matrix_parallel(workers)
+            elif engine == "lsh":
+                self._calculate_similarity_matrix_lsh(bands, rows, max_bucket)
+            else:
+                self._calculate_similarity_matrix()
+        self.build_neighbor_index(neighbor_num)
+
+    def _interaction_matrix(self):
+        """ 用户x物品的计数矩阵及每个物品的权重`1 / log(1 + 交互用户数)` """
+        matrix, users, items = build_interaction_matrix(self.user_item_dict)
+        return matrix, users, items, inverse_log_weights(matrix.T)
+
+    def _calculate_similarity_matrix_lsh(self, bands=32, rows=4, max_bucket=1000, seed=0):
+        """ 只对MinHash-LSH给出的候选用户对计算相似度，候选之外的用户对相似度视为0 """
+        logger.info(f"Calculating User Similarity Matrix (lsh, bands={bands}, rows={rows})")
+        for item, users in self.item_user_dict.items():
+            self.item_set.add(item)
+            self.item_interacted_num[item] += len(users)
+
+        matrix, users, _, weights = self._interaction_matrix()
+        self.user_set.update(users)
+        counts = np.asarray(matrix.sum(axis=1)).ravel()
+        for user, count in zip(users, counts.tolist()):
+            self.user_interacted_num[user] += int(count)
+
+        signatures = minhash_signatures(matrix, bands * rows, seed)
+        left, right, skipped = lsh_candidates(signatures, bands, rows, max_bucket)
+        # 与逐物品循环相同：共现物品的权重之和除以 sqrt(N_u * N_v)
+        scores = pair_similarity(matrix @ sp.diags(weights), matrix, left, right)
+        scores /= np.sqrt(counts[left] * counts[right])
+        keep = scores > 0
+        left, right, scores = left[keep], right[keep], scores[keep]
+        sim = sp.csr_matrix(
+            (np.concatenate([scores, scores]), (np.concatenate([left, right]), np.concatenate([right, left]))),
+            shape=(len(users), len(users)),
+        )
+        self.user_sim_dict = matrix_to_dict(sim, users)
+        self.lsh_stats = {
+            "bands": bands, "rows": rows, "candidate_pairs": int(len(keep)), "similar_pairs": int(len(scores)),
+            "skipped_buckets": skipped, "all_pairs": len(users) * (len(users) - 1) // 2,
+        }
+        logger.info(f"LSH candidates: {self.lsh_stats}")
+
+    def lsh_recall_report(self, sample: int = 1000, k: int = None, seed: int = 0):
+        """ 抽样比较近似近邻与精确近邻，精确近邻只对抽样用户计算
+        :param sample: 抽样的用户数
+        :param k: 比较前k个近邻，默认为近邻索引的大小
+        """
+        k = k or self.neighbor_index.size
+        matrix, users, _, weights = self._interaction_matrix()
+        counts = np.asarray(matrix.sum(axis=1)).ravel()
+        rows = np.sort(np.random.default_rng(seed).choice(len(users), size=min(sample, len(users)), replace=False))
+
+        exact = (matrix[rows] @ sp.diags(weights) @ matrix.T).tocoo()
+        keep = rows[exact.row] != exact.col
+        data = exact.data[keep] / np.sqrt(counts[rows[exact.row[keep]]] * counts[exact.col[keep]])
+        exact = sp.csr_matrix((data, (exact.row[keep], exact.col[keep])), shape=exact.shape)
+        indptr, indices, scores = topk_rows(exact, k)
+        exact_neighbors = {
+            users[row]: [(users[j], score) for j, score in
+                         zip(indices[indptr[i]:indptr[i + 1]].tolist(), scores[indptr[i]:indptr[i + 1]].tolist())]
+            for i, row in enumerate(rows.tolist())
+        }
+        report = dict(getattr(self, "lsh_stats", {}))
+        report.update(sample=len(rows), k=k, recall=neighbor_recall(exact_neighbors, self.neighbor_index,
+                                                                    list(exact_neighbors), k))
+        report["theoretical"] = candidate_stats(report["bands"], report["rows"]) if "bands" in report else {}
+        return report
+
+    def _calculate_similarity_matrix_parallel(self, workers=None):
+        """ 按物品分片，多进程计算部分共现矩阵后合并，结果与逐物品循环一致 """
+        logger.info("Calculating User Similarity Matrix (parallel)")
+        for item, users in self.item_user_dict.items():
+            self.item_set.add(item)
+            self.item_interacted_num[item] += len(users)
+
+        co, counts, users = parallel_cooccurrence(self.item_user_dict, workers)
+        self.user_set.update(users)
+        for user, count in zip(users, counts.tolist()):
+            self.user_interacted_num[user] += int(count)
+
+        self.user_sim_dict = matrix_to_dict(normalize_cooccurrence(co, counts), users)
+
+    def _calculate_similarity_matrix(self):
         logger.info("Calculating User Similarity Matrix")
         for item, users in tqdm(self.item_user_dict.items()):
             self.user_set.update(users)
@@ -70,47 +188,144 @@ class UserCF:
         for i, related_users in tqdm(self.user_sim_dict.items()):
             for j, cij in related_users.items():
                 self.user_sim_dict[i][j] = \
-                    cij / math.sqrt(self.item_interacted_num[i] * self.item_interacted_num[j])
+                    cij / math.sqrt(self.user_interacted_num[i] * self.user_interacted_num[j])
+
+    def update(self, new_interactions):
+        """ 增量更新：只累加新交互带来的共现变化，并只重新归一化受影响的行，结果与全量重新计算一致
+        :param new_interactions: 新的交互数据，`DataFrame`
+        """
+        if self.user_sim_dict is None:
+            raise ValueError("Models loaded from the array format cannot be updated")
+        item_user = new_interactions.groupby(self.item_col)[self.user_col].apply(list).reset_index()
+
+        delta, old_counts = new_cooccurrence_delta(), {}
+        for item, new_users in zip(item_user[self.item_col], item_user[self.user_col]):
+            his_users = self.item_user_dict.get(item, [])
+            users = list(his_users) + list(new_users)
+            # 物品的交互用户变多后，原有共现的权重1 / log(1 + len(users))也随之变小
+            accumulate_cooccurrence(delta, his_users, -1)
+            accumulate_cooccurrence(delta, users, 1)
+            for user in new_users:
+                old_counts.setdefault(user, self.user_interacted_num[user])
+                self.user_interacted_num[user] += 1
+                self.user_sim_dict.setdefault(user, {})
+                self.user_item_dict.setdefault(user, []).append(item)
+            self.item_interacted_num[item] += len(new_users)
+            if self.popularity is not None:
+                self.popularity.add(item, len(new_users))
+            self.item_user_dict[item] = users
+            self.user_set.update(new_users)
+            self.item_set.add(item)
+
+        rows = apply_cooccurrence_delta(self.user_sim_dict, delta, self.user_interacted_num, old_counts)
+        if getattr(self, "neighbor_index", None) is not None:
+            self.neighbor_index = self.neighbor_index.update_rows(self.user_sim_dict, rows | set(old_counts))
+        logger.info(f"Updated UserCF with {len(item_user)} items, {len(rows)} rows renormalised")
+
+    def build_neighbor_index(self, neighbor_num: int = 50):
+        """ 预先截取每个用户相似度最高的`neighbor_num`个用户，召回时不再对相似度整行排序 """
+        with metrics.timer("UserCF", "neighbor_index"):
+            self.neighbor_index = NeighborIndex.from_dict(self.user_sim_dict, neighbor_num)
+        record_model_size(
+            "UserCF", rows=len(self.neighbor_index), neighbors=len(self.neighbor_index.indices),
+            bytes=self.neighbor_index.nbytes,
+        )
+
+    def popular_items(self, topk):
+        """ 交互数最多的topk个物品，索引建立后增量维护，每次召回只需O(topk) """
+        if getattr(self, "popularity", None) is None:
+            self.popularity = RankedCounter.from_counts(self.item_interacted_num)
+        return self.popularity.top(topk)
+
+    def _fill_popular(self, rec_items, seen, topk):
+        """ 用热门物品把推荐结果补足topk个，跳过用户交互过的和已经推荐的物品 """
+        if len(rec_items) >= topk:
+            return rec_items
+        exclude = seen.union(rec_items)
+        popular_items = [item for item in self.popular_items(topk + len(exclude)) if item not in exclude]
+        return rec_items + popular_items[:topk - len(rec_items)]
+
+    def __call__(self, users, n=50, topk=20, hot_fill=False, batch_size=None):
+        """ 物品召回
+        :param batch_size: 不为空时按块批量计算，每块`batch_size`个用户
+        """
+        logger.debug(f"Starting UserCF: ecall@{topk}-Near@{n}")
+        with metrics.timer("UserCF", "popular"):
+            popular_items = self.popular_items(topk)
+        if getattr(self, "neighbor_index", None) is None or self.neighbor_index.size < n:
+            if self.user_sim_dict is None:
+                # 数组格式的模型只保存了近邻索引
+                logger.warning(f"Neighbor index holds {self.neighbor_index.size} neighbors, truncating n={n}")
+            else:
+                # 旧版本缓存中没有近邻索引，或者需要的近邻数超过了索引的大小
+                self.build_neighbor_index(n)
 
-    def __call__(self, users, n=50, topk=20, hot_fill=False):
-        """ 物品召回 """
-        logger.info(f"Starting ItemCF: ecall@{topk}-Near@{n}")
-        popular_items = [val[0] for val in sorted(
-            self.item_interacted_num.items(), key=lambda x: x[1], reverse=True)[:topk]]
+        with metrics.timer("UserCF", "recall"):
+            if batch_size:
+                return self._recommend_batch(users, n, topk, hot_fill, popular_items, batch_size)
+            return self._recommend(users, n, topk, hot_fill, popular_items)
 
+    def _recommend(self, users, n, topk, hot_fill, popular_items):
+        """ 逐用户召回 """
         user_rec = {}
-        for user_id in tqdm(users):
+        for user_id in users:
             # 新用户，直接推荐热门物品
             if user_id not in self.user_set:
                 user_rec[user_id] = popular_items
             else:
                 rank = defaultdict(int)
-                for relate_user, user_smi_score in sorted(
-                        self.user_sim_dict[user_id].items(), key=itemgetter(1), reverse=True)[:n]:
+                seen = set(self.user_item_dict[user_id])
+                for relate_user, user_smi_score in self.neighbor_index.get(user_id, n):
                     for candidate_item in self.user_item_dict[relate_user]:
-                        rank[candidate_item] += user_smi_score
+                        # 用户已经交互过的物品不再推荐
+                        if candidate_item not in seen:
+                            rank[candidate_item] += user_smi_score
 
                 rec_items = [item[0] for item in sorted(rank.items(), key=itemgetter(1), reverse=True)[:topk]]
                 if hot_fill:
                     # 如果推荐的物品不够，用热门物品进行填充
-                    rec_items += popular_items[:topk - len(rec_items)]
+                    rec_items = self._fill_popular(rec_items, seen, topk)
                 user_rec[user_id] = rec_items
 
         return user_rec
 
+    def _recommend_batch(self, users, n, topk, hot_fill, popular_items, batch_size):
+        """ 批量召回，与逐用户召回的结果一致
+        得分矩阵为 S[block] @ H，S为截断到n个邻居的用户近邻矩阵，H为全部用户的历史矩阵
+        """
+        keys = self.neighbor_index.keys.tolist()
+        neighbor_matrix = self.neighbor_index.to_matrix(n)
+        history, _, items = build_interaction_matrix({user_id: self.user_item_dict[user_id] for user_id in keys})
+
+        user_rec = {}
+        known_users = [user_id for user_id in dict.fromkeys(users) if user_id in self.user_set]
+        for start in range(0, len(known_users), batch_size):
+            block = known_users[start:start + batch_size]
+            rows = [self.neighbor_index.position(user_id) for user_id in block]
+            scores = (neighbor_matrix[rows] @ history).tocsr()
+            # 用户已经交互过的物品不再推荐，history的行与近邻索引的行一一对应
+            scores = scores - scores.multiply(history[rows] > 0)
+            scores.eliminate_zeros()
+            indptr, indices, _ = topk_rows(scores, topk)
+            for i, user_id in enumerate(block):
+                rec_items = [items[j] for j in indices[indptr[i]:indptr[i + 1]].tolist()]
+                if hot_fill:
+                    # 如果推荐的物品不够，用热门物品进行填充
+                    rec_items = self._fill_popular(rec_items, set(self.user_item_dict[user_id]), topk)
+                user_rec[user_id] = rec_items
+
+        # 新用户，直接推荐热门物品
+        return {user_id: user_rec.get(user_id, popular_items) for user_id in users}
+
 
-def recommend_by_user_cf(users, data, n=50, topk=20, hot_fill=False, cache_path=None, save=False, **kwargs):
+def recommend_by_user_cf(users, data, n=50, topk=20, hot_fill=False, cache_path=None, save=False,
+                         batch_size=None, engine="python", **kwargs):
     if cache_path and os.path.exists(cache_path):
-        with open(cache_path, 'rb') as file:
-            user_cf = pickle.loads(file.read())
-            file.close()
+        user_cf = load_model(cache_path)
     else:
         user_cf = UserCF(data, **kwargs)
-        user_cf.calculate_similarity_matrix()
+        user_cf.calculate_similarity_matrix(engine=engine)
         if save and cache_path:
-            user_cf_pkl = pickle.dumps(user_cf)
-            output = open(cache_path, 'wb')
-            output.write(user_cf_pkl)
-            output.close()
+            save_model(user_cf, cache_path)
 
-    return user_cf(users, n, topk, hot_fill)
+    return user_cf(users, n, topk, hot_fill, batch_size)
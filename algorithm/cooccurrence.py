@@ -0,0 +1,74 @@
+import numpy as np
+import scipy.sparse as sp
+
+from .cf.sparse import topk_rows
+
+
+class CooccurrenceIndex:
+    """ 向量化的物品共现相似度
+    与逐用户循环一样，物品i和j的相似度为 W[i][j] = C[i][j] / sqrt(N[i] * N[j])，
+    C[i][j]为同时评分过i和j的用户数，N[i]为评分过i的用户数；只计算目标用户评分过的物品所在的行，
+    即评分掩码中这些列的转置与整个评分掩码的乘积，计算都在scipy中完成
+    """
+
+    def __init__(self, matrix, keys, item_keys):
+        """
+        :param matrix: 用户x物品的稀疏评分矩阵
+        :param keys: 每一行对应的用户ID
+        :param item_keys: 每一列对应的物品ID
+        """
+        self.keys = list(keys)
+        self.position = {key: i for i, key in enumerate(self.keys)}
+        self.item_keys = list(item_keys)
+        self.rows = sp.csr_matrix(matrix)
+        self.mask = self.rows.copy()
+        self.mask.data = np.ones_like(self.mask.data)
+        # 按列切片取出目标用户评分过的物品
+        self.mask_columns = self.mask.tocsc()
+        self.counts = np.asarray(self.mask.sum(axis=0)).ravel()
+
+    @classmethod
+    def from_dict(cls, data):
+        """ 由`{user: {item: mark}}`构建 """
+        item_index = {}
+        indptr, indices, marks = [0], [], []
+        for rates in data.values():
+            for item, mark in rates.items():
+                indices.append(item_index.setdefault(item, len(item_index)))
+                marks.append(mark)
+            indptr.append(len(indices))
+        matrix = sp.csr_matrix(
+            (np.asarray(marks, dtype=np.float64), np.asarray(indices, dtype=np.int64), np.asarray(indptr, dtype=np.int64)),
+            shape=(len(data), len(item_index)),
+        )
+        return cls(matrix, data.keys(), item_index)
+
+    def similarity(self, items):
+        """ 物品与所有物品的相似度，每一行对应items中的一个物品，不含物品与自身的相似度 """
+        cooccurrence = (self.mask_columns[:, items].T @ self.mask).tocsr()
+        rows = np.repeat(np.arange(len(items)), np.diff(cooccurrence.indptr))
+        cooccurrence.data = cooccurrence.data / np.sqrt(self.counts[items][rows] * self.counts[cooccurrence.indices])
+        cooccurrence.data[cooccurrence.indices == items[rows]] = 0
+        cooccurrence.eliminate_zeros()
+        return cooccurrence
+
+    def recommend(self, key, n: int = 15, topk: int = 10):
+        """ 对用户评分过的每个物品取相似度最高的n个物品，得分累加 评分 * 相似度
+        :return: `[(item, score), ...]`，不含用户评分过的物品，按得分降序，得分相同时按物品的列顺序
+        """
+        row = self.position.get(key)
+        if row is None:
+            return []
+        start, end = self.rows.indptr[row], self.rows.indptr[row + 1]
+        items, marks = self.rows.indices[start:end], self.rows.data[start:end]
+
+        indptr, indices, scores = topk_rows(self.similarity(items), n)
+        weights = np.repeat(marks, np.diff(indptr)) * scores
+        rank = np.bincount(indices, weights=weights, minlength=len(self.item_keys))
+        # 只保留有近邻得分的物品，用户评分过的物品不推荐
+        candidates = np.zeros(len(self.item_keys), dtype=bool)
+        candidates[indices] = True
+        candidates[items] = False
+        candidates = np.flatnonzero(candidates)
+        candidates = candidates[np.lexsort((candidates, -rank[candidates]))][:topk]
+        return [(self.item_keys[i], float(rank[i])) for i in candidates.tolist()]
@@ -0,0 +1,69 @@
+""" 混合推荐
+多个召回器在同一份评分快照上并发运行，各自的分数归一化到[0, 1]后按权重线性融合：
+    score(i) = Σ w_k * norm_k(i)
+某个召回器没有召回物品i时，该项按0计算
+"""
+import operator
+from concurrent.futures import ThreadPoolExecutor
+
+from loguru import logger
+
+from .metrics import metrics
+
+# 进程内共享的线程池；向量化召回器(`PearsonIndex`、`CooccurrenceIndex`)的主要耗时在numpy/scipy中，
+# 计算期间释放GIL，多核时可以重叠，纯Python的召回器仍然依次执行。见`benchmark.bench_hybrid`
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="hybrid")
+
+
+def normalize_scores(rank_list):
+    """ 把`[(item, score), ...]`的分数线性缩放到[0, 1]，分数全部相同时都记为1 """
+    if not rank_list:
+        return {}
+    scores = [score for _, score in rank_list]
+    low, high = min(scores), max(scores)
+    if high == low:
+        return {item: 1.0 for item, _ in rank_list}
+    return {item: (score - low) / (high - low) for item, score in rank_list}
+
+
+def fuse_scores(rank_lists: dict, weights: dict, topk: int = None):
+    """ 线性融合多个召回列表
+    :param rank_lists: `{name: [(item, score), ...]}`
+    :param weights: `{name: weight}`
+    :param topk: 返回的物品数量，为None时全部返回
+    :return: 按融合分数降序排列的`[(item, score), ...]`
+    """
+    rank = {}
+    for name, rank_list in rank_lists.items():
+        weight = weights.get(name, 0)
+        for item, score in normalize_scores(rank_list).items():
+            rank[item] = rank.get(item, 0) + weight * score
+    return sorted(rank.items(), key=operator.itemgetter(1), reverse=True)[:topk]
+
+
+def _timed_recall(name, recaller):
+    with metrics.timer("hybrid", name):
+        return recaller()
+
+
+def run_recallers(recallers: dict):
+    """ 在线程池中并发运行召回器
+    :param recallers: `{name: callable}`，callable不接收参数并返回`[(item, score), ...]`
+    :return: `{name: [(item, score), ...]}`，出错的召回器返回空列表
+    """
+    futures = {name: _executor.submit(_timed_recall, name, recaller) for name, recaller in recallers.items()}
+    results = {}
+    for name, future in futures.items():
+        try:
+            results[name] = future.result()
+        except Exception as e:
+            logger.exception(f"Recaller {name} failed: {e}")
+            results[name] = []
+    return results
+
+
+def hybrid_recommend(recallers: dict, weights: dict, topk: int = 10):
+    """ 并发召回后线性融合 """
+    rank_lists = run_recallers(recallers)
+    with metrics.timer("hybrid", "fuse"):
+        return fuse_scores(rank_lists, weights, topk)
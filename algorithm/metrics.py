@@ -0,0 +1,128 @@
+""" 推荐链路的分阶段耗时和模型大小
+每个进程各自统计，以Prometheus文本格式输出：
+    recommend_stage_seconds     各阶段耗时的直方图，标签为component和stage
+    recommend_model_size        模型大小，标签为model和kind
+多worker部署时每个worker有自己的计数，由Prometheus按实例采集后汇总
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+# 直方图的上界(秒)
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _labels_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Histogram:
+    """ 累积直方图 """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def render(self, name, key):
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{_format_labels(key, [('le', bound)])} {cumulative}")
+        lines.append(f"{name}_bucket{_format_labels(key, [('le', '+Inf')])} {self.count}")
+        lines.append(f"{name}_sum{_format_labels(key)} {self.sum}")
+        lines.append(f"{name}_count{_format_labels(key)} {self.count}")
+        return lines
+
+
+class Metrics:
+    """ 进程内的指标注册表 """
+
+    def __init__(self):
+        self._histograms = {}  # name -> {labels: Histogram}
+        self._gauges = {}  # name -> {labels: value}
+        self._counters = {}  # name -> {labels: value}
+        self._help = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name, text):
+        self._help[name] = text
+
+    def observe(self, name, value, **labels):
+        key = _labels_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram()
+            histogram.observe(value)
+
+    def set_gauge(self, name, value, **labels):
+        with self._lock:
+            self._gauges.setdefault(name, {})[_labels_key(labels)] = value
+
+    def inc(self, name, value=1, **labels):
+        key = _labels_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    @contextmanager
+    def timer(self, component, stage):
+        """ 记录代码块的耗时到`recommend_stage_seconds{component, stage}` """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe("recommend_stage_seconds", time.perf_counter() - start, component=component, stage=stage)
+
+    def clear(self):
+        with self._lock:
+            self._histograms.clear()
+            self._gauges.clear()
+            self._counters.clear()
+
+    def render(self):
+        """ Prometheus文本格式 """
+        lines = []
+        with self._lock:
+            for kind, families in (("histogram", self._histograms), ("gauge", self._gauges),
+                                   ("counter", self._counters)):
+                for name, series in sorted(families.items()):
+                    if name in self._help:
+                        lines.append(f"# HELP {name} {self._help[name]}")
+                    lines.append(f"# TYPE {name} {kind}")
+                    for key, value in sorted(series.items()):
+                        if kind == "histogram":
+                            lines.extend(value.render(name, key))
+                        else:
+                            lines.append(f"{name}{_format_labels(key)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+metrics.describe("recommend_stage_seconds", "Time spent in each stage of the recommendation pipeline")
+metrics.describe("recommend_model_size", "Size of the loaded recommendation models")
+
+
+def record_model_size(model, **sizes):
+    """ 记录模型大小，例如`record_model_size("ItemCF", rows=..., neighbors=..., bytes=...)` """
+    for kind, value in sizes.items():
+        metrics.set_gauge("recommend_model_size", value, model=model, kind=kind)
@@ -0,0 +1,83 @@
+import numpy as np
+import scipy.sparse as sp
+
+
+class PearsonIndex:
+    """ 向量化的皮尔逊相关系数
+    与逐对计算一样只在两个用户共同评分的物品上求相关系数，所需的各项和
+    n, ΣX, ΣY, ΣXY, ΣX², ΣY² 都可以由评分矩阵、评分掩码和评分平方矩阵与目标用户评分向量的乘积一次得到
+    """
+
+    def __init__(self, matrix, keys):
+        """
+        :param matrix: 用户x物品的稀疏评分矩阵
+        :param keys: 每一行对应的用户ID
+        """
+        self.keys = list(keys)
+        self.position = {key: i for i, key in enumerate(self.keys)}
+        self.rows = sp.csr_matrix(matrix)
+        # 按列切片取出目标用户评分过的物品，保留评分为0的显式元素
+        self.ratings = self.rows.tocsc()
+        self.squares = self.ratings.copy()
+        self.squares.data = self.squares.data ** 2
+        self.mask = self.ratings.copy()
+        self.mask.data = np.ones_like(self.mask.data)
+
+    @classmethod
+    def from_dict(cls, data):
+        """ 由`{user: {item: mark}}`构建 """
+        item_index = {}
+        indptr, indices, marks = [0], [], []
+        for rates in data.values():
+            for item, mark in rates.items():
+                indices.append(item_index.setdefault(item, len(item_index)))
+                marks.append(mark)
+            indptr.append(len(indices))
+        matrix = sp.csr_matrix(
+            (np.asarray(marks, dtype=np.float64), np.asarray(indices, dtype=np.int64), np.asarray(indptr, dtype=np.int64)),
+            shape=(len(data), len(item_index)),
+        )
+        return cls(matrix, data.keys())
+
+    def correlate(self, key):
+        """ 用户与所有用户的皮尔逊相关系数
+        :return: (相关系数数组, 共同评分物品数数组)，没有共同评分或分母为0时相关系数为0
+        """
+        row = self.position[key]
+        start, end = self.rows.indptr[row], self.rows.indptr[row + 1]
+        items, x = self.rows.indices[start:end], self.rows.data[start:end]
+
+        ratings, squares, mask = self.ratings[:, items], self.squares[:, items], self.mask[:, items]
+        n = np.asarray(mask.sum(axis=1)).ravel()
+        sum_x = mask @ x
+        sum_y = np.asarray(ratings.sum(axis=1)).ravel()
+        sum_xy = ratings @ x
+        sum_x2 = mask @ (x ** 2)
+        sum_y2 = np.asarray(squares.sum(axis=1)).ravel()
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            molecule = sum_xy - sum_x * sum_y / n
+            denominator = np.sqrt((sum_x2 - sum_x ** 2 / n) * (sum_y2 - sum_y ** 2 / n))
+            corr = molecule / denominator
+        corr[(n == 0) | ~(denominator > 0)] = 0
+        return corr, n
+
+    def nearest(self, key, n: int = 1, min_common: int = 0):
+        """ 与用户相关系数最高的n个用户`[(user, corr), ...]`，相关系数相同时按用户的原有顺序排列
+        :param min_common: 共同评分物品数少于该值的用户不参与排序
+        """
+        if n <= 0:
+            return []
+        corr, common = self.correlate(key)
+        candidates = np.flatnonzero(common >= min_common)
+        candidates = candidates[candidates != self.position[key]]
+
+        values = corr[candidates]
+        if n < len(candidates):
+            # 用partition找到第n大的相关系数，边界上相关系数相同的用户按原有顺序取
+            threshold = -np.partition(-values, n - 1)[n - 1]
+            above = candidates[values > threshold]
+            ties = candidates[values == threshold][:n - len(above)]
+            candidates = np.concatenate([above, ties])
+        candidates = candidates[np.lexsort((candidates, -corr[candidates]))]
+        return [(self.keys[i], float(corr[i])) for i in candidates.tolist()]
@@ -0,0 +1,330 @@
+""" 热门物品索引
+物品按计数分桶，桶按计数从高到低串成双向链表：
+    计数增减时物品只在相邻的桶之间移动，不需要重新排序
+    取前K个热门物品时从计数最高的桶依次向后遍历，耗时O(K)
+`PopularityIndex`同时维护全量计数和滑动窗口内的计数(趋势)，窗口按时间片划分，过期的时间片整体扣除
+"""
+import math
+import threading
+import time
+from collections import defaultdict
+from itertools import chain
+from operator import itemgetter
+
+from loguru import logger
+
+from .metrics import metrics, record_model_size
+
+
+class _Bucket:
+    __slots__ = ("count", "items", "prev", "next")
+
+    def __init__(self, count):
+        self.count = count
+        self.items = {}  # 作为有序集合使用，同一计数的物品按到达该计数的先后排列
+        self.prev = None
+        self.next = None
+
+
+class RankedCounter:
+    """ 支持增量更新并按计数取前K个的计数器，计数不大于0的物品不保存 """
+
+    def __init__(self):
+        self._head = None  # 计数最高的桶
+        self._tail = None  # 计数最低的桶
+        self._buckets = {}  # {item: bucket}
+
+    @classmethod
+    def from_counts(cls, counts):
+        """ 由`{item: count}`一次性建立，计数相同的物品保持原有顺序 """
+        counter = cls()
+        for item, count in sorted(counts.items(), key=itemgetter(1), reverse=True):
+            if count <= 0:
+                break
+            if counter._tail is None or counter._tail.count != count:
+                counter._link(_Bucket(count), counter._tail, None)
+            counter._tail.items[item] = None
+            counter._buckets[item] = counter._tail
+        return counter
+
+    def __reduce__(self):
+        # 链表很长时逐层序列化会超过递归深度，按计数字典序列化
+        return self.__class__.from_counts, (dict(self.items()),)
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def __contains__(self, item):
+        return item in self._buckets
+
+    def get(self, item, default=0):
+        bucket = self._buckets.get(item)
+        return default if bucket is None else bucket.count
+
+    def items(self):
+        """ 按计数降序遍历`(item, count)` """
+        bucket = self._head
+        while bucket is not None:
+            for item in bucket.items:
+                yield item, bucket.count
+            bucket = bucket.next
+
+    def top(self, k: int):
+        """ 计数最高的k个物品 """
+        result = []
+        bucket = self._head
+        while bucket is not None and len(result) < k:
+            for item in bucket.items:
+                if len(result) == k:
+                    break
+                result.append(item)
+            bucket = bucket.next
+        return result
+
+    def add(self, item, delta: int = 1):
+        """ 物品的计数加上delta，delta可以为负 """
+        bucket = self._buckets.get(item)
+        count = (bucket.count if bucket is not None else 0) + delta
+        if not delta or (bucket is None and count <= 0):
+            return
+
+        if count > 0:
+            if delta > 0:
+                # 从原来的位置向计数更高的方向查找
+                cursor = bucket.prev if bucket is not None else self._tail
+                while cursor is not None and cursor.count < count:
+                    cursor = cursor.prev
+                target = cursor if cursor is not None and cursor.count == count else None
+                prev, next_ = cursor, (cursor.next if cursor is not None else self._head)
+            else:
+                cursor = bucket.next
+                while cursor is not None and cursor.count > count:
+                    cursor = cursor.next
+                target = cursor if cursor is not None and cursor.count == count else None
+                prev, next_ = (cursor.prev if cursor is not None else self._tail), cursor
+            if target is None:
+                target = self._link(_Bucket(count), prev, next_)
+            target.items[item] = None
+            self._buckets[item] = target
+        else:
+            del self._buckets[item]
+
+        if bucket is not None:
+            del bucket.items[item]
+            if not bucket.items:
+                self._unlink(bucket)
+
+    def _link(self, bucket, prev, next_):
+        """ 把桶插入prev和next_之间 """
+        bucket.prev, bucket.next = prev, next_
+        if prev is None:
+            self._head = bucket
+        else:
+            prev.next = bucket
+        if next_ is None:
+            self._tail = bucket
+        else:
+            next_.prev = bucket
+        return bucket
+
+    def _unlink(self, bucket):
+        if bucket.prev is None:
+            self._head = bucket.next
+        else:
+            bucket.prev.next = bucket.next
+        if bucket.next is None:
+            self._tail = bucket.prev
+        else:
+            bucket.next.prev = bucket.prev
+
+
+class PopularityIndex:
+    """ 全量热度和滑动窗口内的趋势热度 """
+
+    def __init__(self, window: float = 7 * 86400, slot: float = 3600, clock=time.time):
+        """
+        :param window: 趋势热度的窗口长度(秒)
+        :param slot: 时间片长度(秒)，趋势热度以时间片为单位过期
+        :param clock: 返回当前时间戳的函数
+        """
+        self.window = window
+        self.slot = slot
+        self.clock = clock
+        self.all_time = RankedCounter()
+        self.trending = RankedCounter()
+        self._slots = {}  # {时间片编号: {item: count}}
+        self._oldest = None  # 窗口内最早的时间片编号
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_events(cls, events, **options):
+        """ 由历史交互一次性建立索引
+        :param events: `(item, timestamp)`的可迭代对象，timestamp为None的交互只计入全量热度
+        """
+        index = cls(**options)
+        index._oldest = index._cutoff(index.clock())
+        all_time = defaultdict(int)
+        for item, timestamp in events:
+            all_time[item] += 1
+            slot = None if timestamp is None else int(timestamp // index.slot)
+            if slot is not None and slot >= index._oldest:
+                index._slots.setdefault(slot, defaultdict(int))[item] += 1
+        trending = defaultdict(int)
+        for counts in index._slots.values():
+            for item, count in counts.items():
+                trending[item] += count
+        index.all_time = RankedCounter.from_counts(all_time)
+        index.trending = RankedCounter.from_counts(trending)
+        return index
+
+    def _cutoff(self, now):
+        """ 窗口内最早的时间片编号 """
+        return int(now // self.slot) - math.ceil(self.window / self.slot) + 1
+
+    def _expire(self, now):
+        cutoff = self._cutoff(now)
+        if self._oldest is None:
+            self._oldest = cutoff
+        while self._oldest < cutoff:
+            for item, count in self._slots.pop(self._oldest, {}).items():
+                self.trending.add(item, -count)
+            self._oldest += 1
+
+    def add(self, item, count: int = 1, timestamp: float = None):
+        """ 记录物品的count次交互
+        :param timestamp: 交互时间，为空时取当前时间，早于窗口的交互只计入全量热度
+        """
+        with self._lock:
+            self.all_time.add(item, count)
+            self._add_trending(item, count, timestamp)
+
+    def remove(self, item, count: int = 1, timestamp: float = None):
+        """ 撤销物品的count次交互，交互所在的时间片已经过期时只从全量热度中扣除 """
+        with self._lock:
+            self.all_time.add(item, -count)
+            self._add_trending(item, -count, timestamp)
+
+    def _add_trending(self, item, count, timestamp):
+        now = self.clock()
+        self._expire(now)
+        slot = int((now if timestamp is None else timestamp) // self.slot)
+        if slot < self._oldest:
+            return
+        counts = self._slots.setdefault(slot, defaultdict(int))
+        if count < 0:
+            # 只能撤销该时间片内已经记录的次数
+            count = -min(-count, counts.get(item, 0))
+        counts[item] += count
+        if counts[item] <= 0:
+            del counts[item]
+        self.trending.add(item, count)
+
+    def top(self, k: int, trending: bool = False):
+        """ 热度最高的k个物品
+        :param trending: 为True时按滑动窗口内的热度排序
+        """
+        with self._lock:
+            if trending:
+                self._expire(self.clock())
+                return self.trending.top(k)
+            return self.all_time.top(k)
+
+    def count(self, item, trending: bool = False):
+        with self._lock:
+            if trending:
+                self._expire(self.clock())
+                return self.trending.get(item)
+            return self.all_time.get(item)
+
+
+class PopularityStore:
+    """ 进程级的热门物品索引
+    第一次读取时从评分表和收藏关系整体加载，此后随评分和收藏的信号增量更新，不再查询数据库
+    """
+
+    def __init__(self, rate_model, item_model, item_field: str, collect_field: str = "collect", **options):
+        """
+        :param rate_model: 评分模型，例如`movie.models.Rate`
+        :param item_model: 物品模型，例如`movie.models.Movie`
+        :param item_field: 评分模型中指向物品的外键名，例如`movie`
+        :param collect_field: 物品模型中收藏者的多对多字段名
+        :param options: `PopularityIndex`的参数
+        """
+        self.rate_model = rate_model
+        self.item_model = item_model
+        self.item_field = item_field
+        self.collect_field = collect_field
+        self.options = options
+        self._index = None
+        self._lock = threading.Lock()
+
+    @property
+    def collect_model(self):
+        return getattr(self.item_model, self.collect_field).through
+
+    def load(self):
+        """ 评分按评分时间计入趋势热度；收藏关系没有时间，加载时只计入全量热度 """
+        label = self.item_model._meta.label_lower
+        with metrics.timer(f"PopularityStore.{label}", "load"):
+            rates = self.rate_model.objects.filter(**{f"{self.item_field}__isnull": False}).values_list(
+                f"{self.item_field}_id", "create_time")
+            collects = self.collect_model.objects.values_list(f"{self.item_model._meta.model_name}_id", flat=True)
+            events = chain(
+                ((item_id, created.timestamp()) for item_id, created in rates.iterator()),
+                ((item_id, None) for item_id in collects.iterator()),
+            )
+            index = PopularityIndex.from_events(events, **self.options)
+        record_model_size(f"PopularityStore.{label}", items=len(index.all_time), trending=len(index.trending))
+        logger.info(f"Loaded popularity index of {self.item_model.__name__}: {len(index.all_time)} items")
+        return index
+
+    def get(self) -> PopularityIndex:
+        if self._index is None:
+            with self._lock:
+                if self._index is None:
+                    self._index = self.load()
+        return self._index
+
+    def top(self, k: int, trending: bool = False):
+        return self.get().top(k, trending)
+
+    def reset(self):
+        """ 丢弃已经加载的索引，下一次读取时从数据库重新加载 """
+        self._index = None
+
+    def on_rate_save(self, sender, instance, created, **kwargs):
+        # 索引还没有加载时不需要处理，加载时会读到这条评分
+        if self._index is not None and created and getattr(instance, f"{self.item_field}_id") is not None:
+            self._index.add(getattr(instance, f"{self.item_field}_id"), timestamp=instance.create_time.timestamp())
+
+    def on_rate_delete(self, sender, instance, **kwargs):
+        if self._index is not None and getattr(instance, f"{self.item_field}_id") is not None:
+            self._index.remove(getattr(instance, f"{self.item_field}_id"), timestamp=instance.create_time.timestamp())
+
+    def on_collect_change(self, sender, instance, action, reverse, pk_set, **kwargs):
+        if self._index is None or action not in ("post_add", "post_remove", "pre_clear"):
+            return
+        if action == "pre_clear":
+            # 清空之前查出将被删除的关系
+            action = "post_remove"
+            if reverse:
+                related = self.item_model.objects.filter(**{self.collect_field: instance})
+            else:
+                related = getattr(instance, self.collect_field).all()
+            pk_set = set(related.values_list("pk", flat=True))
+        # 正向时instance为物品、pk_set为用户，反向时instance为用户、pk_set为物品
+        counts = {instance.pk: len(pk_set)} if not reverse else dict.fromkeys(pk_set, 1)
+        for item_id, count in counts.items():
+            if action == "post_add":
+                self._index.add(item_id, count)
+            else:
+                self._index.remove(item_id, count)
+
+    def connect(self):
+        """ 监听评分的写入、删除和收藏关系的变化 """
+        from django.db.models.signals import m2m_changed, post_delete, post_save
+
+        uid = f"popularity_store_{self.item_model._meta.label_lower}"
+        post_save.connect(self.on_rate_save, sender=self.rate_model, dispatch_uid=uid, weak=False)
+        post_delete.connect(self.on_rate_delete, sender=self.rate_model, dispatch_uid=uid, weak=False)
+        m2m_changed.connect(self.on_collect_change, sender=self.collect_model, dispatch_uid=uid, weak=False)
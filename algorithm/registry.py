@@ -0,0 +1,161 @@
+""" 预热的模型注册表
+启动时构建一次全部模型，之后在后台线程中按计划或在评分变化达到一定次数(去抖)后重新构建，
+构建完成后整体替换当前版本，请求只读取当前版本做打分，不会在请求中构建模型
+"""
+import threading
+import time
+
+from loguru import logger
+
+from .metrics import metrics
+
+
+class ModelVersion:
+    """ 某一版本的全部模型，构建完成后不再修改 """
+
+    def __init__(self, version: int, models: dict, snapshot_version: int, built_at: float, build_seconds: float,
+                 data_version: str = ""):
+        self.version = version
+        self.models = models
+        self.snapshot_version = snapshot_version
+        self.data_version = data_version
+        self.built_at = built_at
+        self.build_seconds = build_seconds
+
+    def info(self):
+        return {
+            "version": self.version,
+            "snapshot_version": self.snapshot_version,
+            "data_version": self.data_version,
+            "built_at": self.built_at,
+            "build_seconds": self.build_seconds,
+            "models": sorted(self.models),
+        }
+
+
+class ModelRegistry:
+    """ 模型注册表 """
+
+    def __init__(self, store, builders: dict, interval: float = 3600, max_changes: int = 100,
+                 debounce: float = 30, poll: float = 1):
+        """
+        :param store: 评分快照存储`RatingStore`
+        :param builders: `{name: builder}`，builder接收评分快照返回训练好的模型
+        :param interval: 定时重新构建的间隔(秒)
+        :param max_changes: 评分变化达到该次数后重新构建
+        :param debounce: 评分变化后需要静默的时间(秒)，避免连续写入时反复构建
+        :param poll: 后台线程检查的间隔(秒)
+        """
+        self.store = store
+        self.builders = builders
+        self.interval = interval
+        self.max_changes = max_changes
+        self.debounce = debounce
+        self.poll = poll
+
+        self._current = None
+        self._changes = 0
+        self._last_change = 0.0
+        self._failed_at = 0.0
+        self._build_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def current(self) -> ModelVersion:
+        """ 当前版本，尚未构建时同步构建一次 """
+        current = self._current
+        if current is None:
+            current = self.build(force=False)
+        return current
+
+    def get(self, name):
+        return self.current.models[name]
+
+    def info(self):
+        current = self._current
+        info = current.info() if current is not None else {"version": 0}
+        info["pending_changes"] = self._changes
+        return info
+
+    def build(self, force: bool = True) -> ModelVersion:
+        """ 构建全部模型并整体替换当前版本
+        :param force: 为False时，如果其他线程已经构建好了版本则直接返回；为True时重新读取评分表
+        """
+        with self._build_lock:
+            if not force and self._current is not None:
+                return self._current
+            changes = self._changes
+            start = time.time()
+            if force:
+                # 批量导入(bulk_create不发送信号)以及其他进程写入的评分不会使本进程的快照过期，
+                # 定时或手动重新构建时总是重新读取评分表
+                self.store.invalidate()
+            snapshot = self.store.get()
+            models = {}
+            for name, builder in self.builders.items():
+                with metrics.timer("ModelRegistry", f"build.{name}"):
+                    models[name] = builder(snapshot)
+            version = ModelVersion(
+                version=(self._current.version + 1) if self._current is not None else 1,
+                models=models,
+                snapshot_version=snapshot.version,
+                built_at=time.time(),
+                build_seconds=time.time() - start,
+                data_version=snapshot.data_version,
+            )
+            # 构建期间发生的变化留给下一次构建
+            self._changes -= changes
+            # 引用赋值是原子的，正在处理的请求继续使用旧版本
+            self._current = version
+            metrics.set_gauge("recommend_model_version", version.version)
+            metrics.set_gauge("recommend_model_built_at", version.built_at)
+        logger.info(f"Built model version {version.version} in {version.build_seconds:.2f}s")
+        return version
+
+    def notify_change(self, *args, **kwargs):
+        """ 评分发生变化 """
+        self._changes += 1
+        self._last_change = time.time()
+
+    def _due(self):
+        current = self._current
+        now = time.time()
+        if now - self._failed_at < self.debounce:
+            return False
+        if current is None or now - current.built_at >= self.interval:
+            return True
+        return self._changes >= self.max_changes and now - self._last_change >= self.debounce
+
+    def _run(self):
+        while not self._stop.wait(self.poll):
+            if not self._due():
+                continue
+            try:
+                self.build()
+            except Exception as e:
+                self._failed_at = time.time()
+                logger.exception(f"Failed to rebuild models, keep serving version {self.info()['version']}: {e}")
+
+    def start(self):
+        """ 同步构建第一个版本并启动后台刷新线程 """
+        if self._current is None:
+            self.build()
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="model-registry", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def connect(self, model):
+        """ 监听评分模型的写入和删除 """
+        from django.db.models.signals import post_delete, post_save
+
+        uid = f"model_registry_{model._meta.label_lower}"
+        post_save.connect(self.notify_change, sender=model, dispatch_uid=uid, weak=False)
+        post_delete.connect(self.notify_change, sender=model, dispatch_uid=uid, weak=False)
@@ -0,0 +1,168 @@
+""" 推荐结果缓存
+缓存键为(user_id, method, n, topk, 模型版本)，模型版本变化后旧结果自然失效；
+用户有新的评分时立即使该用户的全部结果失效
+进程内缓存的失效只作用于处理该次写入的进程，多worker部署时需要使用可以在进程间共享的`django`后端
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResultCache:
+    """ 结果缓存的公共部分：命中/未命中计数 """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()  # 请求线程并发计数，+=不是原子操作
+
+    def get(self, user_id, method, n, topk, version):
+        result = self._get((user_id, method, n, topk, version))
+        with self._stats_lock:
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return result
+
+    def set(self, user_id, method, n, topk, version, result):
+        self._set((user_id, method, n, topk, version), result)
+
+    def invalidate_user(self, user_id):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def _get(self, key):
+        raise NotImplementedError
+
+    def _set(self, key, result):
+        raise NotImplementedError
+
+    def stats(self):
+        with self._stats_lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {"hits": hits, "misses": misses, "hit_rate": hits / total if total else 0.0}
+
+
+class LocalResultCache(ResultCache):
+    """ 进程内的LRU + TTL缓存，多进程部署时每个进程各有一份 """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 300):
+        """
+        :param max_size: 最多缓存的结果数，超出时淘汰最久未使用的结果
+        :param ttl: 结果的有效期(秒)
+        """
+        super().__init__()
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expire_at, result)
+        self._user_keys = {}  # user_id -> {key, ...}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def _set(self, key, result):
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, result)
+            self._entries.move_to_end(key)
+            self._user_keys.setdefault(key[0], set()).add(key)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        self._entries.pop(key, None)
+        keys = self._user_keys.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._user_keys[key[0]]
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            for key in list(self._user_keys.get(user_id, ())):
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._user_keys.clear()
+
+
+class DjangoResultCache(ResultCache):
+    """ 基于Django缓存框架的缓存，可以在多个进程间共享(例如Redis/Memcached)
+    每个用户有一个代数，缓存键中包含代数，用户的评分变化时代数加一，旧的结果不再被读到，由后端按TTL清理
+    """
+
+    def __init__(self, alias: str = "default", ttl: float = 300, prefix: str = "recommend"):
+        """
+        :param alias: `settings.CACHES`中的缓存名
+        :param ttl: 结果的有效期(秒)
+        :param prefix: 缓存键前缀
+        """
+        super().__init__()
+        from django.core.cache import caches
+
+        self.cache = caches[alias]
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def _generation_key(self, user_id):
+        return f"{self.prefix}:gen:{user_id}"
+
+    def _key(self, key):
+        user_id, method, n, topk, version = key
+        generation = self.cache.get(self._generation_key(user_id), 0)
+        return f"{self.prefix}:{user_id}:{generation}:{method}:{n}:{topk}:{version}"
+
+    def _get(self, key):
+        return self.cache.get(self._key(key))
+
+    def _set(self, key, result):
+        self.cache.set(self._key(key), result, self.ttl)
+
+    def invalidate_user(self, user_id):
+        key = self._generation_key(user_id)
+        self.cache.add(key, 0, None)
+        try:
+            self.cache.incr(key)
+        except ValueError:
+            # 代数在add与incr之间被淘汰
+            self.cache.set(key, 1, None)
+
+    def clear(self):
+        self.cache.clear()
+
+
+def build_result_cache(backend: str = "auto", max_size: int = 10000, ttl: float = 300, alias: str = "default",
+                       prefix: str = "recommend") -> ResultCache:
+    """ 按配置创建结果缓存
+    :param backend: `local`、`django`或`auto`，`auto`在多worker部署(环境变量WEB_CONCURRENCY大于1)时使用`django`，
+        否则使用`local`
+    :param max_size: `local`最多缓存的结果数
+    :param ttl: 结果的有效期(秒)
+    :param alias: `django`使用的`settings.CACHES`中的缓存名，多worker时必须是进程间共享的缓存
+    :param prefix: `django`的缓存键前缀
+    """
+    if backend == "auto":
+        backend = "django" if int(os.environ.get("WEB_CONCURRENCY", 1)) > 1 else "local"
+    if backend == "local":
+        return LocalResultCache(max_size, ttl)
+    if backend == "django":
+        return DjangoResultCache(alias, ttl, prefix)
+    raise ValueError(f"Unknown result cache backend: {backend}")
@@ -0,0 +1,305 @@
+""" 全文检索索引
+代替逐行`LIKE '%query%'`的查询，匹配语义与`icontains`一致(查询词是字段的子串)，多个查询词之间为"且"：
+    ngram   进程内的字符n-gram倒排索引，中文不需要分词。查询词的n-gram倒排表求交得到候选，再逐个确认子串
+    fts5    SQLite FTS5虚拟表(trigram分词，需要SQLite 3.34以上)，索引保存在数据库中，多个进程共享
+结果按字段权重排序：查询词出现在权重越高的字段中得分越高，与字段完全相同时得分加倍，同分按ID升序
+"""
+import threading
+from collections import defaultdict
+
+from loguru import logger
+
+from .metrics import metrics, record_model_size
+
+
+def normalize(text):
+    return (text or "").casefold()
+
+
+def query_terms(query):
+    """ 按空白切分查询词，去掉重复 """
+    return list(dict.fromkeys(normalize(query).split()))
+
+
+class SearchIndex:
+    """ 检索索引的公共接口 """
+
+    def __init__(self, fields: dict):
+        """
+        :param fields: `{字段名: 权重}`
+        """
+        self.fields = fields
+
+    def rebuild(self, rows):
+        """ 由`(doc_id, {field: text})`全量重建 """
+        raise NotImplementedError
+
+    def add(self, doc_id, values: dict):
+        """ 写入或更新一个文档 """
+        raise NotImplementedError
+
+    def remove(self, doc_id):
+        raise NotImplementedError
+
+    def search(self, query, limit: int = None):
+        """ 按得分降序返回匹配的文档ID """
+        raise NotImplementedError
+
+
+class NgramSearchIndex(SearchIndex):
+    """ 字符n-gram倒排索引，同时索引单字，长度为1的查询词也能走索引 """
+
+    def __init__(self, fields: dict, n: int = 2):
+        super().__init__(fields)
+        self.n = n
+        self._postings = defaultdict(set)  # {gram: {doc_id}}
+        self._docs = {}  # {doc_id: {field: 归一化后的文本}}，用于确认子串和计算得分
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._docs)
+
+    def grams(self, text):
+        """ 文本中长度为1和n的所有片段，不跨越空白 """
+        grams = set()
+        for token in text.split():
+            grams.update(token)
+            grams.update(token[i:i + self.n] for i in range(len(token) - self.n + 1))
+        return grams
+
+    def _term_grams(self, term):
+        if len(term) < self.n:
+            return {term}
+        return {term[i:i + self.n] for i in range(len(term) - self.n + 1)}
+
+    def rebuild(self, rows):
+        with self._lock:
+            self._postings.clear()
+            self._docs.clear()
+            for doc_id, values in rows:
+                self.add(doc_id, values)
+
+    def add(self, doc_id, values: dict):
+        with self._lock:
+            self.remove(doc_id)
+            doc = {field: normalize(values.get(field)) for field in self.fields}
+            self._docs[doc_id] = doc
+            for gram in set().union(*(self.grams(text) for text in doc.values())):
+                self._postings[gram].add(doc_id)
+
+    def remove(self, doc_id):
+        with self._lock:
+            doc = self._docs.pop(doc_id, None)
+            if doc is None:
+                return
+            for gram in set().union(*(self.grams(text) for text in doc.values())):
+                postings = self._postings.get(gram)
+                if postings is not None:
+                    postings.discard(doc_id)
+                    if not postings:
+                        del self._postings[gram]
+
+    def _candidates(self, term):
+        """ 包含查询词全部n-gram的文档 """
+        postings = []
+        for gram in self._term_grams(term):
+            if gram not in self._postings:
+                return set()
+            postings.append(self._postings[gram])
+        postings.sort(key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            candidates &= posting
+            if not candidates:
+                break
+        return candidates
+
+    def search(self, query, limit: int = None):
+        terms = query_terms(query)
+        if not terms:
+            return []
+        with self._lock:
+            candidates = None
+            for term in sorted(terms, key=len, reverse=True):
+                matched = self._candidates(term)
+                candidates = matched if candidates is None else candidates & matched
+                if not candidates:
+                    return []
+
+            scores = {}
+            for doc_id in candidates:
+                doc, score = self._docs[doc_id], 0
+                for term in terms:
+                    # n-gram只是必要条件，确认查询词确实是某个字段的子串
+                    term_score = sum(weight * (2 if doc[field] == term else 1)
+                                     for field, weight in self.fields.items() if term in doc[field])
+                    if not term_score:
+                        break
+                    score += term_score
+                else:
+                    scores[doc_id] = score
+        return [doc_id for doc_id, _ in sorted(scores.items(), key=lambda x: (-x[1], x[0]))[:limit]]
+
+
+def fts5_available(connection) -> bool:
+    """ 数据库是否为支持trigram分词的SQLite """
+    if connection.vendor != "sqlite":
+        return False
+    with connection.cursor() as cursor:
+        try:
+            cursor.execute("CREATE VIRTUAL TABLE temp.fts5_probe USING fts5(x, tokenize='trigram')")
+            cursor.execute("DROP TABLE temp.fts5_probe")
+        except Exception:
+            return False
+    return True
+
+
+class Fts5SearchIndex(SearchIndex):
+    """ SQLite FTS5虚拟表，rowid即文档ID
+    trigram分词只能索引长度不小于3的查询词，更短的查询词在虚拟表上按LIKE扫描
+    """
+
+    def __init__(self, fields: dict, table: str, alias: str = "default"):
+        super().__init__(fields)
+        self.table = table
+        self.alias = alias
+
+    @property
+    def connection(self):
+        from django.db import connections
+        return connections[self.alias]
+
+    def create(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} "
+                           f"USING fts5({', '.join(self.fields)}, tokenize='trigram')")
+
+    def __len__(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"SELECT count(*) FROM {self.table}")
+            return cursor.fetchone()[0]
+
+    def rebuild(self, rows):
+        from django.db import transaction
+
+        self.create()
+        with transaction.atomic(using=self.alias), self.connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table}")
+            cursor.executemany(
+                f"INSERT INTO {self.table}(rowid, {', '.join(self.fields)}) "
+                f"VALUES (%s{', %s' * len(self.fields)})",
+                [(doc_id, *(normalize(values.get(field)) for field in self.fields)) for doc_id, values in rows],
+            )
+
+    def add(self, doc_id, values: dict):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table} WHERE rowid = %s", [doc_id])
+            cursor.execute(
+                f"INSERT INTO {self.table}(rowid, {', '.join(self.fields)}) "
+                f"VALUES (%s{', %s' * len(self.fields)})",
+                [doc_id, *(normalize(values.get(field)) for field in self.fields)],
+            )
+
+    def remove(self, doc_id):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table} WHERE rowid = %s", [doc_id])
+
+    def search(self, query, limit: int = None):
+        terms = query_terms(query)
+        if not terms:
+            return []
+        conditions, params = [], []
+        phrases = [term for term in terms if len(term) >= 3]
+        if phrases:
+            conditions.append(f"{self.table} MATCH %s")
+            params.append(" AND ".join('"{}"'.format(term.replace('"', '""')) for term in phrases))
+        for term in terms:
+            if len(term) < 3:
+                pattern = "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+                conditions.append("(" + " OR ".join(f"{field} LIKE %s ESCAPE '\\'" for field in self.fields) + ")")
+                params.extend([pattern] * len(self.fields))
+        weights = ", ".join(str(weight) for weight in self.fields.values())
+        order = f"bm25({self.table}, {weights}), rowid" if phrases else "rowid"
+        sql = f"SELECT rowid FROM {self.table} WHERE {' AND '.join(conditions)} ORDER BY {order}"
+        if limit is not None:
+            sql += f" LIMIT {int(limit)}"
+        with self.connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return [row[0] for row in cursor.fetchall()]
+
+
+class SearchStore:
+    """ 进程级的检索索引
+    第一次检索时从模型整体加载，此后随模型的写入和删除增量更新
+    """
+
+    def __init__(self, model, fields: dict, backend: str = "ngram", **kwargs):
+        """
+        :param model: 被检索的模型，例如`movie.models.Movie`
+        :param fields: `{字段名: 权重}`
+        :param backend: `ngram`或`fts5`，数据库不支持FTS5时退回`ngram`
+        :param kwargs: `NgramSearchIndex`的参数
+        """
+        self.model = model
+        self.fields = fields
+        self.backend = backend
+        self.kwargs = kwargs
+        self._index = None
+        self._lock = threading.Lock()
+
+    def rows(self):
+        for doc_id, *values in self.model.objects.values_list("pk", *self.fields).iterator():
+            yield doc_id, dict(zip(self.fields, values))
+
+    def load(self):
+        from django.db import connection
+
+        label = self.model._meta.label_lower
+        with metrics.timer(f"SearchStore.{label}", "load"):
+            if self.backend == "fts5" and fts5_available(connection):
+                index = Fts5SearchIndex(self.fields, table=f"{self.model._meta.db_table}_search")
+                index.create()
+                # 虚拟表保存在数据库中，只有条数与模型不一致时才重建
+                if len(index) != self.model.objects.count():
+                    index.rebuild(self.rows())
+            else:
+                if self.backend not in ("ngram", "fts5"):
+                    raise ValueError(f"Unknown search backend: {self.backend}")
+                if self.backend == "fts5":
+                    logger.warning("SQLite FTS5 with the trigram tokenizer is unavailable, using the ngram index")
+                index = NgramSearchIndex(self.fields, **self.kwargs)
+                index.rebuild(self.rows())
+        record_model_size(f"SearchStore.{label}", documents=len(index))
+        logger.info(f"Loaded {type(index).__name__} of {self.model.__name__}: {len(index)} documents")
+        return index
+
+    def get(self) -> SearchIndex:
+        if self._index is None:
+            with self._lock:
+                if self._index is None:
+                    self._index = self.load()
+        return self._index
+
+    def search(self, query, limit: int = None):
+        return self.get().search(query, limit)
+
+    def reset(self):
+        """ 丢弃已经加载的索引，下一次检索时重新加载 """
+        self._index = None
+
+    def on_save(self, sender, instance, **kwargs):
+        # 索引还没有加载时不需要处理，加载时会读到这条记录
+        if self._index is not None:
+            self._index.add(instance.pk, {field: getattr(instance, field) for field in self.fields})
+
+    def on_delete(self, sender, instance, **kwargs):
+        if self._index is not None:
+            self._index.remove(instance.pk)
+
+    def connect(self):
+        """ 监听模型的写入和删除 """
+        from django.db.models.signals import post_delete, post_save
+
+        uid = f"search_store_{self.model._meta.label_lower}"
+        post_save.connect(self.on_save, sender=self.model, dispatch_uid=uid, weak=False)
+        post_delete.connect(self.on_delete, sender=self.model, dispatch_uid=uid, weak=False)
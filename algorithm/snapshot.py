@@ -0,0 +1,183 @@
+""" 进程内共享的评分快照
+评分表通过一次`values_list`查询整体读入，以紧凑数组保存：
+    user_ids    升序排列的用户ID
+    item_ids    升序排列的物品ID
+    indptr      第i个用户的评分位于`[indptr[i], indptr[i + 1])`
+    items       评分物品在item_ids中的位置
+    marks       评分
+    times       评分时间(Unix时间戳，秒)
+评分表有写入或删除时，通过`post_save`/`post_delete`信号使快照过期，下一次读取时重新加载
+"""
+import threading
+import time
+import zlib
+from functools import cached_property
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from loguru import logger
+
+from .cooccurrence import CooccurrenceIndex
+from .metrics import metrics, record_model_size
+from .pearson import PearsonIndex
+
+
+class RatingSnapshot:
+    """ 某一版本评分表的只读快照 """
+
+    def __init__(self, user_ids, item_ids, marks, version: int = 0, times=None, data_version: str = ""):
+        """ 由逐条评分构建快照，同一用户对同一物品的多条评分只保留最后一条
+        :param user_ids: 每条评分的用户ID
+        :param item_ids: 每条评分的物品ID
+        :param marks: 每条评分的分数
+        :param version: 快照版本
+        :param times: 每条评分的时间戳(秒)，为空时记为0
+        :param data_version: 评分数据的版本标识`条数-最大ID-校验和`，与预计算结果的版本比较
+        """
+        user_ids = np.asarray(user_ids, dtype=np.int64)
+        item_ids = np.asarray(item_ids, dtype=np.int64)
+        marks = np.asarray(marks, dtype=np.float64)
+        times = np.zeros(len(marks)) if times is None else np.asarray(times, dtype=np.float64)
+
+        # 按(用户, 物品, 出现顺序)排序后，每组的最后一条即为最新的评分
+        order = np.lexsort((np.arange(len(user_ids)), item_ids, user_ids))
+        user_ids, item_ids, marks, times = user_ids[order], item_ids[order], marks[order], times[order]
+        last = np.ones(len(order), dtype=bool)
+        last[:-1] = (user_ids[1:] != user_ids[:-1]) | (item_ids[1:] != item_ids[:-1])
+        user_ids, item_ids, marks, times = user_ids[last], item_ids[last], marks[last], times[last]
+
+        self.user_ids, user_codes = np.unique(user_ids, return_inverse=True)
+        self.item_ids, self.items = np.unique(item_ids, return_inverse=True)
+        self.indptr = np.zeros(len(self.user_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(user_codes, minlength=len(self.user_ids)), out=self.indptr[1:])
+        self.marks = marks
+        self.times = times
+        self.version = version
+        self.data_version = data_version
+        self.loaded_at = time.time()
+
+    def __len__(self):
+        return len(self.marks)
+
+    def user_position(self, user_id):
+        """ 用户所在的行，没有评分的用户返回None """
+        i = np.searchsorted(self.user_ids, user_id)
+        if i < len(self.user_ids) and self.user_ids[i] == user_id:
+            return int(i)
+        return None
+
+    def user_ratings(self, user_id):
+        """ 用户的评分`{item_id: mark}` """
+        i = self.user_position(user_id)
+        if i is None:
+            return {}
+        start, end = self.indptr[i], self.indptr[i + 1]
+        return dict(zip(self.item_ids[self.items[start:end]].tolist(), self.marks[start:end].tolist()))
+
+    @cached_property
+    def user_dict(self):
+        """ `{user_id: {item_id: mark}}`，同一版本的快照只构建一次，调用方不应修改 """
+        users = self.user_ids.tolist()
+        items = self.item_ids[self.items].tolist()
+        marks = self.marks.tolist()
+        indptr = self.indptr.tolist()
+        return {user: dict(zip(items[indptr[i]:indptr[i + 1]], marks[indptr[i]:indptr[i + 1]]))
+                for i, user in enumerate(users)}
+
+    def to_csr(self):
+        """ 用户x物品的稀疏评分矩阵，行列分别对应`user_ids`和`item_ids` """
+        return sp.csr_matrix((self.marks, self.items, self.indptr), shape=(len(self.user_ids), len(self.item_ids)))
+
+    @cached_property
+    def pearson_index(self):
+        """ 向量化皮尔逊相关系数的索引，行顺序与`user_dict`一致 """
+        return PearsonIndex(self.to_csr(), self.user_ids.tolist())
+
+    @cached_property
+    def cooccurrence_index(self):
+        """ 向量化物品共现相似度的索引 """
+        return CooccurrenceIndex(self.to_csr(), self.user_ids.tolist(), self.item_ids.tolist())
+
+    def to_frame(self, user_col="user_id", item_col="item_id", mark_col="mark", time_col="time"):
+        """ 转换为`algorithm.cf`使用的`DataFrame` """
+        return pd.DataFrame({
+            user_col: np.repeat(self.user_ids, np.diff(self.indptr)),
+            item_col: self.item_ids[self.items],
+            mark_col: self.marks,
+            time_col: self.times,
+        })
+
+
+class RatingStore:
+    """ 评分快照的进程级存储
+    读取时如果快照已经过期则重新加载，加载只有一次`values_list`查询，不会逐条访问外键
+    """
+
+    def __init__(self, model, item_field: str):
+        """
+        :param model: 评分模型，例如`movie.models.Rate`
+        :param item_field: 评分模型中指向物品的外键名，例如`movie`
+        """
+        self.model = model
+        self.item_field = item_field
+        self.version = 0
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+    def load(self, version: int):
+        with metrics.timer(f"RatingStore.{self.model._meta.label_lower}", "load"):
+            rows = list(self.model.objects.filter(
+                user__isnull=False, **{f"{self.item_field}__isnull": False}
+            ).order_by("pk").values_list("pk", "user_id", f"{self.item_field}_id", "mark", "create_time"))
+            pks, user_ids, item_ids, marks, times = zip(*rows) if rows else ((), (), (), (), ())
+            # 版本标识由读到的评分计算，与快照的内容严格对应，读取期间的写入不会被误算进来
+            snapshot = RatingSnapshot(user_ids, item_ids, marks, version, [created.timestamp() for created in times],
+                                      self.data_version(pks, user_ids, item_ids, marks))
+        record_model_size(
+            f"RatingSnapshot.{self.model._meta.label_lower}", ratings=len(snapshot),
+            users=len(snapshot.user_ids), items=len(snapshot.item_ids),
+        )
+        logger.info(f"Loaded rating snapshot v{version} of {self.model.__name__}: {len(snapshot)} ratings")
+        return snapshot
+
+    def get(self) -> RatingSnapshot:
+        """ 当前版本的快照 """
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.version == self.version:
+            return snapshot
+        with self._lock:
+            version = self.version
+            if self._snapshot is None or self._snapshot.version != version:
+                self._snapshot = self.load(version)
+            return self._snapshot
+
+    def invalidate(self, *args, **kwargs):
+        """ 评分表发生变化，下一次读取时重新加载 """
+        self.version += 1
+
+    def stamp(self):
+        """ 评分表的(条数, 最大ID)，收不到写入信号的进程据此判断评分表是否变化 """
+        from django.db.models import Count, Max
+
+        stats = self.model.objects.aggregate(count=Count("pk"), last=Max("pk"))
+        return stats["count"], stats["last"] or 0
+
+    @staticmethod
+    def data_version(pks, user_ids, item_ids, marks):
+        """ 评分数据的版本标识`条数-最大ID-校验和`
+        只看条数和最大ID时，原地修改评分(例如用户改分)不会改变版本标识；
+        校验和为每条评分的ID、用户、物品和分数的CRC32，评分有增删或修改时都会变化
+        """
+        checksum = 0
+        for values, dtype in ((pks, np.int64), (user_ids, np.int64), (item_ids, np.int64), (marks, np.float64)):
+            checksum = zlib.crc32(np.asarray(values, dtype=dtype).tobytes(), checksum)
+        return f"{len(pks)}-{max(pks, default=0)}-{checksum:08x}"
+
+    def connect(self):
+        """ 监听评分模型的写入和删除 """
+        from django.db.models.signals import post_delete, post_save
+
+        uid = f"rating_store_{self.model._meta.label_lower}"
+        post_save.connect(self.invalidate, sender=self.model, dispatch_uid=uid, weak=False)
+        post_delete.connect(self.invalidate, sender=self.model, dispatch_uid=uid, weak=False)
@@ -0,0 +1,3 @@
+""" 性能基准测试
+    python -m benchmark --scales 1e3 1e4 1e5 --output bench.json
+"""
@@ -0,0 +1,95 @@
+""" 运行基准测试并把结果写入JSON
+    python -m benchmark --scales 1e3 1e4 1e5 1e6 --output bench.json
+    python -m benchmark --scales 1e4 --view    # 同时测试Django接口，需要DJANGO_SETTINGS_MODULE
+    python -m benchmark --scales 1e6 --db --engines item_cf_sparse    # 评分表索引和SQLite参数调优前后的对比
+    python -m benchmark --scales 1e5 --hybrid --engines item_cf_sparse    # 混合推荐中召回器串行与并发的延迟
+"""
+import argparse
+import json
+import os
+import platform
+import time
+
+# tqdm在导入时读取环境变量，基准测试中不输出进度条
+os.environ.setdefault("TQDM_DISABLE", "1")
+
+from loguru import logger
+
+from .bench_cf import ENGINES, bench_cf
+from .bench_db import bench_db
+from .bench_hybrid import bench_hybrid
+from .datagen import zipf_interactions
+from .measure import timed
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the CF engines and the recommend endpoint")
+    parser.add_argument("--scales", nargs="+", type=float, default=[1e3, 1e4, 1e5],
+                        help="number of interactions, from 1e3 to 1e7")
+    parser.add_argument("--engines", nargs="+", choices=list(ENGINES), default=None)
+    parser.add_argument("--queries", type=int, default=1000, help="sampled users per query benchmark")
+    parser.add_argument("--n", type=int, default=50)
+    parser.add_argument("--topk", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=1024)
+    parser.add_argument("--python-limit", type=float, default=1e6,
+                        help="skip the pure Python engines above this many interactions")
+    parser.add_argument("--user-alpha", type=float, default=0.8)
+    parser.add_argument("--item-alpha", type=float, default=1.1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--view", action="store_true", help="also benchmark the RecommedMovie view")
+    parser.add_argument("--db", action="store_true",
+                        help="also compare rating-table query plans and latencies before/after the indexes")
+    parser.add_argument("--hybrid", action="store_true",
+                        help="also compare sequential and concurrent recaller latency of the hybrid recommender")
+    parser.add_argument("--output", default="bench.json")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    # 基准测试中不输出每次召回的日志
+    logger.disable("algorithm")
+    if args.view:
+        import django
+
+        os.environ.setdefault("DJANGO_SETTINGS_MODULE", "recommend.settings")
+        django.setup()
+        logger.disable("movie")
+        from .bench_view import bench_view
+
+    report = {
+        "created_at": time.time(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "args": vars(args),
+        "runs": [],
+    }
+    for scale in args.scales:
+        data, generate_seconds = timed(
+            zipf_interactions, int(scale), user_alpha=args.user_alpha, item_alpha=args.item_alpha, seed=args.seed)
+        run = {
+            # 实际条数可能少于请求的规模，结果以实际条数为准
+            "requested_interactions": int(scale),
+            "interactions": len(data),
+            "users": int(data["user_id"].nunique()),
+            "items": int(data["item_id"].nunique()),
+            "generate_seconds": generate_seconds,
+            "cf": bench_cf(data, args.engines, args.queries, args.n, args.topk, args.batch_size,
+                           int(args.python_limit), args.seed),
+        }
+        if args.view:
+            run["view"] = bench_view(data, args.queries, args.topk, args.seed)
+        if args.db:
+            run["db"] = bench_db(data, args.queries, seed=args.seed)
+        if args.hybrid:
+            run["hybrid"] = bench_hybrid(data, args.queries, seed=args.seed)
+        report["runs"].append(run)
+        # 每个规模结束后写一次，长时间运行中断时保留已有结果
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+        logger.info(f"Finished {len(data)} interactions, results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+""" `algorithm.cf`中各引擎的构建耗时、峰值内存、单用户查询延迟和吞吐量
+每个引擎在fork出的子进程中运行，峰值内存互不影响
+"""
+import multiprocessing
+
+import numpy as np
+from loguru import logger
+
+from algorithm.cf.item_cf import ItemCF
+from algorithm.cf.user_cf import UserCF
+from .measure import latency_stats, peak_rss, reset_peak_rss, timed
+
+
+def build_item_cf_python(data):
+    item_cf = ItemCF(data, user_col="user_id", item_col="item_id")
+    item_cf.calculate_similarity_matrix(engine="python")
+    return item_cf
+
+
+def build_item_cf_sparse(data):
+    item_cf = ItemCF(data, user_col="user_id", item_col="item_id")
+    item_cf.calculate_similarity_matrix(engine="sparse")
+    return item_cf
+
+
+def build_item_cf_parallel(data):
+    item_cf = ItemCF(data, user_col="user_id", item_col="item_id")
+    item_cf.calculate_similarity_matrix(engine="parallel")
+    return item_cf
+
+
+def build_user_cf(data):
+    user_cf = UserCF(data, user_col="user_id", item_col="item_id")
+    user_cf.calculate_similarity_matrix()
+    return user_cf
+
+
+def build_user_cf_parallel(data):
+    user_cf = UserCF(data, user_col="user_id", item_col="item_id")
+    user_cf.calculate_similarity_matrix(engine="parallel")
+    return user_cf
+
+
+def build_user_cf_lsh(data):
+    user_cf = UserCF(data, user_col="user_id", item_col="item_id")
+    user_cf.calculate_similarity_matrix(engine="lsh")
+    return user_cf
+
+
+ENGINES = {
+    "item_cf_python": build_item_cf_python,
+    "item_cf_sparse": build_item_cf_sparse,
+    "item_cf_parallel": build_item_cf_parallel,
+    "user_cf": build_user_cf,
+    "user_cf_parallel": build_user_cf_parallel,
+    "user_cf_lsh": build_user_cf_lsh,
+}
+# 逐行Python循环的引擎，数据量超过限制时跳过
+PYTHON_ENGINES = {"item_cf_python", "user_cf"}
+
+
+def _run_engine(name, data, users, n, topk, batch_size):
+    baseline = peak_rss()
+    reset_peak_rss()
+    model, build_seconds = timed(ENGINES[name], data)
+    build_peak = peak_rss()
+
+    latencies = [timed(model, [user_id], n, topk, True)[1] for user_id in users]
+    _, batch_seconds = timed(model, users, n, topk, True, batch_size)
+    return {
+        "build_seconds": build_seconds,
+        "peak_rss_mb": build_peak,
+        "build_rss_mb": build_peak - baseline,
+        "query": latency_stats(latencies),
+        "query_throughput": len(users) / sum(latencies) if latencies else 0.0,
+        "batch_throughput": len(users) / batch_seconds if batch_seconds else 0.0,
+    }
+
+
+def bench_engine(name, data, users, n=50, topk=20, batch_size=1024):
+    """ 在子进程中构建模型并查询
+    :param users: 查询的用户
+    :param batch_size: 批量查询时每块的用户数
+    """
+    # 不使用进程池：进程池的子进程不能再创建`parallel`引擎需要的子进程
+    context = multiprocessing.get_context("fork")
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_send_result, args=(sender, name, data, users, n, topk, batch_size))
+    process.start()
+    sender.close()
+    try:
+        result = receiver.recv()
+    except EOFError:
+        result = {"error": "benchmark process exited unexpectedly"}
+    process.join()
+    return result
+
+
+def _send_result(sender, *args):
+    try:
+        sender.send(_run_engine(*args))
+    except Exception as e:
+        sender.send({"error": repr(e)})
+
+
+def bench_cf(data, engines=None, queries=1000, n=50, topk=20, batch_size=1024, python_limit=10 ** 6, seed=0):
+    """ 对每个引擎运行基准测试
+    :param engines: 引擎名列表，默认全部
+    :param queries: 抽样查询的用户数
+    :param python_limit: 评分条数超过该值时跳过逐行Python循环的引擎
+    """
+    all_users = data["user_id"].unique()
+    users = np.random.default_rng(seed).choice(all_users, size=min(queries, len(all_users)), replace=False).tolist()
+
+    results = {}
+    for name in engines or ENGINES:
+        if name in PYTHON_ENGINES and len(data) > python_limit:
+            results[name] = {"skipped": f"{len(data)} interactions exceed python_limit={python_limit}"}
+            continue
+        logger.info(f"Benchmarking {name} on {len(data)} interactions")
+        results[name] = bench_engine(name, data, users, n, topk, batch_size)
+    return results
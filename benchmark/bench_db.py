@@ -0,0 +1,162 @@
+""" 评分表的索引与SQLite参数的基准测试
+在临时文件中分别建立两份`movie_rate`表并写入同样的合成评分：
+    before  只有外键索引(user_id、movie_id)，SQLite默认参数
+    after   增加(user_id, movie_id)唯一索引和create_time索引，使用调优后的PRAGMA
+输出每个查询的执行计划和延迟，以及写入吞吐量
+"""
+import os
+import sqlite3
+import tempfile
+
+import numpy as np
+from loguru import logger
+
+from .measure import latency_stats, timed
+
+# 与settings.SQLITE_PRAGMAS相同
+TUNED_PRAGMAS = {
+    "journal_mode": "wal",
+    "synchronous": "normal",
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -64000,
+    "temp_store": "memory",
+}
+
+# 与迁移生成的表结构一致
+SCHEMA = """
+CREATE TABLE "movie_rate" (
+    "id" integer NOT NULL PRIMARY KEY AUTOINCREMENT,
+    "mark" real NOT NULL,
+    "create_time" datetime NOT NULL,
+    "movie_id" bigint NULL,
+    "user_id" bigint NULL
+);
+CREATE INDEX "movie_rate_movie_id" ON "movie_rate" ("movie_id");
+CREATE INDEX "movie_rate_user_id" ON "movie_rate" ("user_id");
+"""
+
+INDEXES = """
+CREATE UNIQUE INDEX "unique_user_movie_rate" ON "movie_rate" ("user_id", "movie_id");
+CREATE INDEX "movie_rate_create_time_idx" ON "movie_rate" ("create_time");
+"""
+
+QUERIES = {
+    # 某个用户的全部评分
+    "user_history": "SELECT movie_id, mark FROM movie_rate WHERE user_id = ?",
+    # 用户对某部电影的评分，`get_or_create`和评分更新走这条查询
+    "user_movie": "SELECT id, mark FROM movie_rate WHERE user_id = ? AND movie_id = ?",
+    # 最近一段时间的评分，趋势热度和按时间切分的评估走这条查询
+    "recent": "SELECT movie_id, create_time FROM movie_rate WHERE create_time >= ?",
+}
+
+# 评分快照的全表读取
+SNAPSHOT_QUERY = ("SELECT user_id, movie_id, mark, create_time FROM movie_rate "
+                  "WHERE user_id IS NOT NULL AND movie_id IS NOT NULL ORDER BY id")
+
+
+def connect(path, pragmas=None):
+    conn = sqlite3.connect(path, isolation_level=None)
+    for name, value in (pragmas or {}).items():
+        conn.execute(f"PRAGMA {name} = {value}")
+    return conn
+
+
+def rate_rows(data, start: float = 1.6e9, span: float = 365 * 86400, seed: int = 0):
+    """ 合成评分的行，评分时间在[start, start + span)内按插入顺序递增 """
+    rng = np.random.default_rng(seed)
+    times = np.sort(start + rng.random(len(data)) * span)
+    created = np.datetime_as_string(times.astype("datetime64[us]"), unit="us")
+    return list(zip(data["mark"].tolist(), np.char.replace(created, "T", " ").tolist(),
+                    data["item_id"].tolist(), data["user_id"].tolist()))
+
+
+def populate(conn, rows, batch_size: int = 10000):
+    """ 分批写入，每批一个事务，返回写入吞吐量(行/秒) """
+    def insert():
+        for start in range(0, len(rows), batch_size):
+            conn.execute("BEGIN")
+            conn.executemany(
+                "INSERT INTO movie_rate (mark, create_time, movie_id, user_id) VALUES (?, ?, ?, ?)",
+                rows[start:start + batch_size])
+            conn.execute("COMMIT")
+
+    _, seconds = timed(insert)
+    return len(rows) / seconds if seconds else 0.0
+
+
+def single_inserts(conn, rows):
+    """ 逐条提交的写入吞吐量(行/秒)，与接口中逐条保存评分的方式一致 """
+    def insert():
+        for row in rows:
+            conn.execute("INSERT INTO movie_rate (mark, create_time, movie_id, user_id) VALUES (?, ?, ?, ?)", row)
+
+    _, seconds = timed(insert)
+    return len(rows) / seconds if seconds else 0.0
+
+
+def query_plans(conn, params):
+    """ 每个查询的`EXPLAIN QUERY PLAN` """
+    plans = {name: [row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params[name][0])]
+             for name, sql in QUERIES.items()}
+    plans["snapshot"] = [row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {SNAPSHOT_QUERY}")]
+    return plans
+
+
+def query_latencies(conn, params, snapshot_repeats: int = 3):
+    results = {}
+    for name, sql in QUERIES.items():
+        latencies = []
+        for args in params[name]:
+            _, seconds = timed(lambda: conn.execute(sql, args).fetchall())
+            latencies.append(seconds)
+        results[name] = latency_stats(latencies)
+    results["snapshot"] = latency_stats(
+        [timed(lambda: conn.execute(SNAPSHOT_QUERY).fetchall())[1] for _ in range(snapshot_repeats)])
+    return results
+
+
+def bench_variant(path, rows, params, indexes: bool, pragmas, inserts):
+    conn = connect(path, pragmas)
+    try:
+        conn.executescript(SCHEMA + (INDEXES if indexes else ""))
+        insert_throughput = populate(conn, rows)
+        conn.execute("ANALYZE")
+        results = {
+            "pragmas": {name: conn.execute(f"PRAGMA {name}").fetchone()[0] for name in TUNED_PRAGMAS},
+            "bulk_insert_rows_per_second": insert_throughput,
+            "plans": query_plans(conn, params),
+            "queries": query_latencies(conn, params),
+            "single_insert_rows_per_second": single_inserts(conn, inserts),
+            "file_mb": os.path.getsize(path) / 2 ** 20,
+        }
+    finally:
+        conn.close()
+    return results
+
+
+def bench_db(data, queries: int = 1000, inserts: int = 200, pragmas: dict = None, seed: int = 0):
+    """ 在同样的数据上比较加索引和调优参数之前与之后的执行计划、查询延迟和写入吞吐量
+    :param data: 合成评分，`zipf_interactions`的结果
+    :param queries: 每个查询采样的参数组数
+    :param inserts: 逐条提交写入的评分数
+    :param pragmas: 调优后的PRAGMA，默认为`TUNED_PRAGMAS`
+    """
+    rows = rate_rows(data, seed=seed)
+    rng = np.random.default_rng(seed)
+    sample = rng.choice(len(rows), size=min(queries, len(rows)), replace=False)
+    params = {
+        "user_history": [(rows[i][3],) for i in sample],
+        "user_movie": [(rows[i][3], rows[i][2]) for i in sample],
+        # 最近1%的评分，每次返回的行数较多，重复次数少一些
+        "recent": [(rows[int(len(rows) * 0.99)][1],)] * min(len(sample), 100),
+    }
+    new_rows = [(float(mark), created, item, user + 10 ** 9)
+                for mark, created, item, user in (rows[i] for i in rng.choice(len(rows), size=inserts))]
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, indexes, variant_pragmas in (("before", False, None), ("after", True, pragmas or TUNED_PRAGMAS)):
+            logger.info(f"Benchmarking rating table ({name}) with {len(rows)} rows")
+            results[name] = bench_variant(os.path.join(tmp, f"{name}.sqlite3"), rows, params, indexes,
+                                          variant_pragmas, new_rows)
+    return results
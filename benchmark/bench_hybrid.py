@@ -0,0 +1,50 @@
+""" 混合推荐中召回器串行与并发运行的延迟对比
+两个召回器与`movie.algorithm.mixtrue`相同：向量化皮尔逊近邻(user_cf)和向量化物品共现(item_cf)，
+在同一份评分快照上分别逐个运行和通过`algorithm.hybrid.run_recallers`在线程池中并发运行；
+两者的主要耗时在numpy/scipy中，计算期间释放GIL，只有多核时并发才能缩短延迟
+"""
+import os
+
+import numpy as np
+
+from algorithm.hybrid import run_recallers
+from algorithm.snapshot import RatingSnapshot
+from .measure import latency_stats, timed
+
+
+def _recallers(snapshot, user_id, n, topk):
+    pearson_index, cooccurrence_index = snapshot.pearson_index, snapshot.cooccurrence_index
+    return {
+        "user_cf": lambda: pearson_index.nearest(user_id, n),
+        "item_cf": lambda: cooccurrence_index.recommend(user_id, n, topk),
+    }
+
+
+def bench_hybrid(data, queries=200, n=15, topk=10, seed=0):
+    """ 对抽样用户逐个测量每个召回器、串行和并发运行的延迟
+    :param data: 包含`user_id`、`item_id`的`DataFrame`，没有`mark`列时随机生成1到5分
+    :param queries: 抽样的用户数
+    """
+    rng = np.random.default_rng(seed)
+    marks = data["mark"] if "mark" in data else rng.integers(1, 6, len(data))
+    snapshot = RatingSnapshot(data["user_id"], data["item_id"], marks)
+    # 索引在第一次使用时构建，不计入延迟
+    _, index_seconds = timed(lambda: (snapshot.pearson_index, snapshot.cooccurrence_index))
+
+    users = rng.choice(snapshot.user_ids, size=min(queries, len(snapshot.user_ids)), replace=False).tolist()
+    latencies = {"user_cf": [], "item_cf": [], "sequential": [], "concurrent": []}
+    for user_id in users:
+        recallers = _recallers(snapshot, user_id, n, topk)
+        for name, recaller in recallers.items():
+            latencies[name].append(timed(recaller)[1])
+        latencies["sequential"].append(timed(lambda: [recaller() for recaller in recallers.values()])[1])
+        latencies["concurrent"].append(timed(run_recallers, recallers)[1])
+
+    sequential, concurrent = sum(latencies["sequential"]), sum(latencies["concurrent"])
+    return {
+        "cpu_count": os.cpu_count(),
+        "index_seconds": index_seconds,
+        **{name: latency_stats(values) for name, values in latencies.items()},
+        # 大于1表示并发缩短了延迟，单核时约为1
+        "speedup": sequential / concurrent if concurrent else 0.0,
+    }
@@ -0,0 +1,80 @@
+""" `RecommedMovie`接口的基准测试
+在Django测试数据库中写入合成数据，用`RequestFactory`直接调用视图(包括序列化)，不经过网络
+"""
+import numpy as np
+from loguru import logger
+
+from .measure import latency_stats, peak_rss, timed
+
+
+def populate(data, batch_size=10000):
+    """ 把合成评分写入数据库，电影和用户按数据中出现的ID创建 """
+    from movie.models import Movie, Rate, User
+
+    movie_ids = np.unique(data["item_id"]).tolist()
+    user_ids = np.unique(data["user_id"]).tolist()
+    counts = data["item_id"].value_counts().to_dict()
+    Movie.objects.bulk_create((
+        Movie(id=i, name=f"movie-{i}", director="", country="", years="", leader="", d_rate_nums=0,
+              d_rate="0", intro="", pic="", good="None", sump=counts.get(i, 0))
+        for i in movie_ids
+    ), batch_size=batch_size)
+    User.objects.bulk_create((
+        User(id=i, username=f"user-{i}", name=f"user-{i}", password="", phone="", address="", email="")
+        for i in user_ids
+    ), batch_size=batch_size)
+    Rate.objects.bulk_create((
+        Rate(user_id=user_id, movie_id=movie_id, mark=mark)
+        for user_id, movie_id, mark in zip(data["user_id"].tolist(), data["item_id"].tolist(), data["mark"].tolist())
+    ), batch_size=batch_size)
+
+
+def _request_latencies(view, users, method, topk):
+    from django.test import RequestFactory
+
+    factory = RequestFactory()
+    latencies = []
+    for user_id in users:
+        request = factory.get("/api/recommend/", {"user_id": user_id, "method": method, "topk": topk})
+        _, seconds = timed(lambda: view(request).render())
+        latencies.append(seconds)
+    return latencies
+
+
+def bench_view(data, queries=1000, topk=15, seed=0):
+    """ 在临时测试数据库中测量模型构建耗时，以及缓存未命中/命中时的请求延迟和吞吐量 """
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    from movie.algorithm.cache import result_cache
+    from movie.algorithm.registry import model_registry
+    from movie.algorithm.snapshot import rating_store
+    from movie.views import RecommedMovie
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        _, populate_seconds = timed(populate, data)
+        rating_store.invalidate()
+        _, build_seconds = timed(model_registry.build)
+        result_cache.clear()
+
+        all_users = data["user_id"].unique()
+        users = np.random.default_rng(seed).choice(all_users, size=min(queries, len(all_users)), replace=False).tolist()
+        view = RecommedMovie.as_view()
+        results = {"populate_seconds": populate_seconds, "build_seconds": build_seconds, "peak_rss_mb": peak_rss()}
+        for method in ("user_cf", "item_cf"):
+            logger.info(f"Benchmarking RecommedMovie method={method} on {len(data)} interactions")
+            cold = _request_latencies(view, users, method, topk)
+            warm = _request_latencies(view, users, method, topk)
+            results[method] = {
+                "cold": latency_stats(cold),
+                "warm": latency_stats(warm),
+                "cold_throughput": len(cold) / sum(cold) if cold else 0.0,
+                "warm_throughput": len(warm) / sum(warm) if warm else 0.0,
+            }
+        return results
+    finally:
+        result_cache.clear()
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
@@ -0,0 +1,61 @@
+""" 合成数据生成
+用户活跃度和物品热度都服从Zipf(幂律)分布：少数用户贡献了大部分评分，少数物品获得了大部分评分
+"""
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+
+def zipf_weights(size: int, alpha: float):
+    """ 排名为1..size的概率，p(k) ∝ 1 / k^alpha """
+    weights = 1.0 / np.arange(1, size + 1, dtype=np.float64) ** alpha
+    return weights / weights.sum()
+
+
+def zipf_interactions(num_interactions: int, num_users: int = None, num_items: int = None,
+                      user_alpha: float = 0.8, item_alpha: float = 1.1, seed: int = 0,
+                      user_col: str = "user_id", item_col: str = "item_id", mark_col: str = "mark",
+                      max_rounds: int = 30):
+    """ 生成用户-物品评分，同一用户对同一物品只保留一条评分
+    幂律分布下热门用户与热门物品的组合大量重复，去重后按缺少的条数继续抽样，直到凑满`num_interactions`条；
+    热门用户的物品很快被占满，抽样`max_rounds`轮仍然不够时返回已有的评分并给出警告，调用方应以实际条数为准
+    :param num_interactions: 评分条数
+    :param num_users: 用户数，默认为评分条数的1/20
+    :param num_items: 物品数，默认为评分条数的1/50，至少100、最多10^6
+    :param user_alpha: 用户活跃度的幂律指数
+    :param item_alpha: 物品热度的幂律指数
+    :param seed: 随机种子，相同参数生成相同的数据
+    :param max_rounds: 最多抽样的轮数
+    """
+    num_users = num_users or max(num_interactions // 20, 10)
+    num_items = num_items or min(max(num_interactions // 50, 100), 10 ** 6)
+    if num_interactions > num_users * num_items:
+        raise ValueError(f"{num_interactions} interactions do not fit {num_users} users x {num_items} items")
+    rng = np.random.default_rng(seed)
+
+    # ID与排名之间随机打乱，避免ID越小越热门
+    user_ids = rng.permutation(num_users) + 1
+    item_ids = rng.permutation(num_items) + 1
+    user_weights, item_weights = zipf_weights(num_users, user_alpha), zipf_weights(num_items, item_alpha)
+
+    data = pd.DataFrame({user_col: [], item_col: [], mark_col: []})
+    size = num_interactions
+    for _ in range(max_rounds):
+        batch = pd.DataFrame({
+            user_col: user_ids[rng.choice(num_users, size=size, p=user_weights)],
+            item_col: item_ids[rng.choice(num_items, size=size, p=item_weights)],
+            mark_col: rng.integers(1, 11, size=size).astype(np.float64),
+        })
+        before = len(data)
+        data = pd.concat([data, batch], ignore_index=True).drop_duplicates([user_col, item_col], keep="last")
+        missing = num_interactions - len(data)
+        if missing <= 0:
+            break
+        # 按这一轮去重后留下的比例放大下一轮的抽样数
+        kept = max((len(data) - before) / size, 0.01)
+        size = min(int(missing / kept) + 1, 100 * num_interactions)
+    else:
+        logger.warning(f"Generated {len(data)} of {num_interactions} interactions after {max_rounds} rounds, "
+                       f"use more users/items or a smaller alpha")
+    data = data.iloc[:num_interactions].astype({user_col: np.int64, item_col: np.int64})
+    return data.reset_index(drop=True)
@@ -0,0 +1,259 @@
+""" 召回引擎的离线评估
+评分按时间切分：时间最晚的一部分作为测试集，之前的作为训练集，只用训练集构建模型，
+对测试集中的每个用户召回K个物品，与该用户在测试集中的评分比较：
+    recall@K     命中数 / 测试集中的物品数
+    precision@K  命中数 / K
+    ndcg@K       命中位置按1 / log2(排名 + 1)折损，除以理想排序的值
+    coverage@K   所有用户的召回结果覆盖的物品数 / 训练集中的物品数
+    latency@K    单个用户召回K个物品的延迟
+测试用户切成若干块，在fork出的进程池中并行召回并累加指标，模型由子进程直接继承，不需要序列化。
+召回结果中训练集里交互过的物品在计算指标前去掉，数量记为history_leaks，召回引擎本身已经排除了这些物品，正常为0
+    python -m benchmark.evaluate --scale 1e6 --engines item_cf_sparse user_cf_lsh --n 20 50 --ks 10 20
+    python -m benchmark.evaluate --app movie --test-ratio 0.1    # 评估数据库中的评分，需要DJANGO_SETTINGS_MODULE
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import time
+from contextlib import nullcontext
+
+# tqdm在导入时读取环境变量，评估中不输出进度条
+os.environ.setdefault("TQDM_DISABLE", "1")
+
+import numpy as np
+from loguru import logger
+
+from .bench_cf import ENGINES
+from .datagen import zipf_interactions
+from .measure import latency_stats, timed
+
+METRICS = ("recall", "precision", "ndcg")
+
+# fork出的子进程直接继承这些数据，不需要序列化
+_shared = {}
+
+
+def temporal_split(data, time_col: str = "time", test_ratio: float = 0.2, user_col: str = "user_id"):
+    """ 按评分时间切分训练集和测试集，测试集只保留训练集中出现过的用户
+    :param test_ratio: 测试集占全部评分的比例，时间不早于该分位数的评分进入测试集
+    :return: (训练集, 测试集, 切分时间)
+    """
+    cutoff = float(np.quantile(data[time_col].to_numpy(), 1 - test_ratio))
+    is_test = (data[time_col] >= cutoff).to_numpy()
+    train, test = data[~is_test], data[is_test]
+    # 没有训练数据的用户无法由协同过滤召回，不参与评估
+    test = test[test[user_col].isin(train[user_col].unique())]
+    return train.reset_index(drop=True), test.reset_index(drop=True), cutoff
+
+
+def ranking_metrics(recommended, relevant, ks):
+    """ 单个用户在每个K上的指标
+    :param recommended: 召回的物品，按得分降序
+    :param relevant: 测试集中的物品集合
+    :return: `len(ks) x len(METRICS)`的数组
+    """
+    hits = np.fromiter((item in relevant for item in recommended[:max(ks)]), dtype=np.float64)
+    gains = hits / np.log2(np.arange(2, len(hits) + 2))
+    ideal = np.cumsum(1 / np.log2(np.arange(2, max(ks) + 2)))
+    result = np.zeros((len(ks), len(METRICS)))
+    for i, k in enumerate(ks):
+        hit = hits[:k].sum()
+        result[i] = hit / len(relevant), hit / k, gains[:k].sum() / ideal[min(k, len(relevant)) - 1]
+    return result
+
+
+def _score_chunk(users):
+    """ 召回一块用户并累加指标，返回(指标之和, 每个K召回的物品, 耗时秒数, 召回的训练集物品数) """
+    model, test, ks = _shared["model"], _shared["test"], _shared["ks"]
+    history = model.user_item_dict
+    # 多召回最长的历史长度个物品，去掉训练集中交互过的物品后仍有max(ks)个
+    extra = max((len(history.get(user_id, ())) for user_id in users), default=0)
+    start = time.perf_counter()
+    recommendations = model(users, _shared["n"], max(ks) + extra, _shared["hot_fill"], _shared["batch_size"])
+    seconds = time.perf_counter() - start
+
+    totals = np.zeros((len(ks), len(METRICS)))
+    covered = [set() for _ in ks]
+    leaks = 0
+    for user_id in users:
+        seen = set(history.get(user_id, ()))
+        rec_items = recommendations.get(user_id, [])
+        leaks += sum(item in seen for item in rec_items[:max(ks)])
+        rec_items = [item for item in rec_items if item not in seen][:max(ks)]
+        totals += ranking_metrics(rec_items, test[user_id], ks)
+        for items, k in zip(covered, ks):
+            items.update(rec_items[:k])
+    return totals, [np.fromiter(items, dtype=np.int64, count=len(items)) for items in covered], seconds, leaks
+
+
+def evaluate_model(model, test, ks=(10, 20), n=50, num_items=None, queries=200, workers=None,
+                   chunk_size=2000, batch_size=1024, hot_fill=True, seed=0):
+    """ 评估一个已经构建好的模型
+    :param test: `{user_id: 测试集中的物品集合}`
+    :param ks: 召回数K，按最大的K召回一次，较小的K取前K个
+    :param n: 近邻数
+    :param num_items: 训练集中的物品数，计算覆盖率的分母
+    :param queries: 测量单用户延迟时抽样的用户数
+    :param workers: 进程数，默认为CPU核数
+    :param chunk_size: 每个任务的用户数
+    :param batch_size: 每个进程内批量召回时每块的用户数
+    """
+    ks = sorted(ks)
+    users = list(test)
+    workers = workers or os.cpu_count() or 1
+    chunks = [users[start:start + chunk_size] for start in range(0, len(users), chunk_size)]
+
+    totals = np.zeros((len(ks), len(METRICS)))
+    covered = [set() for _ in ks]
+    score_seconds, history_leaks = 0.0, 0
+    start = time.perf_counter()
+    _shared.update(model=model, test=test, ks=ks, n=n, hot_fill=hot_fill, batch_size=batch_size)
+    try:
+        with multiprocessing.get_context("fork").Pool(workers) if workers > 1 else nullcontext() as pool:
+            results = pool.imap(_score_chunk, chunks) if pool else map(_score_chunk, chunks)
+            # 按块的顺序累加，结果与进程数无关
+            for chunk_totals, chunk_covered, seconds, leaks in results:
+                totals += chunk_totals
+                for items, chunk_items in zip(covered, chunk_covered):
+                    items.update(chunk_items.tolist())
+                score_seconds += seconds
+                history_leaks += leaks
+    finally:
+        _shared.clear()
+    wall_seconds = time.perf_counter() - start
+
+    # 单用户延迟在主进程中逐个测量，不与并行召回争用CPU
+    sample = np.random.default_rng(seed).choice(len(users), size=min(queries, len(users)), replace=False)
+    sample = [users[i] for i in sample.tolist()]
+    result = {}
+    for i, k in enumerate(ks):
+        latencies = [timed(model, [user_id], n, k, hot_fill)[1] for user_id in sample]
+        result[f"@{k}"] = {
+            **{name: float(value) / len(users) if users else 0.0 for name, value in zip(METRICS, totals[i])},
+            "coverage": len(covered[i]) / num_items if num_items else 0.0,
+            "latency": latency_stats(latencies),
+        }
+    result.update({
+        "users": len(users),
+        "workers": workers,
+        "wall_seconds": wall_seconds,
+        "users_per_second": len(users) / wall_seconds if wall_seconds else 0.0,
+        # 各进程召回耗时之和，除以wall_seconds即为有效并行度
+        "score_seconds": score_seconds,
+        # 召回引擎在前max(ks)个结果中返回的训练集物品数，已在计算指标前去掉
+        "history_leaks": history_leaks,
+    })
+    return result
+
+
+def evaluate(data, engines=None, ns=(50,), ks=(10, 20), test_ratio=0.2, time_col="time", **options):
+    """ 切分数据，对每个引擎构建一次模型，再对每个近邻数n评估
+    :param data: 包含`user_id`、`item_id`和评分时间列的`DataFrame`
+    :param engines: `benchmark.bench_cf.ENGINES`中的引擎名，默认全部
+    :param ns: 需要比较的近邻数
+    :param options: `evaluate_model`的其余参数
+    """
+    train, test_data, cutoff = temporal_split(data, time_col, test_ratio)
+    test = {user_id: set(items) for user_id, items in test_data.groupby("user_id")["item_id"]}
+    num_items = int(train["item_id"].nunique())
+    report = {
+        "split": {
+            "cutoff": cutoff,
+            "train_interactions": len(train),
+            "test_interactions": len(test_data),
+            "test_users": len(test),
+            "train_items": num_items,
+        },
+        "engines": {},
+    }
+    logger.info(f"Split at {cutoff:.0f}: {len(train)} train / {len(test_data)} test interactions, "
+                f"{len(test)} test users")
+
+    for name in engines or ENGINES:
+        model, build_seconds = timed(ENGINES[name], train)
+        runs = []
+        for n in ns:
+            result = evaluate_model(model, test, ks, n, num_items, **options)
+            for k in sorted(ks):
+                metrics = result[f"@{k}"]
+                logger.info(f"{name} n={n} K={k}: recall {metrics['recall']:.4f} precision {metrics['precision']:.4f} "
+                            f"ndcg {metrics['ndcg']:.4f} coverage {metrics['coverage']:.4f} "
+                            f"p50 {metrics['latency'].get('p50_ms', 0):.2f}ms")
+            runs.append({"n": n, **result})
+        report["engines"][name] = {"build_seconds": build_seconds, "runs": runs}
+        del model
+    return report
+
+
+def load_rates(app):
+    """ 数据库中某个应用的全部评分，评分时间为Unix时间戳 """
+    import django
+    from importlib import import_module
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "recommend.settings")
+    django.setup()
+    from django.apps import apps
+
+    if not apps.is_installed(app):
+        raise ValueError(f"App '{app}' is not in INSTALLED_APPS")
+    logger.disable(app)
+    return import_module(f"{app}.algorithm.snapshot").rating_store.get().to_frame()
+
+
+def synthetic_rates(scale, span: float = 365 * 86400, seed: int = 0, **options):
+    """ 合成评分，评分时间在span秒内均匀分布，按时间切分相当于随机留出 """
+    data = zipf_interactions(int(scale), seed=seed, **options)
+    data["time"] = 1.6e9 + np.random.default_rng(seed).random(len(data)) * span
+    return data
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline evaluation of the CF engines on a time-based split")
+    parser.add_argument("--app", choices=["movie", "book"], default=None,
+                        help="evaluate the ratings of this app instead of synthetic data")
+    parser.add_argument("--scale", type=float, default=1e5, help="number of synthetic interactions")
+    parser.add_argument("--engines", nargs="+", choices=list(ENGINES), default=["item_cf_sparse", "user_cf_lsh"])
+    parser.add_argument("--n", nargs="+", type=int, default=[50], help="neighbour counts to compare")
+    parser.add_argument("--ks", nargs="+", type=int, default=[10, 20])
+    parser.add_argument("--test-ratio", type=float, default=0.2)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--chunk-size", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=1024)
+    parser.add_argument("--queries", type=int, default=200, help="sampled users per latency measurement")
+    parser.add_argument("--no-hot-fill", action="store_true", help="do not pad short lists with popular items")
+    parser.add_argument("--user-alpha", type=float, default=0.8)
+    parser.add_argument("--item-alpha", type=float, default=1.1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="evaluation.json")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    # 评估中不输出每次召回的日志
+    logger.disable("algorithm")
+    if args.app:
+        data = load_rates(args.app)
+    else:
+        data = synthetic_rates(args.scale, seed=args.seed, user_alpha=args.user_alpha, item_alpha=args.item_alpha)
+
+    report = {
+        "created_at": time.time(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "args": vars(args),
+        "interactions": len(data),
+        **evaluate(data, args.engines, args.n, args.ks, args.test_ratio, queries=args.queries,
+                   workers=args.workers, chunk_size=args.chunk_size, batch_size=args.batch_size,
+                   hot_fill=not args.no_hot_fill, seed=args.seed),
+    }
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+    logger.info(f"Evaluation written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
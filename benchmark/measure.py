@@ -0,0 +1,52 @@
+""" 计时与内存测量 """
+import time
+
+import numpy as np
+
+
+def peak_rss():
+    """ 进程的峰值常驻内存(MB)，读取`/proc/self/status`中的VmHWM """
+    try:
+        with open("/proc/self/status") as file:
+            for line in file:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def reset_peak_rss():
+    """ 把峰值常驻内存重置为当前值，只在Linux上可用 """
+    try:
+        with open("/proc/self/clear_refs", "w") as file:
+            file.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def latency_stats(latencies):
+    """ 延迟的分位数(毫秒)
+    :param latencies: 每次请求的耗时(秒)
+    """
+    if not len(latencies):
+        return {}
+    latencies = np.asarray(latencies) * 1000
+    return {
+        "count": int(len(latencies)),
+        "mean_ms": float(latencies.mean()),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p90_ms": float(np.percentile(latencies, 90)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "max_ms": float(latencies.max()),
+    }
+
+
+def timed(func, *args, **kwargs):
+    """ 调用函数，返回(结果, 耗时秒数) """
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
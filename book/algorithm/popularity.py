@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.db.models import Case, IntegerField, When
+
+from algorithm.popularity import PopularityStore
+from book.models import Book, Rate
+
+popularity_store = PopularityStore(Rate, Book, item_field="book", **getattr(settings, "RECOMMEND_POPULARITY", {}))
+
+
+def popular_books(topk, trending=False):
+    """ 按热度排序的热门书籍，热度为评分数与收藏数之和，只按主键查询
+    :param trending: 为True时按最近一段时间内的热度排序
+    """
+    book_ids = popularity_store.top(topk, trending)
+    if len(book_ids) < topk:
+        # 有热度的书籍不足topk本，按照收藏人数补足
+        book_ids += list(Book.objects.exclude(id__in=book_ids).order_by("-sump").values_list(
+            "id", flat=True)[:topk - len(book_ids)])
+    order = Case(*[When(id=book_id, then=i) for i, book_id in enumerate(book_ids)], output_field=IntegerField())
+    return Book.objects.filter(id__in=book_ids).order_by(order)
@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class BookConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'book'
+
+    def ready(self):
+        from book.algorithm.popularity import popularity_store
+        from book.algorithm.snapshot import rating_store
+        rating_store.connect()
+        popularity_store.connect()
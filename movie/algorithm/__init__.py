@@ -1,3 +1,4 @@
 from .item_cf import recommend_by_item_cf
 from .mixtrue import recommend_by_mixture
+from .tags import recommend_by_tags
 from .user_cf import recommend_by_user_cf
@@ -0,0 +1,13 @@
+from django.conf import settings
+
+from algorithm.result_cache import build_result_cache
+from movie.models import Recommendation
+
+result_cache = build_result_cache(**getattr(settings, "RECOMMEND_CACHE", {}))
+
+
+def invalidate_rate(sender, instance, **kwargs):
+    """ 用户有新的评分时，其缓存的推荐结果和预计算的推荐结果立即失效 """
+    if instance.user_id is not None:
+        result_cache.invalidate_user(instance.user_id)
+        Recommendation.objects.filter(user_id=instance.user_id).delete()
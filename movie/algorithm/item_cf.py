@@ -1,7 +1,10 @@
 import operator
 from math import sqrt
 
-from movie.models import Rate, Movie
+from algorithm.cooccurrence import CooccurrenceIndex
+from algorithm.metrics import metrics
+from movie.models import Movie
+from .snapshot import rating_store
 
 
 class ItemCf:
@@ -12,27 +15,26 @@ class ItemCf:
     4.根据⽤户的历史记录，给⽤户推荐物品
     """
 
-    def __init__(self, user_id):
+    def __init__(self, user_id, data=None, cooccurrence_index=None):
         self.user_id = user_id  # 用户id
+        self.data = data  # 调用方已经读取的评分数据`{user_id: {item_id: mark}}`
+        self._cooccurrence_index = cooccurrence_index
 
     def get_data(self):
         # 获取用户评分过的资讯
-        rates = Rate.objects.all()
-        if not rates:
+        if self.data is not None:
+            return self.data
+        snapshot = rating_store.get()
+        if not len(snapshot):
             return False
 
-        datas = {}
-        for rate in rates:
-            user_id = rate.user_id
-            if user_id not in datas:
-                datas.setdefault(user_id, {})
-                datas[user_id][rate.movie.id] = rate.mark
-            else:
-                datas[user_id][rate.movie.id] = rate.mark
+        return snapshot.user_dict
 
-        return datas
-
-    def similarity(self, data):
+    def similarity(self, data, items=None):
+        """
+        :param data: 用户数据
+        :param items: 只计算这些物品所在的行，为None时计算完整的相似矩阵
+        """
         # 1 构造物品：物品的共现矩阵
         N = {}  # 喜欢物品i的总⼈数
         C = {}  # 喜欢物品i也喜欢物品j的⼈数
@@ -40,6 +42,8 @@ class ItemCf:
             for i, score in item.items():
                 N.setdefault(i, 0)
                 N[i] += 1
+                if items is not None and i not in items:
+                    continue
                 C.setdefault(i, {})
                 for j, scores in item.items():
                     if j != i:
@@ -75,15 +79,32 @@ class ItemCf:
                     rank[j] += float(score) * w  # 预测兴趣度=评分*相似度
         return sorted(rank.items(), key=operator.itemgetter(1), reverse=True)[:topk]
 
-    def recommendation(self, n=15, topk=10):
-        """ 给用户推荐相似资讯 """
-        data = self.get_data()
+    # 向量化计算的物品共现相似度索引
+    @property
+    def cooccurrence_index(self):
+        if self._cooccurrence_index is None:
+            self._cooccurrence_index = CooccurrenceIndex.from_dict(self.get_data())
+        return self._cooccurrence_index
+
+    def recommendation(self, n=15, topk=10, vectorized=False):
+        """ 给用户推荐相似资讯
+        :param vectorized: 是否在scipy中向量化计算，计算期间释放GIL，可以与其他召回器并发
+        """
+        with metrics.timer("movie.ItemCf", "load"):
+            data = self.get_data()
         if not data or self.user_id not in data:
             # 用户没有评分过任何资讯，就返回空列表
             return []
 
-        W = self.similarity(data)  # 计算物品相似矩阵
-        sort_rank = self.recommand_list(data, W, self.user_id, n, topk)  # 推荐
+        if vectorized:
+            with metrics.timer("movie.ItemCf", "vectorized"):
+                return self.cooccurrence_index.recommend(self.user_id, n, topk)
+
+        # 推荐只用到用户评分过的物品所在的行
+        with metrics.timer("movie.ItemCf", "similarity"):
+            W = self.similarity(data, data[self.user_id].keys())  # 计算物品相似矩阵
+        with metrics.timer("movie.ItemCf", "rank"):
+            sort_rank = self.recommand_list(data, W, self.user_id, n, topk)  # 推荐
         return sort_rank
 
 
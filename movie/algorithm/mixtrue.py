@@ -1,42 +1,37 @@
-import operator
-
+from algorithm.hybrid import hybrid_recommend
 from movie.models import Movie
-from .item_cf import recommend_by_item_cf
-from .user_cf import recommend_by_user_cf
-
+from .item_cf import ItemCf
+from .popularity import popular_movies
+from .snapshot import rating_store
+from .tags import tag_store
+from .user_cf import UserCf
 
-def recommend_by_mixture(user_id, n=15, topk=10, w=0.8):
-    # 混合推荐算法
-    # 推荐列表 = w*P_cu + (1-w)* p_cf
-    cu_list = recommend_by_user_cf(user_id, n, topk, return_queryset=False)  # 用户协同过滤得到的推荐列表
-    cf_list = recommend_by_item_cf(user_id, n, topk, return_queryset=False)  # 物品协同过滤得到的推荐列表
-    if not cu_list:
-        # 用户协同过滤推荐列表为空
-        if not cf_list:
-            movie_list = Movie.objects.all().order_by("-sump")[:topk]
-        else:
-            # 返回物品协同过滤列表中的电影
-            movie_list = Movie.objects.filter(id__in=[s[0] for s in cf_list]).order_by("sump")[:topk]
-    else:
-        if not cf_list:
-            # 物品协同过滤列表为空，则返回用户协同过滤列表中的书籍
-            movie_list = Movie.objects.filter(id__in=[s[0] for s in cu_list]).exclude(
-                id=user_id).order_by("-sump")[:topk]
-        else:
-            # 混合推荐
-            rank = {}
-            for movie_id, distance in cu_list:
-                cf_d = 0
-                # 找到物品协同过滤列表中同一本书籍的兴趣度
-                for movie_id_cf, value in cf_list:
-                    if movie_id == movie_id_cf:
-                        cf_d = value
-                        break
 
-                rank[movie_id] = w * distance + (1 - w) * cf_d
-            rank_list = sorted(rank.items(), key=operator.itemgetter(1), reverse=True)[:topk]
+def recommend_by_mixture(user_id, n=15, topk=10, w=0.8, weights=None):
+    """ 混合推荐算法
+    推荐列表 = w*P_cu + (1-w)* p_cf，两种协同过滤在同一份评分快照上并发计算，分数归一化后线性融合
+    :param w: 用户协同过滤的权重
+    :param weights: `{"user_cf": w1, "item_cf": w2, "tag": w3}`，指定时覆盖`w`，`tag`为基于标签的召回
+    """
+    snapshot = rating_store.get()
+    if snapshot.user_position(user_id) is None:
+        # 当前用户没有打分，按照热度顺序返回
+        return popular_movies(topk)
 
-            movie_list = Movie.objects.filter(id__in=[s[0] for s in rank_list]).exclude(
-                id=user_id).order_by("-sump")[:topk]
+    data = snapshot.user_dict
+    user_cf = UserCf(data=data, pearson_index=snapshot.pearson_index)
+    item_cf = ItemCf(user_id, data=data, cooccurrence_index=snapshot.cooccurrence_index)
+    recallers = {
+        "user_cf": lambda: user_cf.recommend(user_id, n, vectorized=True),  # 用户协同过滤得到的推荐列表
+        "item_cf": lambda: item_cf.recommendation(n, topk, vectorized=True),  # 物品协同过滤得到的推荐列表
+    }
+    weights = weights or {"user_cf": w, "item_cf": 1 - w}
+    if weights.get("tag"):
+        # 与历史评分共享标签最多的电影，没有评分的新电影也能被召回
+        recallers["tag"] = lambda: tag_store.get().recall(data[user_id].keys(), topk)
+    rank_list = hybrid_recommend(recallers, weights, topk=topk)
+    if not rank_list:
+        # 两个推荐列表都为空
+        return popular_movies(topk)
 
-    return movie_list
+    return Movie.objects.filter(id__in=[s[0] for s in rank_list]).order_by("-sump")[:topk]
@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.db.models import Case, IntegerField, When
+
+from algorithm.popularity import PopularityStore
+from movie.models import Movie, Rate
+
+popularity_store = PopularityStore(Rate, Movie, item_field="movie", **getattr(settings, "RECOMMEND_POPULARITY", {}))
+
+
+def popular_movies(topk, trending=False):
+    """ 按热度排序的热门电影，热度为评分数与收藏数之和，只按主键查询
+    :param trending: 为True时按最近一段时间内的热度排序
+    """
+    movie_ids = popularity_store.top(topk, trending)
+    if len(movie_ids) < topk:
+        # 有热度的电影不足topk部，按照收藏人数补足
+        movie_ids += list(Movie.objects.exclude(id__in=movie_ids).order_by("-sump").values_list(
+            "id", flat=True)[:topk - len(movie_ids)])
+    order = Case(*[When(id=movie_id, then=i) for i, movie_id in enumerate(movie_ids)], output_field=IntegerField())
+    return Movie.objects.filter(id__in=movie_ids).order_by(order)
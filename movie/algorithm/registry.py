@@ -0,0 +1,31 @@
+from django.conf import settings
+
+from algorithm.cf.item_cf import ItemCF
+from algorithm.cf.user_cf import UserCF
+from algorithm.registry import ModelRegistry
+from .snapshot import rating_store
+from .tags import tag_store
+
+
+def build_item_cf(snapshot):
+    item_cf = ItemCF(snapshot.to_frame(), user_col="user_id", item_col="item_id", time_col="time")
+    options = {"engine": "sparse", **getattr(settings, "RECOMMEND_ITEM_CF", {})}
+    item_cf.calculate_similarity_matrix(**options)
+    # 没有评分的新电影按标签相似度参与召回，标签索引在模型之外随Movie.tags增量更新
+    tags = dict(getattr(settings, "RECOMMEND_TAGS", {}))
+    if tags.pop("enabled", False):
+        item_cf.use_tags(tag_store.get(), **tags)
+    return item_cf
+
+
+def build_user_cf(snapshot):
+    user_cf = UserCF(snapshot.to_frame(), user_col="user_id", item_col="item_id")
+    user_cf.calculate_similarity_matrix()
+    return user_cf
+
+
+model_registry = ModelRegistry(
+    rating_store,
+    builders={"item_cf": build_item_cf, "user_cf": build_user_cf},
+    **getattr(settings, "RECOMMEND_REGISTRY", {}),
+)
@@ -0,0 +1,8 @@
+from django.conf import settings
+
+from algorithm.search import SearchStore
+from movie.models import Movie
+
+# 字段权重：电影名称 > 导演 > 描述
+search_store = SearchStore(Movie, fields={"name": 3, "director": 2, "intro": 1},
+                           **getattr(settings, "RECOMMEND_SEARCH", {}))
@@ -0,0 +1,4 @@
+from algorithm.snapshot import RatingStore
+from movie.models import Rate
+
+rating_store = RatingStore(Rate, item_field="movie")
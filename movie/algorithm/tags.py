@@ -0,0 +1,81 @@
+import threading
+
+from django.db.models import Case, IntegerField, When
+from loguru import logger
+
+from algorithm.cf.tags import TagIndex
+from algorithm.metrics import metrics, record_model_size
+from movie.models import Movie
+from .snapshot import rating_store
+
+
+class TagStore:
+    """ 进程级的电影标签索引
+    第一次读取时通过一次`values_list`查询整体加载，此后随`Movie.tags`的变化增量更新
+    """
+
+    def __init__(self):
+        self._index = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        with metrics.timer("TagStore.movie", "load"):
+            item_tags = {}
+            for movie_id, tag_id in Movie.tags.through.objects.values_list("movie_id", "tags_id").iterator():
+                item_tags.setdefault(movie_id, []).append(tag_id)
+            index = TagIndex(item_tags)
+        record_model_size("TagStore.movie", items=len(index), tags=len(index.tag_items))
+        logger.info(f"Loaded tag index: {len(index)} movies, {len(index.tag_items)} tags")
+        return index
+
+    def get(self) -> TagIndex:
+        if self._index is None:
+            with self._lock:
+                if self._index is None:
+                    self._index = self.load()
+        return self._index
+
+    def reset(self):
+        """ 丢弃已经加载的索引，下一次读取时从数据库重新加载 """
+        self._index = None
+
+    def on_tags_change(self, sender, instance, action, reverse, pk_set, **kwargs):
+        # 索引还没有加载时不需要处理，加载时会读到最新的标签
+        if self._index is None or action not in ("post_add", "post_remove", "pre_clear"):
+            return
+        if action == "pre_clear":
+            # 清空之前查出将被删除的关系
+            action = "post_remove"
+            pk_set = set(Movie.objects.filter(tags=instance).values_list("pk", flat=True)) if reverse else None
+        # 正向时instance为电影、pk_set为标签，反向时instance为标签、pk_set为电影
+        pairs = [(movie_id, [instance.pk]) for movie_id in pk_set] if reverse else [(instance.pk, pk_set)]
+        for movie_id, tags in pairs:
+            if action == "post_add":
+                self._index.add_tags(movie_id, tags)
+            else:
+                self._index.remove_tags(movie_id, tags)
+
+    def on_movie_delete(self, sender, instance, **kwargs):
+        if self._index is not None:
+            self._index.remove_tags(instance.pk)
+
+    def connect(self):
+        from django.db.models.signals import m2m_changed, post_delete
+
+        m2m_changed.connect(self.on_tags_change, sender=Movie.tags.through, dispatch_uid="tag_store", weak=False)
+        post_delete.connect(self.on_movie_delete, sender=Movie, dispatch_uid="tag_store", weak=False)
+
+
+tag_store = TagStore()
+
+
+def recommend_by_tags(user_id, topk=15):
+    """ 基于内容的推荐：与用户评分过的电影共享标签最多的电影 """
+    snapshot = rating_store.get()
+    if snapshot.user_position(user_id) is None:
+        return Movie.objects.none()
+    with metrics.timer("movie.TagRecall", "recall"):
+        rank_list = tag_store.get().recall(snapshot.user_dict[user_id].keys(), topk)
+    movie_ids = [movie_id for movie_id, _ in rank_list]
+    order = Case(*[When(id=movie_id, then=i) for i, movie_id in enumerate(movie_ids)], output_field=IntegerField())
+    return Movie.objects.filter(id__in=movie_ids).order_by(order)
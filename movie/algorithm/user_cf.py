@@ -3,7 +3,11 @@ from math import sqrt, pow
 
 from loguru import logger
 
-from movie.models import User, Movie, Rate
+from algorithm.metrics import metrics
+from algorithm.pearson import PearsonIndex
+from movie.models import Movie
+from .popularity import popular_movies
+from .snapshot import rating_store
 
 
 class UserCf:
@@ -31,8 +35,9 @@ class UserCf:
     """
 
     # 获得初始化数据
-    def __init__(self, data):
+    def __init__(self, data, pearson_index=None):
         self.data = data
+        self._pearson_index = pearson_index
 
     # 通过用户名获得书籍列表，仅调试使用
     def get_items(self, username1, username2):
@@ -60,13 +65,33 @@ class UserCf:
 
         return molecule / denominator if denominator != 0 else 0
 
+    # 向量化计算的皮尔逊相关系数索引，行顺序与data一致
+    @property
+    def pearson_index(self):
+        if self._pearson_index is None:
+            self._pearson_index = PearsonIndex.from_dict(self.data)
+        return self._pearson_index
+
     # 计算与当前用户的距离，获得最临近的用户
-    def nearest_user(self, username, n=1):
+    def nearest_user(self, username, n=1, vectorized=False, min_common=0):
+        """
+        :param username: 当前用户
+        :param n: 最相似的用户数
+        :param vectorized: 是否一次性向量化计算当前用户与所有用户的相关系数
+        :param min_common: 共同评分数少于该值的用户不作为近邻
+        """
+        if vectorized:
+            closest_distance = self.pearson_index.nearest(username, n, min_common)
+            logger.debug(f"Closest Users: {closest_distance}")
+            return closest_distance
+
         distances = {}
         # 用户相似度，遍历整个数据集
         for user, rate_set in self.data.items():
             # 非当前的用户
             if user != username:
+                if min_common and len(self.data[username].keys() & rate_set.keys()) < min_common:
+                    continue
                 distance = self.pearson(self.data[username], self.data[user])
                 # 计算两个用户的相似度
                 distances[user] = distance
@@ -75,20 +100,20 @@ class UserCf:
             distances.items(), key=operator.itemgetter(1), reverse=True
         )
         # 最相似的N个用户
-        logger.info(f"Closest Users: {closest_distance[:n]}")
+        logger.debug(f"Closest Users: {closest_distance[:n]}")
 
         return closest_distance[:n]
 
     # 给用户推荐电影
-    def recommend(self, username, n=1):
+    def recommend(self, username, n=1, vectorized=False, min_common=0):
         recommend = {}
-        nearest_user = self.nearest_user(username, n)
+        with metrics.timer("movie.UserCf", "similarity"):
+            nearest_user = self.nearest_user(username, n, vectorized, min_common)
         for user, score in dict(nearest_user).items():  # 最相近的n个用户
             for movie_id, scores in self.data[user].items():  # 推荐的用户的电影列表
                 if movie_id not in self.data[username].keys():  # 当前username没有看过
-                    rate = Rate.objects.filter(movie_id=movie_id, user__username=user)
                     # 如果用户评分低于3分，则表明用户不喜欢此电影，则不推荐给别的用户
-                    if rate and rate.first().mark < 3:
+                    if scores < 3:
                         continue
                     if movie_id not in recommend.keys():  # 添加到推荐列表中
                         recommend[movie_id] = scores
@@ -96,37 +121,28 @@ class UserCf:
         return sorted(recommend.items(), key=operator.itemgetter(1), reverse=True)
 
 
-def recommend_by_user_cf(user_id, n=15, topk=15, return_queryset=True):
+def recommend_by_user_cf(user_id, n=15, topk=15, return_queryset=True, vectorized=True, min_common=0):
     # 通过用户协同算法来进行推荐
-    current_user = User.objects.get(id=user_id)
+    with metrics.timer("movie.UserCf", "load"):
+        snapshot = rating_store.get()
     # 如果当前用户没有打分 则按照热度顺序返回
-    if current_user.rate_set.count() == 0:
-        movie_list = Movie.objects.all().order_by("-sump")[:topk]
+    if snapshot.user_position(user_id) is None:
+        movie_list = popular_movies(topk)
         return movie_list
 
-    users = User.objects.all()
-    all_user = {}
-    for user in users:
-        rates = user.rate_set.all()
-        rate = {}
-        # 用户有给图书打分
-        if rates:
-            for i in rates:
-                rate.setdefault(str(i.movie.id), i.mark)
-            all_user.setdefault(user.username, rate)
-        else:
-            # 用户没有为书籍打过分，设为0
-            all_user.setdefault(user.username, {})
-
-    user_cf = UserCf(data=all_user)
-    recommend_list = user_cf.recommend(current_user.username, n)
+    # 所有用户的评分`{user_id: {movie_id: mark}}`，来自评分快照而不是逐个用户查询
+    all_user = snapshot.user_dict
+
+    user_cf = UserCf(data=all_user, pearson_index=snapshot.pearson_index)
+    with metrics.timer("movie.UserCf", "recommend"):
+        recommend_list = user_cf.recommend(user_id, n, vectorized, min_common)
     if not return_queryset:
         return recommend_list
 
     good_list = [each[0] for each in recommend_list]
     if not good_list:
         # 如果没有找到相似用户喜欢的书则按照热度顺序返回
-        movie_list = Movie.objects.all().order_by("-sump")[:topk]
+        movie_list = popular_movies(topk)
         return movie_list
 
     return Movie.objects.filter(id__in=good_list).order_by("-sump")[:topk]
@@ -4,3 +4,24 @@ from django.apps import AppConfig
 class MovieConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'movie'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from django.db.models.signals import post_delete, post_save
+
+        from movie.algorithm.cache import invalidate_rate
+        from movie.algorithm.popularity import popularity_store
+        from movie.algorithm.registry import model_registry
+        from movie.algorithm.search import search_store
+        from movie.algorithm.snapshot import rating_store
+        from movie.algorithm.tags import tag_store
+        from movie.models import Rate
+        from recommend.sqlite import apply_sqlite_pragmas
+        connection_created.connect(apply_sqlite_pragmas, dispatch_uid="sqlite_pragmas")
+        rating_store.connect()
+        popularity_store.connect()
+        search_store.connect()
+        tag_store.connect()
+        model_registry.connect(Rate)
+        post_save.connect(invalidate_rate, sender=Rate, dispatch_uid="result_cache_rate")
+        post_delete.connect(invalidate_rate, sender=Rate, dispatch_uid="result_cache_rate")
@@ -0,0 +1,231 @@
+""" 批量导入电影/书籍目录和评分
+    python manage.py ingest movies data/movie.csv
+    python manage.py ingest books books.csv
+    python manage.py ingest rates rates.csv --app movie --create-users
+CSV逐块读取，每块在一个事务中用`bulk_create`写入物品、标签、多对多关系和评分，标签在内存中解析。
+每块提交后在`<csv>.progress`中记录已处理的行数，中断后重新执行会跳过这些行；`--no-resume`从头开始。
+各类文件的列：
+    movies  title,image_link,country,years,director_description,leader,star,description,tags(用/分隔)
+    books   title,author,description,tags,image_link(可选)
+    rates   user_id,<item_col>,mark,create_time(可选，Unix时间戳或ISO格式)
+同一块中同一用户对同一物品的多条评分只保留最后一条，数据库中已有的评分保持不变；
+输出的写入数是实际插入的行数
+"""
+import csv
+import os
+import re
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone as dt_timezone
+from itertools import islice
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+
+@contextmanager
+def keep_auto_now_add(model, field_name):
+    """ `bulk_create`会用当前时间覆盖`auto_now_add`字段，导入历史数据时暂时关闭 """
+    field = model._meta.get_field(field_name)
+    auto_now_add = field.auto_now_add
+    field.auto_now_add = False
+    try:
+        yield
+    finally:
+        field.auto_now_add = auto_now_add
+
+
+def parse_time(value):
+    """ Unix时间戳或ISO格式的时间，为空时取当前时间 """
+    if not value:
+        return timezone.now()
+    try:
+        return datetime.fromtimestamp(float(value), tz=dt_timezone.utc)
+    except ValueError:
+        created = datetime.fromisoformat(value)
+        return created if timezone.is_aware(created) else timezone.make_aware(created)
+
+
+class Command(BaseCommand):
+    help = "Bulk load movie/book catalogues and ratings from CSV files"
+
+    def add_arguments(self, parser):
+        parser.add_argument("kind", choices=["movies", "books", "rates"])
+        parser.add_argument("path", help="CSV文件路径，第一行为列名")
+        parser.add_argument("--app", choices=["movie", "book"], default="movie", help="rates导入到哪个应用")
+        parser.add_argument("--item-col", default=None, help="rates中物品ID的列名，默认为movie_id/book_id")
+        parser.add_argument("--create-users", action="store_true", help="rates中不存在的用户自动创建")
+        parser.add_argument("--chunk-size", type=int, default=5000, help="每个事务写入的行数")
+        parser.add_argument("--no-resume", action="store_true", help="忽略进度文件，从第一行开始")
+
+    def handle(self, *args, kind, path, app, item_col, create_users, chunk_size, no_resume, **options):
+        app = {"movies": "movie", "books": "book"}.get(kind, app)
+        if not apps.is_installed(app):
+            raise CommandError(f"App '{app}' is not in INSTALLED_APPS")
+        self.app_config = apps.get_app_config(app)
+        self.item_col = item_col or f"{app}_id"
+        self.create_users = create_users
+        prepare, loader = {
+            "movies": (self.prepare_movies, self.load_movies),
+            "books": (self.prepare_books, self.load_books),
+            "rates": (self.prepare_rates, self.load_rates),
+        }[kind]
+
+        progress_path = f"{path}.progress"
+        done = 0
+        if not no_resume and os.path.exists(progress_path):
+            with open(progress_path) as f:
+                done = int(f.read().strip() or 0)
+            self.stdout.write(f"Resuming {path} after {done} rows")
+        prepare()
+
+        start, rows_total, written_total = time.perf_counter(), 0, 0
+        with open(path, newline="", encoding="utf-8") as f:
+            reader = islice(csv.DictReader(f), done, None)
+            while True:
+                chunk = list(islice(reader, chunk_size))
+                if not chunk:
+                    break
+                chunk_start = time.perf_counter()
+                with transaction.atomic():
+                    written = loader(chunk)
+                done += len(chunk)
+                with open(progress_path, "w") as progress:
+                    progress.write(str(done))
+                rows_total += len(chunk)
+                written_total += written
+                elapsed = time.perf_counter() - chunk_start
+                self.stdout.write(f"[{kind}] {done} rows read, {written} written, {len(chunk) / elapsed:.0f} rows/s")
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f"[{kind}] Read {rows_total} rows and wrote {written_total} in {elapsed:.1f}s "
+            f"({rows_total / elapsed if elapsed else 0:.0f} rows/s)"))
+
+    def resolve_tags(self, names):
+        """ 标签名到ID，不存在的标签批量创建 """
+        Tags = self.app_config.get_model("Tags")
+        missing = [name for name in dict.fromkeys(names) if name not in self.tags]
+        if missing:
+            Tags.objects.bulk_create([Tags(name=name) for name in missing])
+            self.tags.update(Tags.objects.filter(name__in=missing).values_list("name", "id"))
+        return [self.tags[name] for name in names]
+
+    def prepare_movies(self):
+        Movie, Tags = self.app_config.get_model("Movie"), self.app_config.get_model("Tags")
+        self.tags = dict(Tags.objects.values_list("name", "id"))
+        # 电影名称唯一，已经存在的电影跳过
+        self.seen = set(Movie.objects.values_list("name", flat=True))
+
+    def load_movies(self, rows):
+        Movie = self.app_config.get_model("Movie")
+        movies, movie_tags = [], {}
+        for row in rows:
+            name = row["title"].strip()
+            if not name or name in self.seen:
+                continue
+            self.seen.add(name)
+            star = row.get("star", "").strip()
+            res = re.match(r"\d+", star)
+            movies.append(Movie(
+                name=name, pic=name + ".png",
+                country=row.get("country", "").strip(),
+                years=row.get("years", "").strip(),
+                leader=row.get("leader", "").strip(),
+                d_rate_nums=int(res[0]) if res else 0,
+                d_rate=star,
+                intro=row.get("description", "").strip(),
+                director=row.get("director_description", "").strip(),
+                good="None",
+            ))
+            movie_tags[name] = [tag.strip() for tag in row.get("tags", "").split("/") if tag.strip()]
+        if not movies:
+            return 0
+
+        Movie.objects.bulk_create(movies)
+        movie_ids = dict(Movie.objects.filter(name__in=movie_tags).values_list("name", "id"))
+        tag_names = list(dict.fromkeys(tag for tags in movie_tags.values() for tag in tags))
+        tag_ids = dict(zip(tag_names, self.resolve_tags(tag_names)))
+        Through = Movie.tags.through
+        Through.objects.bulk_create([
+            Through(movie_id=movie_ids[name], tags_id=tag_ids[tag])
+            for name, tags in movie_tags.items() for tag in dict.fromkeys(tags)
+        ], ignore_conflicts=True)
+        return len(movies)
+
+    def prepare_books(self):
+        Book, Tags = self.app_config.get_model("Book"), self.app_config.get_model("Tags")
+        self.tags = dict(Tags.objects.values_list("name", "id"))
+        self.seen = set(Book.objects.values_list("title", "author"))
+
+    def load_books(self, rows):
+        Book = self.app_config.get_model("Book")
+        books, book_tags = [], []
+        for row in rows:
+            key = (row["title"].strip(), row.get("author", "").strip())
+            if not key[0] or key in self.seen:
+                continue
+            self.seen.add(key)
+            books.append(Book(
+                title=key[0], author=key[1],
+                intro=row.get("description", "").strip(),
+                pic=row.get("image_link", "").strip() or key[0] + ".png",
+                good="None",
+            ))
+            # 书籍只有一个标签，取第一个
+            book_tags.append(next((tag.strip() for tag in row.get("tags", "").split("/") if tag.strip()), None))
+        if not books:
+            return 0
+
+        tag_names = list(dict.fromkeys(filter(None, book_tags)))
+        tag_ids = dict(zip(tag_names, self.resolve_tags(tag_names)))
+        for book, tag in zip(books, book_tags):
+            book.tags_id = tag_ids.get(tag)
+        Book.objects.bulk_create(books)
+        return len(books)
+
+    def prepare_rates(self):
+        User = self.app_config.get_model("User")
+        Item = self.app_config.get_model("Movie" if self.app_config.label == "movie" else "Book")
+        # 外键在提交时才检查，先在内存中过滤掉不存在的用户和物品，避免整块回滚
+        self.user_ids = set(User.objects.values_list("id", flat=True))
+        self.item_ids = set(Item.objects.values_list("id", flat=True))
+        self.skipped = 0
+
+    def load_rates(self, rows):
+        User, Rate = self.app_config.get_model("User"), self.app_config.get_model("Rate")
+        item_field = f"{self.app_config.label}_id"
+        # 与评分快照一致，同一(用户, 物品)的多条评分保留最后一条，否则ignore_conflicts会留下第一条
+        latest = {}
+        for row in rows:
+            user_id, item_id = int(row["user_id"]), int(row[self.item_col])
+            latest[user_id, item_id] = (user_id, item_id, float(row["mark"]), row.get("create_time"))
+        parsed = list(latest.values())
+
+        if self.create_users:
+            new_users = {user_id for user_id, *_ in parsed} - self.user_ids
+            User.objects.bulk_create([
+                User(id=user_id, username=f"user{user_id}", name=f"user{user_id}", password="",
+                     phone="", address="", email=f"user{user_id}@example.com")
+                for user_id in sorted(new_users)
+            ], ignore_conflicts=True)
+            # ignore_conflicts跳过的用户(例如用户名已被占用)没有创建，重新查询实际存在的用户
+            self.user_ids.update(User.objects.filter(id__in=new_users).values_list("id", flat=True))
+
+        rates = [
+            Rate(user_id=user_id, mark=mark, create_time=parse_time(created), **{item_field: item_id})
+            for user_id, item_id, mark, created in parsed
+            if user_id in self.user_ids and item_id in self.item_ids
+        ]
+        self.skipped += len(parsed) - len(rates)
+        if len(parsed) != len(rates):
+            self.stdout.write(self.style.WARNING(
+                f"Skipped {len(parsed) - len(rates)} rates with unknown users or items ({self.skipped} in total)"))
+        # ignore_conflicts跳过已有的评分且不返回插入的行数，按本块用户的评分数之差统计
+        chunk_rates = Rate.objects.filter(user_id__in={rate.user_id for rate in rates})
+        before = chunk_rates.count()
+        with keep_auto_now_add(Rate, "create_time"):
+            Rate.objects.bulk_create(rates, ignore_conflicts=True)
+        return chunk_rates.count() - before
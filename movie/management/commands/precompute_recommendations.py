@@ -0,0 +1,81 @@
+""" 离线批量计算所有用户的推荐结果，写入`Recommendation`表
+    python manage.py precompute_recommendations --method all --n 15 --topk 15
+评分数据的版本由评分数量、最大评分ID和全部评分的校验和确定，评分有增删或原地修改时版本都会变化；
+已经按当前版本写入的用户会被跳过，中断后重新执行即可从断点继续；`--no-resume`强制全部重新计算。
+接口只使用与当前模型评分数据版本相同的预计算结果
+"""
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from movie.algorithm.registry import build_item_cf, build_user_cf
+from movie.algorithm.snapshot import rating_store
+from movie.models import Recommendation, User
+
+BUILDERS = {"item_cf": build_item_cf, "user_cf": build_user_cf}
+
+
+class Command(BaseCommand):
+    help = "Precompute top-K recommendations for all users into the Recommendation table"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--method", choices=["item_cf", "user_cf", "all"], default="all")
+        parser.add_argument("--n", type=int, default=15, help="近邻数")
+        parser.add_argument("--topk", type=int, default=15, help="每个用户的推荐数")
+        parser.add_argument("--chunk-size", type=int, default=1000, help="每个事务写入的用户数")
+        parser.add_argument("--batch-size", type=int, default=256, help="批量召回时每块的用户数")
+        parser.add_argument("--no-resume", action="store_true", help="忽略已有结果，全部重新计算")
+
+    def handle(self, *args, **options):
+        methods = list(BUILDERS) if options["method"] == "all" else [options["method"]]
+        # 版本标识与快照同时读取，与接口中模型的版本标识一致
+        snapshot = rating_store.get()
+        data_version = snapshot.data_version
+        user_ids = list(User.objects.order_by("id").values_list("id", flat=True))
+        self.stdout.write(f"Rating data version {data_version}: {len(snapshot)} ratings, {len(user_ids)} users")
+
+        for method in methods:
+            self.precompute(method, snapshot, user_ids, data_version, options["n"], options["topk"],
+                            options["chunk_size"], options["batch_size"], resume=not options["no_resume"])
+
+    def precompute(self, method, snapshot, user_ids, data_version, n, topk, chunk_size, batch_size, resume=True):
+        """ 计算一种召回方法的推荐结果 """
+        pending = user_ids
+        if resume:
+            done = set(Recommendation.objects.filter(
+                method=method, n=n, topk=topk, data_version=data_version,
+            ).values_list("user_id", flat=True))
+            pending = [user_id for user_id in user_ids if user_id not in done]
+            if done:
+                self.stdout.write(f"[{method}] Resuming: {len(done)} users already up to date")
+        if not pending:
+            self.stdout.write(self.style.SUCCESS(f"[{method}] Nothing to do"))
+            return
+
+        start = time.perf_counter()
+        model = BUILDERS[method](snapshot)
+        self.stdout.write(f"[{method}] Model built in {time.perf_counter() - start:.1f}s")
+
+        start, written = time.perf_counter(), 0
+        for offset in range(0, len(pending), chunk_size):
+            chunk_start = time.perf_counter()
+            chunk = pending[offset:offset + chunk_size]
+            user_rec = model(chunk, n, topk, hot_fill=True, batch_size=batch_size)
+            rows = [
+                Recommendation(user_id=user_id, method=method, n=n, topk=topk,
+                               movies=[int(movie_id) for movie_id in user_rec[user_id]],
+                               data_version=data_version)
+                for user_id in chunk
+            ]
+            # 每块一个事务，中断时已提交的块不会重复计算
+            with transaction.atomic():
+                Recommendation.objects.filter(method=method, user_id__in=chunk).delete()
+                Recommendation.objects.bulk_create(rows)
+            written += len(rows)
+            elapsed = time.perf_counter() - chunk_start
+            self.stdout.write(f"[{method}] {written}/{len(pending)} users, {len(rows) / elapsed:.0f} users/s")
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f"[{method}] Wrote {written} users in {elapsed:.1f}s ({written / elapsed:.0f} users/s)"))
@@ -0,0 +1,35 @@
+# Generated by Django 3.2.25 on 2026-10-18 05:47
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movie', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Recommendation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('method', models.CharField(max_length=16, verbose_name='召回方法')),
+                ('n', models.IntegerField(verbose_name='近邻数')),
+                ('topk', models.IntegerField(verbose_name='推荐数')),
+                ('movies', models.JSONField(default=list, verbose_name='推荐电影id')),
+                ('data_version', models.CharField(max_length=32, verbose_name='评分数据版本')),
+                ('created_at', models.DateTimeField(auto_now=True, verbose_name='生成时间')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='movie.user', verbose_name='用户')),
+            ],
+            options={
+                'verbose_name': '预计算推荐',
+                'verbose_name_plural': '预计算推荐',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='recommendation',
+            constraint=models.UniqueConstraint(fields=('user', 'method'), name='unique_user_method_recommendation'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 3.2.25 on 2026-10-18 05:55
+
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def remove_duplicate_rates(apps, schema_editor):
+    """ 同一用户对同一电影的多条评分只保留最后一条(ID最大)，与评分快照的处理一致 """
+    Rate = apps.get_model("movie", "Rate")
+    rates = Rate.objects.using(schema_editor.connection.alias).filter(user__isnull=False, movie__isnull=False)
+    latest = rates.values("user_id", "movie_id").annotate(latest=Max("id")).values("latest")
+    rates.exclude(id__in=latest).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movie', '0002_recommendation'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_rates, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='rate',
+            index=models.Index(fields=['create_time'], name='movie_rate_create_time_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='rate',
+            constraint=models.UniqueConstraint(fields=('user', 'movie'), name='unique_user_movie_rate'),
+        ),
+    ]
@@ -74,6 +74,13 @@ class Rate(models.Model):
     class Meta:
         verbose_name = "评分信息"
         verbose_name_plural = verbose_name
+        # 同一用户对同一电影只保留一条评分，唯一约束同时作为按用户查询的联合索引
+        constraints = [
+            models.UniqueConstraint(fields=["user", "movie"], name="unique_user_movie_rate"),
+        ]
+        indexes = [
+            models.Index(fields=["create_time"], name="movie_rate_create_time_idx"),
+        ]
 
 
 class Comment(models.Model):
@@ -99,3 +106,20 @@ class Num(models.Model):
     class Meta:
         verbose_name = "数据统计"
         verbose_name_plural = verbose_name
+
+
+class Recommendation(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name="用户")
+    method = models.CharField(max_length=16, verbose_name="召回方法")
+    n = models.IntegerField(verbose_name="近邻数")
+    topk = models.IntegerField(verbose_name="推荐数")
+    movies = models.JSONField(verbose_name="推荐电影id", default=list)
+    data_version = models.CharField(max_length=32, verbose_name="评分数据版本")
+    created_at = models.DateTimeField(verbose_name="生成时间", auto_now=True)
+
+    class Meta:
+        verbose_name = "预计算推荐"
+        verbose_name_plural = verbose_name
+        constraints = [
+            models.UniqueConstraint(fields=["user", "method"], name="unique_user_method_recommendation"),
+        ]
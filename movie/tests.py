@@ -1,3 +1,782 @@
-from django.test import TestCase
+import json
+import os
+import pickle
+import tempfile
+import threading
+from unittest import mock
+from datetime import timedelta
+from io import StringIO
 
-# Create your tests here.
+import numpy as np
+import pandas as pd
+from asgiref.sync import async_to_sync
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Q
+from django.http import StreamingHttpResponse
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from algorithm.cf.artifact import convert_pickle, load_model, save_model
+from algorithm.cf.item_cf import ItemCF
+from algorithm.cf.lsh import candidate_stats
+from algorithm.cf.streaming import _SpillingAccumulator, build_streaming
+from algorithm.cf.user_cf import UserCF
+from algorithm.hybrid import run_recallers
+from algorithm.popularity import PopularityIndex, RankedCounter
+from algorithm.result_cache import DjangoResultCache
+from algorithm.search import Fts5SearchIndex, NgramSearchIndex, fts5_available
+from benchmark.evaluate import ranking_metrics, temporal_split
+from movie.algorithm.cache import result_cache
+from movie.algorithm.item_cf import ItemCf
+from movie.algorithm.popularity import popularity_store
+from movie.algorithm.registry import model_registry
+from movie.algorithm.search import search_store
+from movie.algorithm.snapshot import rating_store
+from movie.algorithm.tags import tag_store
+from movie.algorithm.user_cf import UserCf
+from movie.models import Movie, Rate, Recommendation, Tags, User
+from recommend.handlers import ASGIHandler
+
+
+def reset_stores():
+    """ 进程级的索引、模型和缓存不会随测试数据库回滚，每个测试开始前重新加载 """
+    rating_store.invalidate()
+    popularity_store.reset()
+    search_store.reset()
+    tag_store.reset()
+    model_registry._current = None
+    result_cache.clear()
+    result_cache.hits = result_cache.misses = 0
+
+
+def create_user(i):
+    return User.objects.create(username=f"user{i}", name=f"user{i}", password="", phone="", address="",
+                               email=f"user{i}@example.com")
+
+
+def create_movie(i):
+    return Movie.objects.create(name=f"movie{i}", director="", country="", years="", leader="", d_rate_nums=0,
+                                d_rate="", intro="", pic="", good="None", sump=i)
+
+
+class RecommendTestCase(TestCase):
+    """ 8个用户、12部电影，用户i依次给电影i..i+3评分，相邻用户的评分有重叠 """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [create_user(i) for i in range(8)]
+        cls.movies = [create_movie(i) for i in range(12)]
+        for i, user in enumerate(cls.users):
+            for j in range(4):
+                Rate.objects.create(user=user, movie=cls.movies[(i + j) % 12], mark=4)
+
+    def setUp(self):
+        reset_stores()
+
+    def rated(self, user):
+        return set(Rate.objects.filter(user=user).values_list("movie_id", flat=True))
+
+    def recommend(self, user, method="user_cf", topk=5, **params):
+        response = self.client.get("/api/recommend/", {"user_id": user.id, "method": method, "topk": topk, **params})
+        self.assertEqual(response.status_code, 200)
+        return response, [movie["id"] for movie in response.json()]
+
+
+class SearchMovieTests(TestCase):
+    """ 单个查询词的检索结果与原来的`icontains`查询相同，多个查询词之间为"且" """
+    queries = ["救赎", "肖申克", "克", "nolan", "NOLAN", "Knight", "nigh", "an", "a", "secrets through", "zzz"]
+
+    @classmethod
+    def setUpTestData(cls):
+        for i, (name, director, intro) in enumerate([
+            ("肖申克的救赎", "弗兰克·德拉邦特", "希望让人自由"),
+            ("救赎之路", "张三", "一部关于肖申克的纪录片"),
+            ("The Dark Knight", "Christopher Nolan", "Batman fights crime in Gotham"),
+            ("Inception", "Christopher Nolan", "A thief who steals secrets through dreams"),
+            ("Knight and Day", "James Mangold", "spy comedy"),
+            ("Nolan", "", ""),
+        ]):
+            Movie.objects.create(name=name, director=director, country="", years="", leader="", d_rate_nums=0,
+                                 d_rate="", intro=intro, pic="", good="None", sump=i)
+
+    def setUp(self):
+        reset_stores()
+
+    def search(self, query):
+        response = self.client.get("/api/search/", {"query": query})
+        self.assertEqual(response.status_code, 200)
+        return [movie["id"] for movie in response.json()]
+
+    @staticmethod
+    def icontains(query):
+        return set(Movie.objects.filter(
+            Q(name__icontains=query) | Q(intro__icontains=query) | Q(director__icontains=query)
+        ).values_list("id", flat=True))
+
+    def assert_same_as_icontains(self):
+        for query in self.queries:
+            self.assertEqual(set(self.search(query)), self.icontains(query), query)
+        # 查询词分别出现在不同字段中也能匹配，原来的查询要求整个查询串是某个字段的子串
+        inception = Movie.objects.get(name="Inception").id
+        self.assertEqual(self.search("christopher dreams"), [inception])
+        self.assertEqual(self.icontains("christopher dreams"), set())
+
+    def test_ngram(self):
+        with mock.patch.object(search_store, "backend", "ngram"):
+            self.assert_same_as_icontains()
+            self.assertIsInstance(search_store.get(), NgramSearchIndex)
+            # 与名称完全相同时得分加倍，导演名中出现的得分低于名称，同分按ID升序
+            ids = {movie.name: movie.id for movie in Movie.objects.all()}
+            self.assertEqual(self.search("nolan"), [ids["Nolan"], ids["The Dark Knight"], ids["Inception"]])
+            # 索引加载后写入和删除的电影随信号更新
+            movie = Movie.objects.create(name="Nolan Rising", director="", country="", years="", leader="",
+                                         d_rate_nums=0, d_rate="", intro="", pic="", good="None")
+            self.assertIn(movie.id, self.search("rising"))
+            movie.delete()
+            self.assertEqual(self.search("rising"), [])
+
+    def test_fts5(self):
+        if not fts5_available(connection):
+            self.skipTest("SQLite FTS5 with the trigram tokenizer is unavailable")
+        with mock.patch.object(search_store, "backend", "fts5"):
+            self.assert_same_as_icontains()
+            self.assertIsInstance(search_store.get(), Fts5SearchIndex)
+
+    def test_fts5_unavailable_falls_back_to_ngram(self):
+        with mock.patch.object(search_store, "backend", "fts5"), \
+                mock.patch("algorithm.search.fts5_available", return_value=False):
+            self.assert_same_as_icontains()
+            self.assertIsInstance(search_store.get(), NgramSearchIndex)
+
+
+class RecommedMovieTests(RecommendTestCase):
+
+    def test_excludes_rated_movies(self):
+        for method in ("user_cf", "item_cf"):
+            for user in self.users:
+                _, movie_ids = self.recommend(user, method)
+                self.assertEqual(len(movie_ids), 5)
+                self.assertFalse(set(movie_ids) & self.rated(user), (method, user.id))
+
+
+class ModelRegistryTests(RecommendTestCase):
+
+    def test_rebuild_reads_ratings_written_without_signals(self):
+        first = model_registry.current
+        size = len(rating_store.get())
+        # bulk_create不发送post_save，与ingest命令和其他进程的写入相同
+        user = create_user(100)
+        Rate.objects.bulk_create([Rate(user=user, movie=movie, mark=5) for movie in self.movies[:3]])
+        current = model_registry.build()
+        self.assertEqual(len(rating_store.get()), size + 3)
+        self.assertNotEqual(current.snapshot_version, first.snapshot_version)
+        self.assertIn(user.id, current.models["item_cf"].user_set)
+
+
+class ResultCacheTests(RecommendTestCase):
+
+    def test_hit_miss_and_invalidation_on_rate_save(self):
+        user = self.users[0]
+        response, first = self.recommend(user)
+        self.assertEqual(response["X-Cache"], "MISS")
+        response, second = self.recommend(user)
+        self.assertEqual(response["X-Cache"], "HIT")
+        self.assertEqual(first, second)
+        # 其他用户的评分不影响该用户的缓存
+        Rate.objects.create(user=self.users[4], movie=self.movies[0], mark=5)
+        response, _ = self.recommend(user)
+        self.assertEqual(response["X-Cache"], "HIT")
+
+        Rate.objects.create(user=user, movie=Movie.objects.get(id=first[0]), mark=5)
+        response, _ = self.recommend(user)
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertEqual(result_cache.stats()["hits"], 2)
+
+    def test_shared_backend_invalidates_across_workers(self):
+        # 两个实例相当于两个worker，共享同一个缓存后端
+        worker, other_worker = DjangoResultCache(prefix="test"), DjangoResultCache(prefix="test")
+        worker.set(1, "user_cf", 15, 15, 1, [3, 4])
+        self.assertEqual(other_worker.get(1, "user_cf", 15, 15, 1), [3, 4])
+        other_worker.invalidate_user(1)
+        self.assertIsNone(worker.get(1, "user_cf", 15, 15, 1))
+
+
+class PrecomputedTests(RecommendTestCase):
+
+    def precompute(self, user, data_version, movies):
+        return Recommendation.objects.create(user=user, method="user_cf", n=15, topk=15,
+                                             movies=[movie.id for movie in movies], data_version=data_version)
+
+    def test_used_when_version_matches_and_cached(self):
+        user, movies = self.users[0], self.movies[6:9]
+        self.precompute(user, model_registry.current.data_version, movies)
+        response, movie_ids = self.recommend(user, topk=3, n=15)
+        self.assertEqual(response["X-Source"], "precomputed")
+        self.assertEqual(set(movie_ids), {movie.id for movie in movies})
+        # 预计算结果写入结果缓存，之后不再查询预计算表
+        response, _ = self.recommend(user, topk=3, n=15)
+        self.assertEqual((response["X-Source"], response["X-Cache"]), ("cache", "HIT"))
+
+    def test_rejects_other_data_version(self):
+        user = self.users[0]
+        self.precompute(user, model_registry.current.data_version, self.movies[6:9])
+        # 评分变化后模型重新构建，旧版本的预计算结果不再使用
+        Rate.objects.bulk_create([Rate(user=self.users[1], movie=self.movies[9], mark=5)])
+        model_registry.build()
+        response, movie_ids = self.recommend(user, topk=3, n=15)
+        self.assertEqual(response["X-Source"], "live")
+        self.assertFalse(set(movie_ids) & self.rated(user))
+
+    def test_rejects_rows_after_in_place_edit(self):
+        user = self.users[0]
+        data_version = model_registry.current.data_version
+        self.precompute(user, data_version, self.movies[6:9])
+        # 原地修改分数，评分条数和最大ID都不变
+        Rate.objects.filter(user=self.users[1], movie=self.movies[1]).update(mark=1)
+        model_registry.build()
+        self.assertNotEqual(model_registry.current.data_version, data_version)
+        response, _ = self.recommend(user, topk=3, n=15)
+        self.assertEqual(response["X-Source"], "live")
+
+    def test_rejects_expired_rows(self):
+        user = self.users[0]
+        row = self.precompute(user, model_registry.current.data_version, self.movies[6:9])
+        # update()不触发auto_now
+        Recommendation.objects.filter(id=row.id).update(created_at=timezone.now() - timedelta(days=2))
+        response, _ = self.recommend(user, topk=3, n=15)
+        self.assertEqual(response["X-Source"], "live")
+
+
+class BatchRecommendMovieTests(RecommendTestCase):
+
+    def batch(self, **data):
+        return self.client.post("/api/recommend/batch", data, content_type="application/json")
+
+    def test_streams_one_line_per_user(self):
+        user_ids = [user.id for user in self.users] + [10 ** 6]
+        response = self.batch(user_ids=user_ids, method="item_cf", topk=5)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        lines = [json.loads(line) for line in b"".join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([line["user_id"] for line in lines], user_ids)
+        for user, line in zip(self.users, lines):
+            self.assertEqual(len(line["movies"]), 5)
+            self.assertFalse(set(line["movies"]) & self.rated(user))
+        # 没有评分的用户返回热门电影
+        self.assertEqual(len(lines[-1]["movies"]), 5)
+
+    def test_rejects_invalid_user_ids(self):
+        for user_ids in ("12", 12, None, [1, "2"], [1.5], [True], {"1": 1}):
+            response = self.batch(user_ids=user_ids)
+            self.assertEqual(response.status_code, 400, user_ids)
+        self.assertEqual(self.batch(user_ids=[1], topk="many").status_code, 400)
+        with self.settings(RECOMMEND_BATCH={"max_users": 2}):
+            self.assertEqual(self.batch(user_ids=[1, 2, 3]).status_code, 400)
+
+
+class ASGIHandlerTests(TestCase):
+
+    def test_streaming_parts_are_generated_off_the_event_loop(self):
+        threads = []
+
+        def parts():
+            for i in range(3):
+                threads.append(threading.get_ident())
+                yield f"{i}\n"
+
+        async def send_response():
+            messages = []
+
+            async def send(message):
+                messages.append(message)
+
+            await ASGIHandler().send_response(StreamingHttpResponse(parts()), send)
+            return threading.get_ident(), messages
+
+        loop_thread, messages = async_to_sync(send_response)()
+        self.assertEqual(len(threads), 3)
+        self.assertNotIn(loop_thread, threads)
+        self.assertEqual(messages[0]["type"], "http.response.start")
+        self.assertEqual(b"".join(message.get("body", b"") for message in messages[1:]), b"0\n1\n2\n")
+        self.assertFalse(messages[-1].get("more_body", False))
+
+
+class IngestRatesTests(RecommendTestCase):
+
+    def ingest(self, lines, *args):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "rates.csv")
+            with open(path, "w") as f:
+                f.write("user_id,movie_id,mark\n" + "".join(f"{line}\n" for line in lines))
+            out = StringIO()
+            call_command("ingest", "rates", path, *args, stdout=out)
+        return out.getvalue()
+
+    def test_counts_inserted_rows_and_keeps_last_duplicate(self):
+        user, movie = self.users[0], self.movies[6]
+        existing = Rate.objects.filter(user=user).first()
+        out = self.ingest([
+            f"{user.id},{movie.id},1",
+            f"{user.id},{movie.id},5",
+            # 已有的评分被ignore_conflicts跳过，不计入写入数
+            f"{user.id},{existing.movie_id},1",
+        ])
+        self.assertIn("wrote 1 ", out)
+        self.assertEqual(Rate.objects.get(user=user, movie=movie).mark, 5)
+        self.assertEqual(Rate.objects.get(id=existing.id).mark, existing.mark)
+
+    def test_create_users_only_trusts_created_ids(self):
+        # 用户名user1000已被占用，id为1000的用户不会被创建，它的评分应当跳过而不是导致外键错误
+        User.objects.filter(id=self.users[1].id).update(username="user1000")
+        out = self.ingest([f"1000,{self.movies[0].id},4", f"1001,{self.movies[0].id},4"], "--create-users")
+        self.assertFalse(User.objects.filter(id=1000).exists())
+        self.assertTrue(User.objects.filter(id=1001).exists())
+        self.assertIn("Skipped 1 rates", out)
+        self.assertIn("wrote 1 ", out)
+
+
+class TagRecallTests(RecommendTestCase):
+
+    def test_cold_movies_do_not_displace_item_cf(self):
+        user = self.users[0]
+        _, without_tags = self.recommend(user, "item_cf")
+        # 全部电影的标签相同，没有评分的电影标签得分达到协同过滤的最高得分
+        tag = Tags.objects.create(name="drama")
+        for movie in self.movies + [create_movie(100 + i) for i in range(3)]:
+            movie.tags.add(tag)
+        cold = set(Movie.objects.exclude(id__in=Rate.objects.values("movie_id")).values_list("id", flat=True))
+
+        with self.settings(RECOMMEND_TAGS={"enabled": True, "weight": 1.0, "slots": 2}):
+            reset_stores()
+            _, with_tags = self.recommend(user, "item_cf")
+        self.assertEqual(len(with_tags), 5)
+        self.assertEqual(len(set(with_tags) & cold), 2)
+        self.assertEqual(len(set(with_tags) & set(without_tags)), 3)
+        self.assertFalse(set(with_tags) & self.rated(user))
+
+
+class CFTestCase(SimpleTestCase):
+    """ 40个用户、30个物品的随机交互，近邻数大于用户数和物品数，不存在近邻截断带来的差异；
+    得分相同的物品顺序可以不同，因此比较召回结果在参照得分下的得分
+    """
+    n, topk = 100, 5
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        rng = np.random.default_rng(0)
+        rows = [(user, item) for user in range(40) for item in rng.choice(30, rng.integers(3, 9), replace=False)]
+        cls.data = pd.DataFrame(rows, columns=["user_id", "item_id"])
+        cls.data["time"] = rng.random(len(rows)) * 1000
+        cls.users = list(range(40))
+
+    def build(self, model_class, engine, data=None, time_col=None, **options):
+        model = model_class(self.data if data is None else data, user_col="user_id", item_col="item_id",
+                            **({"time_col": time_col} if time_col else {}))
+        model.calculate_similarity_matrix(engine=engine, neighbor_num=self.n, **options)
+        return model
+
+    @staticmethod
+    def item_cf_ranks(model):
+        """ 按ItemCF的定义逐用户累加历史物品的近邻得分，用户交互过的物品不参与 """
+        ranks = {}
+        for user_id in model.user_item_dict:
+            history = set(model.user_item_dict[user_id])
+            rank = {}
+            for his_item in model.user_item_dict[user_id]:
+                for item, score in model.neighbor_index.get(his_item):
+                    if item not in history:
+                        rank[item] = rank.get(item, 0) + score
+            ranks[user_id] = rank
+        return ranks
+
+    @staticmethod
+    def user_cf_ranks(model):
+        """ 按UserCF的定义累加近邻用户交互过的物品的得分，用户交互过的物品不参与 """
+        ranks = {}
+        for user_id in model.user_item_dict:
+            history = set(model.user_item_dict[user_id])
+            rank = {}
+            for other, score in model.neighbor_index.get(user_id):
+                for item in model.user_item_dict[other]:
+                    if item not in history:
+                        rank[item] = rank.get(item, 0) + score
+            ranks[user_id] = rank
+        return ranks
+
+    def assert_same_similarity(self, model, expected):
+        self.assertEqual(set(model.neighbor_index.keys.tolist()), set(expected.neighbor_index.keys.tolist()))
+        for key in expected.neighbor_index.keys.tolist():
+            scores, expected_scores = dict(model.neighbor_index.get(key)), dict(expected.neighbor_index.get(key))
+            self.assertEqual(set(scores), set(expected_scores), key)
+            np.testing.assert_allclose([scores[k] for k in expected_scores], list(expected_scores.values()))
+
+    def assert_top_scores(self, model, ranks, users=None):
+        for batch_size in (None, 7):
+            user_rec = model(users or self.users, self.n, self.topk, batch_size=batch_size)
+            for user_id, rank in ranks.items():
+                expected = sorted(rank.values(), reverse=True)[:self.topk]
+                # 不在rank中的物品(例如用户评过分的物品)得分记为-1，必然不一致
+                scores = [rank.get(item, -1) for item in user_rec[user_id]]
+                np.testing.assert_allclose(scores, expected, err_msg=f"user {user_id}, batch_size {batch_size}")
+
+
+class EngineParityTests(CFTestCase):
+    """ 各相似度引擎、逐用户和批量召回的结果与逐用户循环的python引擎一致 """
+
+    def test_item_cf_engines(self):
+        expected = self.build(ItemCF, "python")
+        ranks = self.item_cf_ranks(expected)
+        self.assert_top_scores(expected, ranks)
+        for engine, options in (("sparse", {}), ("parallel", {"workers": 2})):
+            model = self.build(ItemCF, engine, **options)
+            self.assert_same_similarity(model, expected)
+            self.assert_top_scores(model, ranks)
+
+    def test_user_cf_engines(self):
+        expected = self.build(UserCF, "python")
+        ranks = self.user_cf_ranks(expected)
+        self.assert_top_scores(expected, ranks)
+        model = self.build(UserCF, "parallel", workers=2)
+        self.assert_same_similarity(model, expected)
+        self.assert_top_scores(model, ranks)
+
+
+class IncrementalUpdateTests(CFTestCase):
+    """ 在一部分数据上构建后用update()加入其余数据，结果与在全部数据上构建一致 """
+
+    def split(self):
+        rng = np.random.default_rng(1)
+        # 用户32-39和物品26-29只出现在新数据中，其余用户还会交互一部分新的物品
+        rest = (self.data["user_id"] >= 32) | (self.data["item_id"] >= 26) | (rng.random(len(self.data)) < 0.2)
+        return self.data[~rest], self.data[rest]
+
+    def assert_same_sim_dict(self, sim_dict, expected):
+        self.assertEqual(set(sim_dict), set(expected))
+        for key, row in expected.items():
+            self.assertEqual(set(sim_dict[key]), set(row), key)
+            np.testing.assert_allclose([sim_dict[key][k] for k in row], list(row.values()))
+
+    def test_item_cf_update(self):
+        prefix, rest = self.split()
+        self.assertFalse(set(prefix["user_id"]) & set(range(32, 40)) or set(prefix["item_id"]) & set(range(26, 30)))
+        expected = self.build(ItemCF, "python")
+        for engine in ("python", "sparse"):
+            model = self.build(ItemCF, engine, data=prefix)
+            model.update(rest)
+            self.assert_same_sim_dict(model.item_sim_dict, expected.item_sim_dict)
+            self.assert_same_similarity(model, expected)
+            self.assert_top_scores(model, self.item_cf_ranks(expected))
+
+    def test_user_cf_update(self):
+        prefix, rest = self.split()
+        expected = self.build(UserCF, "python")
+        for engine, options in (("python", {}), ("parallel", {"workers": 2})):
+            model = self.build(UserCF, engine, data=prefix, **options)
+            model.update(rest)
+            self.assert_same_sim_dict(model.user_sim_dict, expected.user_sim_dict)
+            self.assert_same_similarity(model, expected)
+            self.assert_top_scores(model, self.user_cf_ranks(expected))
+
+
+class ArtifactTests(CFTestCase):
+    """ 数组格式的模型保存后以memmap加载，召回结果与内存中的模型相同 """
+
+    def models(self):
+        yield "item_cf", self.build(ItemCF, "sparse")
+        yield "item_cf_max_items", self.build(ItemCF, "sparse", time_col="time", max_items=2)
+        yield "user_cf", self.build(UserCF, "python")
+
+    def assert_same_recall(self, loaded, model, name):
+        # 用户100没有交互，返回热门物品
+        users = self.users + [100]
+        for batch_size in (None, 7):
+            self.assertEqual(loaded(users, self.n, self.topk, hot_fill=True, batch_size=batch_size),
+                             model(users, self.n, self.topk, hot_fill=True, batch_size=batch_size), (name, batch_size))
+
+    def test_save_and_load_with_mmap(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for name, model in self.models():
+                path = os.path.join(directory, name)
+                save_model(model, path)
+                loaded = load_model(path)
+                self.assertIs(type(loaded), type(model))
+                # NeighborIndex用np.asarray包装，数组仍然是只读映射的文件，没有复制
+                for array in (loaded.neighbor_index.scores, loaded.neighbor_index.indices):
+                    self.assertIsInstance(array if isinstance(array, np.memmap) else array.base, np.memmap)
+                    self.assertFalse(array.flags.writeable)
+                self.assert_same_recall(loaded, model, name)
+                # 覆盖保存，已有的目录被整体替换
+                save_model(model, path)
+                self.assert_same_recall(load_model(path), model, name)
+
+    def test_convert_pickle(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for name, model in self.models():
+                pickle_path, path = os.path.join(directory, f"{name}.pkl"), os.path.join(directory, name)
+                with open(pickle_path, "wb") as file:
+                    pickle.dump(model, file)
+                # 文件按旧版本的pickle缓存加载
+                self.assert_same_recall(load_model(pickle_path), model, name)
+                convert_pickle(pickle_path, path)
+                self.assert_same_recall(load_model(path), model, name)
+
+
+class StreamingBuildTests(CFTestCase):
+    """ 分块构建时强制溢写和按行块合并，结果与内存中构建并保存的模型一致 """
+
+    def chunks(self):
+        return (self.data[start:start + 20] for start in range(0, len(self.data), 20))
+
+    def test_spilled_build_matches_in_memory_model(self):
+        for name, model in (("ItemCF", self.build(ItemCF, "sparse")), ("UserCF", self.build(UserCF, "python"))):
+            with tempfile.TemporaryDirectory() as directory, \
+                    mock.patch.object(_SpillingAccumulator, "spill", autospec=True,
+                                      side_effect=_SpillingAccumulator.spill) as spill:
+                path, expected_path = os.path.join(directory, "streaming"), os.path.join(directory, "in_memory")
+                # 内存预算只有1字节：每个分区累加后都溢写，合并时每个行块只有一行
+                build_streaming(self.chunks(), path, model=name, neighbor_num=self.n, partitions=4, memory_budget=1)
+                self.assertGreater(spill.call_count, 1, name)
+                save_model(model, expected_path)
+                loaded, expected = load_model(path), load_model(expected_path)
+                self.assertIs(type(loaded), type(model))
+                self.assert_same_similarity(loaded, expected)
+                self.assertEqual(dict(loaded.item_interacted_num), dict(expected.item_interacted_num))
+                for user_id in self.users:
+                    self.assertEqual(list(loaded.user_item_dict[user_id]), list(expected.user_item_dict[user_id]))
+                ranks = self.item_cf_ranks(model) if name == "ItemCF" else self.user_cf_ranks(model)
+                self.assert_top_scores(loaded, ranks)
+
+
+class LSHTests(CFTestCase):
+    """ LSH近邻的相似度是候选用户对的精确值，签名固定种子，结果可复现 """
+
+    def test_candidate_scores_are_exact(self):
+        expected = self.build(UserCF, "python")
+        model = self.build(UserCF, "lsh", bands=8, rows=2)
+        self.assertLess(model.lsh_stats["candidate_pairs"], model.lsh_stats["all_pairs"])
+        for user_id in self.users:
+            scores = dict(model.neighbor_index.get(user_id))
+            self.assertLessEqual(set(scores), set(expected.user_sim_dict[user_id]), user_id)
+            np.testing.assert_allclose(list(scores.values()), [expected.user_sim_dict[user_id][v] for v in scores])
+        # 相同的种子得到相同的近邻
+        again = self.build(UserCF, "lsh", bands=8, rows=2)
+        for user_id in self.users:
+            self.assertEqual(again.neighbor_index.get(user_id), model.neighbor_index.get(user_id))
+
+    def test_full_recall(self):
+        expected = self.build(UserCF, "python")
+        # 每段1位、256段：Jaccard相似度不低于1/16的用户对(本数据中的最小值)成为候选的概率大于1 - 1e-7
+        self.assertGreater(min(candidate_stats(256, 1, (1 / 16,)).values()), 1 - 1e-7)
+        model = self.build(UserCF, "lsh", bands=256, rows=1)
+        report = model.lsh_recall_report(sample=len(self.users))
+        self.assertEqual(report["recall"], 1.0)
+        self.assertEqual((report["sample"], report["k"]), (len(self.users), self.n))
+        self.assertEqual(model.lsh_stats["similar_pairs"],
+                         sum(len(row) for row in expected.user_sim_dict.values()) // 2)
+        self.assert_same_similarity(model, expected)
+        self.assert_top_scores(model, self.user_cf_ranks(expected))
+
+
+class HistoryLimitTests(CFTestCase):
+    """ max_items/window只截取参与相似度计算的历史，召回时仍然排除用户交互过的全部物品 """
+
+    def test_batch_recall_and_save(self):
+        for options in ({"max_items": 2}, {"window": 200}):
+            model = self.build(ItemCF, "sparse", time_col="time", **options)
+            # 截取后部分历史物品没有参与相似度计算
+            self.assertTrue(any(item not in model.item_interacted_num
+                                for items in model.user_item_dict.values() for item in items), options)
+            ranks = self.item_cf_ranks(model)
+            self.assert_top_scores(model, ranks)
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, "item_cf")
+                save_model(model, path)
+                loaded = load_model(path)
+                for user_id in self.users:
+                    self.assertEqual(list(loaded.user_item_dict[user_id]), list(model.user_item_dict[user_id]))
+                self.assert_top_scores(loaded, ranks)
+                self.assertEqual(loaded(self.users, self.n, self.topk, hot_fill=True),
+                                 model(self.users, self.n, self.topk, hot_fill=True))
+
+
+class HybridRecallTests(SimpleTestCase):
+
+    def test_vectorized_item_cf_matches_per_pair_scores(self):
+        rng = np.random.default_rng(0)
+        data = {user: {int(item): float(rng.integers(1, 6)) for item in rng.choice(30, rng.integers(1, 9), replace=False)}
+                for user in range(40)}
+        for user in data:
+            item_cf = ItemCf(user, data=data)
+            # 近邻数大于物品数，没有截断边界上得分相同的物品
+            expected = item_cf.recommendation(n=100, topk=10)
+            result = item_cf.recommendation(n=100, topk=10, vectorized=True)
+            np.testing.assert_allclose([score for _, score in result], [score for _, score in expected])
+            self.assertFalse({item for item, _ in result} & data[user].keys())
+            if len({score for _, score in expected}) == len(expected):
+                self.assertEqual(result, expected)
+
+    def test_recallers_run_concurrently(self):
+        # 两个召回器互相等待，依次执行时第一个召回器会超时
+        barrier = threading.Barrier(2, timeout=5)
+
+        def recaller(item):
+            barrier.wait()
+            return [(item, 1.0)]
+
+        result = run_recallers({"a": lambda: recaller(1), "b": lambda: recaller(2)})
+        self.assertEqual(result, {"a": [(1, 1.0)], "b": [(2, 1.0)]})
+
+
+class PearsonTests(SimpleTestCase):
+    """ 向量化的皮尔逊相关系数与逐对计算的近邻用户和推荐结果一致 """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        rng = np.random.default_rng(0)
+        cls.data = {user: {int(item): float(rng.integers(1, 6)) for item in rng.choice(20, rng.integers(2, 9), replace=False)}
+                    for user in range(30)}
+        # 评分全部相同(方差为0)、只有一个评分、与其他用户没有共同评分的用户，相关系数都为0
+        cls.data[30] = {item: 3.0 for item in range(6)}
+        cls.data[31] = {item: 4.0 for item in range(10, 16)}
+        cls.data[32] = {0: 5.0}
+        cls.data[33] = {100: 2.0, 101: 4.0}
+
+    def test_correlations_match_per_pair(self):
+        user_cf = UserCf(self.data)
+        position = user_cf.pearson_index.position
+        for user in self.data:
+            corr, _ = user_cf.pearson_index.correlate(user)
+            expected = [user_cf.pearson(self.data[user], self.data[other]) for other in self.data]
+            np.testing.assert_allclose(corr, expected, atol=1e-12, err_msg=f"user {user}")
+            if user in (30, 31, 32, 33):
+                self.assertFalse(np.any(np.delete(corr, position[user])), user)
+
+    def test_nearest_users_and_recommend(self):
+        user_cf = UserCf(self.data)
+        for user in self.data:
+            for n, min_common in ((1, 0), (5, 0), (5, 2), (len(self.data), 0)):
+                expected = user_cf.nearest_user(user, n, vectorized=False, min_common=min_common)
+                result = user_cf.nearest_user(user, n, vectorized=True, min_common=min_common)
+                # 评分都是整数，各项和没有舍入误差，相关系数和相同相关系数下的顺序都完全一致
+                self.assertEqual(result, expected, (user, n, min_common))
+                self.assertEqual(user_cf.recommend(user, n, vectorized=True, min_common=min_common),
+                                 user_cf.recommend(user, n, vectorized=False, min_common=min_common))
+
+
+class RankedCounterTests(SimpleTestCase):
+    """ 计数相同的物品按到达该计数的先后排列，计数不大于0的物品移除 """
+
+    def test_ordering_and_ties(self):
+        counter = RankedCounter()
+        for item in "abc":
+            counter.add(item)
+        self.assertEqual(counter.top(3), ["a", "b", "c"])
+        counter.add("c")
+        counter.add("a")
+        self.assertEqual(list(counter.items()), [("c", 2), ("a", 2), ("b", 1)])
+        # 减少后排在同一计数已有物品的后面
+        counter.add("c", -1)
+        self.assertEqual(list(counter.items()), [("a", 2), ("b", 1), ("c", 1)])
+        counter.add("b", 5)
+        self.assertEqual(counter.top(2), ["b", "a"])
+        counter.add("a", -2)
+        self.assertEqual((len(counter), "a" in counter, counter.get("a")), (2, False, 0))
+        # 不存在的物品减少计数、增量为0时不变
+        counter.add("d", -1)
+        counter.add("b", 0)
+        self.assertEqual(list(counter.items()), [("b", 6), ("c", 1)])
+        self.assertEqual(list(pickle.loads(pickle.dumps(counter)).items()), list(counter.items()))
+
+    def test_random_updates_match_sorted_counts(self):
+        rng = np.random.default_rng(0)
+        counter, counts, arrival = RankedCounter(), {}, {}
+        for step in range(2000):
+            item, delta = int(rng.integers(20)), int(rng.choice([-3, -1, 1, 1, 2]))
+            counter.add(item, delta)
+            count = counts.get(item, 0) + delta
+            if item not in counts and count <= 0:
+                continue
+            if count > 0:
+                counts[item], arrival[item] = count, step
+            else:
+                del counts[item]
+            expected = sorted(counts.items(), key=lambda pair: (-pair[1], arrival[pair[0]]))
+            self.assertEqual(list(counter.items()), expected, step)
+            self.assertEqual(counter.top(5), [item for item, _ in expected[:5]])
+
+
+class PopularityIndexTests(SimpleTestCase):
+    """ 趋势热度按时间片过期，全量热度不过期 """
+
+    def test_trending_slots_expire(self):
+        now = [100.0]
+        # 窗口为3个时间片：当前时间100时窗口内为时间片8、9、10
+        index = PopularityIndex(window=30, slot=10, clock=lambda: now[0])
+        index.add("a", 3, timestamp=85)
+        index.add("b", 2, timestamp=95)
+        index.add("c", timestamp=105)
+        index.add("d", 5, timestamp=70)  # 早于窗口，只计入全量热度
+        self.assertEqual(index.top(4, trending=True), ["a", "b", "c"])
+        self.assertEqual(index.top(4), ["d", "a", "b", "c"])
+
+        now[0] = 110.0  # 时间片8过期
+        self.assertEqual(index.top(4, trending=True), ["b", "c"])
+        self.assertEqual((index.count("a"), index.count("a", trending=True)), (3, 0))
+        # 交互所在的时间片已经过期，只从全量热度中扣除
+        index.remove("a", timestamp=85)
+        self.assertEqual((index.count("a"), index.count("a", trending=True)), (2, 0))
+        # 只能撤销时间片内已经记录的次数
+        index.remove("b", 5, timestamp=95)
+        self.assertEqual(index.top(4, trending=True), ["c"])
+
+        now[0] = 130.0  # 时间片9、10过期
+        self.assertEqual(index.top(4, trending=True), [])
+        index.add("c", timestamp=125)
+        self.assertEqual((index.count("c"), index.count("c", trending=True)), (2, 1))
+
+    def test_from_events_matches_incremental(self):
+        rng = np.random.default_rng(0)
+        events = [(int(rng.integers(10)), float(rng.random() * 100)) for _ in range(300)] + [(3, None), (4, None)]
+        options = {"window": 40, "slot": 10, "clock": lambda: 100.0}
+        index = PopularityIndex.from_events(events, **options)
+        expected = PopularityIndex(**options)
+        for item, timestamp in events:
+            if timestamp is None:
+                expected.all_time.add(item)
+            else:
+                expected.add(item, timestamp=timestamp)
+        for trending in (False, True):
+            self.assertEqual({item: index.count(item, trending) for item in range(10)},
+                             {item: expected.count(item, trending) for item in range(10)})
+
+
+class EvaluateTests(SimpleTestCase):
+    """ 离线评估的指标与手算结果一致 """
+
+    def test_ranking_metrics(self):
+        # 命中第1、3位，测试集有3个物品；理想排序前3位都命中
+        ideal = 1 + 1 / np.log2(3) + 1 / 2
+        np.testing.assert_allclose(ranking_metrics(["a", "b", "c", "d", "e"], {"a", "c", "x"}, (1, 3, 5)), [
+            [1 / 3, 1, 1],
+            [2 / 3, 2 / 3, 1.5 / ideal],
+            [2 / 3, 2 / 5, 1.5 / ideal],
+        ])
+        # 测试集物品少于K：理想排序只有第1位命中，召回的物品少于K时其余位置记为未命中
+        np.testing.assert_allclose(ranking_metrics(["a", "b", "c", "d"], {"d"}, (2, 5)), [
+            [0, 0, 0],
+            [1, 1 / 5, 1 / np.log2(5)],
+        ])
+        np.testing.assert_allclose(ranking_metrics(["a", "b", "c"], {"b", "a"}, (3,)), [[1, 2 / 3, 1]])
+
+    def test_temporal_split(self):
+        data = pd.DataFrame([(1, "a"), (1, "b"), (2, "a"), (2, "c"), (1, "c"), (2, "d"), (1, "d"), (2, "b"),
+                             (1, "e"), (3, "a")], columns=["user_id", "item_id"])
+        data["time"] = np.arange(1, 11)
+        train, test, cutoff = temporal_split(data, test_ratio=0.2)
+        # 1..10的0.8分位数为8.2；用户3只有测试集中的评分，不参与评估
+        self.assertAlmostEqual(cutoff, 8.2)
+        self.assertEqual(train["time"].tolist(), list(range(1, 9)))
+        self.assertEqual(test[["user_id", "item_id", "time"]].values.tolist(), [[1, "e", 9]])
@@ -3,9 +3,13 @@ from django.urls import path
 from movie.views import (
     SearchMovie,
     RecommedMovie,
+    BatchRecommendMovie,
+    metrics_view,
 )
 
 urlpatterns = [
     path(route="search/", view=SearchMovie.as_view(), name='SearchMovie'),
     path(route="recommend/", view=RecommedMovie.as_view(), name='RecommedMovie'),
+    path(route="recommend/batch", view=BatchRecommendMovie.as_view(), name='BatchRecommendMovie'),
+    path(route="metrics", view=metrics_view, name='metrics'),
 ]
@@ -1,11 +1,20 @@
-from django.db.models import Q
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils import timezone
 from rest_framework import status
 from rest_framework.generics import ListAPIView
 from rest_framework.response import Response
+from rest_framework.views import APIView
 
-from movie.models import Movie
+from algorithm.metrics import metrics
+from movie.models import Movie, Recommendation
 from movie.serializers import MovieSerializer
-from movie.algorithm import recommend_by_user_cf, recommend_by_item_cf
+from movie.algorithm.cache import result_cache
+from movie.algorithm.registry import model_registry
+from movie.algorithm.search import search_store
 
 
 class SearchMovie(ListAPIView):
@@ -14,37 +23,136 @@ class SearchMovie(ListAPIView):
 
     def list(self, request, *args, **kwargs):
         query = request.query_params.get("query")
-        if query:
-            self.queryset = self.queryset.filter(
-                Q(name__icontains=query) | Q(intro__icontains=query) | Q(director__icontains=query)
-            )
+        if not query:
+            queryset = self.get_queryset()
+            page = self.paginate_queryset(queryset)
+            if page is not None:
+                serializer = self.get_serializer(page, many=True)
+                return self.get_paginated_response(serializer.data)
+
+            serializer = self.get_serializer(queryset, many=True)
+            return Response(serializer.data, status=status.HTTP_200_OK)
 
-        page = self.paginate_queryset(self.queryset)
+        # 索引返回按相关度排序的ID，分页后只查询当前页的电影
+        with metrics.timer("SearchMovie", "search"):
+            movie_ids = search_store.search(query)
+        page = self.paginate_queryset(movie_ids)
+        page_ids = page if page is not None else movie_ids
+        with metrics.timer("SearchMovie", "query"):
+            movies = self.get_queryset().prefetch_related("tags").in_bulk(page_ids)
+            items = [movies[movie_id] for movie_id in page_ids if movie_id in movies]
+        with metrics.timer("SearchMovie", "serialize"):
+            data = self.get_serializer(items, many=True).data
         if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
+            return self.get_paginated_response(data)
 
-        serializer = self.get_serializer(self.queryset, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return Response(data, status=status.HTTP_200_OK)
 
 
 class RecommedMovie(ListAPIView):
     queryset = Movie.objects.all()
     serializer_class = MovieSerializer
 
+    @staticmethod
+    def precomputed(user_id, method, n, topk, data_version):
+        """ 离线预计算的推荐结果，不存在、已过期或与当前模型的评分数据版本不同时返回None """
+        max_age = getattr(settings, "RECOMMEND_PRECOMPUTED", {}).get("max_age", 86400)
+        row = Recommendation.objects.filter(
+            user_id=user_id, method=method, n=n, topk__gte=topk, data_version=data_version,
+            created_at__gte=timezone.now() - timedelta(seconds=max_age),
+        ).values_list("movies", flat=True).first()
+        return None if row is None else row[:topk]
+
     def list(self, request, *args, **kwargs):
         user_id = int(request.query_params.get("user_id"))
         method = request.query_params.get("method", "user_cf")
+        n = int(request.query_params.get("n", 15))
+        topk = int(request.query_params.get("topk", 15))
 
-        if method == "user_cf":
-            self.queryset = recommend_by_user_cf(user_id)
-        else:
-            self.queryset = recommend_by_item_cf(user_id)
+        # 只用当前版本的模型打分，模型的构建和刷新在后台完成
+        current = model_registry.current
+        method = "user_cf" if method == "user_cf" else "item_cf"
+        # 依次查找结果缓存、预计算结果，都没有时实时召回，后两者的结果写入结果缓存
+        with metrics.timer("RecommedMovie", "cache"):
+            movie_ids = result_cache.get(user_id, method, n, topk, current.version)
+        source, cache_status = "cache", "HIT"
+        if movie_ids is None:
+            cache_status = "MISS"
+            with metrics.timer("RecommedMovie", "precomputed"):
+                movie_ids = self.precomputed(user_id, method, n, topk, current.data_version)
+            source = "precomputed"
+            if movie_ids is None:
+                source = "live"
+                with metrics.timer("RecommedMovie", f"recall.{method}"):
+                    movie_ids = current.models[method]([user_id], n, topk, hot_fill=True)[user_id]
+            result_cache.set(user_id, method, n, topk, current.version, movie_ids)
+        metrics.inc("recommend_requests_total", method=method, source=source, cache=cache_status.lower())
+        self.queryset = Movie.objects.filter(id__in=movie_ids).order_by("-sump")
 
-        page = self.paginate_queryset(self.queryset)
+        headers = {
+            "X-Model-Version": str(current.version),
+            "X-Model-Built-At": str(current.built_at),
+            "X-Cache": cache_status,
+            "X-Source": source,
+        }
+        with metrics.timer("RecommedMovie", "query"):
+            page = self.paginate_queryset(self.queryset)
+            items = list(page if page is not None else self.queryset)
+        with metrics.timer("RecommedMovie", "serialize"):
+            data = self.get_serializer(items, many=True).data
         if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
+            response = self.get_paginated_response(data)
+            response.headers.update(headers)
+            return response
+
+        return Response(data, status=status.HTTP_200_OK, headers=headers)
+
+
+class BatchRecommendMovie(APIView):
+    """ 批量推荐
+    POST `{"user_ids": [...], "method": "user_cf", "n": 15, "topk": 15}`，
+    按块批量打分，每块算完立即以NDJSON逐行返回`{"user_id": ..., "movies": [...]}`，只返回电影ID；
+    ASGI下每块的打分在线程池中执行(见`recommend.handlers`)，不阻塞事件循环
+    """
+
+    def post(self, request, *args, **kwargs):
+        options = getattr(settings, "RECOMMEND_BATCH", {})
+        chunk_size = options.get("chunk_size", 1000)
+        user_ids = request.data.get("user_ids")
+        # 字符串也是可迭代的，"12"会被当成[1, 2]，只接受整数列表
+        if not isinstance(user_ids, list) or not all(
+                isinstance(user_id, int) and not isinstance(user_id, bool) for user_id in user_ids):
+            return Response({"detail": "user_ids must be a list of integers"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            n = int(request.data.get("n", 15))
+            topk = int(request.data.get("topk", 15))
+        except (TypeError, ValueError):
+            return Response({"detail": "n and topk must be integers"}, status=status.HTTP_400_BAD_REQUEST)
+        if len(user_ids) > options.get("max_users", 1000000):
+            return Response({"detail": "Too many user_ids"}, status=status.HTTP_400_BAD_REQUEST)
+        method = "user_cf" if request.data.get("method", "user_cf") == "user_cf" else "item_cf"
+
+        # 整个请求使用同一版本的模型
+        current = model_registry.current
+        model = current.models[method]
+        metrics.inc("recommend_batch_users_total", len(user_ids), method=method)
+
+        def stream():
+            for start in range(0, len(user_ids), chunk_size):
+                chunk = user_ids[start:start + chunk_size]
+                with metrics.timer("BatchRecommendMovie", f"recall.{method}"):
+                    user_rec = model(chunk, n, topk, hot_fill=True, batch_size=chunk_size)
+                yield "".join(
+                    json.dumps({"user_id": user_id, "movies": [int(movie_id) for movie_id in user_rec[user_id]]}) + "\n"
+                    for user_id in chunk
+                )
+
+        response = StreamingHttpResponse(stream(), content_type="application/x-ndjson")
+        response["X-Model-Version"] = str(current.version)
+        response["X-Model-Built-At"] = str(current.built_at)
+        return response
+
 
-        serializer = self.get_serializer(self.queryset, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+def metrics_view(request):
+    """ Prometheus格式的分阶段耗时和模型大小，每个worker进程各自统计 """
+    return HttpResponse(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -9,8 +9,15 @@ https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+from recommend.handlers import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'recommend.settings')
 
 application = get_asgi_application()
+
+# 启动时预热推荐模型，之后在后台线程中刷新；
+# 由run.py启动的worker已经继承了父进程构建的模型，重新构建由父进程完成后替换worker
+from movie.algorithm.registry import model_registry  # noqa: E402
+
+if os.environ.get("RECOMMEND_REFRESH") != "master":
+    model_registry.start()
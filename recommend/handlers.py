@@ -0,0 +1,46 @@
+""" ASGI入口
+Django 3.2在事件循环中同步迭代流式响应，批量推荐每生成一块都要打分，会阻塞同一worker中的其他请求；
+这里把流式响应每一块的生成放到线程池中，事件循环只负责发送
+"""
+import django
+from asgiref.sync import sync_to_async
+from django.core.handlers import asgi
+
+_DONE = object()
+
+
+class ASGIHandler(asgi.ASGIHandler):
+
+    async def send_response(self, response, send):
+        if not response.streaming:
+            return await super().send_response(response, send)
+
+        # 与父类相同：保留响应头的大小写，cookie合并到响应头中
+        response_headers = []
+        for header, value in response.items():
+            if isinstance(header, str):
+                header = header.encode("ascii")
+            if isinstance(value, str):
+                value = value.encode("latin1")
+            response_headers.append((bytes(header), bytes(value)))
+        for cookie in response.cookies.values():
+            response_headers.append((b"Set-Cookie", cookie.output(header="").encode("ascii").strip()))
+        await send({"type": "http.response.start", "status": response.status_code, "headers": response_headers})
+
+        # 生成器中只做打分和序列化，不访问数据库，可以在任意线程中执行
+        parts = iter(response)
+        next_part = sync_to_async(next, thread_sensitive=False)
+        while True:
+            part = await next_part(parts, _DONE)
+            if part is _DONE:
+                break
+            for chunk, _ in self.chunk_bytes(part):
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body"})
+        await sync_to_async(response.close, thread_sensitive=True)()
+
+
+def get_asgi_application():
+    """ 与`django.core.asgi.get_asgi_application`相同，使用上面的ASGIHandler """
+    django.setup(set_prefix=False)
+    return ASGIHandler()
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.2/ref/settings/
 """
 
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -82,6 +83,16 @@ DATABASES = {
     }
 }
 
+# PRAGMAs applied to every new SQLite connection, see recommend/sqlite.py
+
+SQLITE_PRAGMAS = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64000,
+    'temp_store': 'memory',
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -125,3 +136,89 @@ STATIC_URL = '/static/'
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Recommendation model registry
+# interval: rebuild every `interval` seconds; max_changes/debounce: rebuild after `max_changes`
+# rating changes once no further change has arrived for `debounce` seconds
+
+RECOMMEND_REGISTRY = {
+    'interval': 3600,
+    'max_changes': 100,
+    'debounce': 30,
+}
+
+# ItemCF build options: time decay half-life in seconds, and per-user history limits
+# (most recent max_items ratings / ratings within window seconds of the user's latest one)
+
+RECOMMEND_ITEM_CF = {
+    'engine': 'sparse',
+    'half_life': None,
+    'max_items': None,
+    'window': None,
+}
+
+# Tag similarity for movies without ratings in ItemCF, off by default
+# weight: a cold movie scores weight * (mean Jaccard similarity to the user's history) * the user's top CF score
+# slots: at most this many cold movies per recommendation list
+
+RECOMMEND_TAGS = {
+    'enabled': False,
+    'weight': 1.0,
+    'slots': 2,
+}
+
+# Per-user recommendation result cache
+# backend: 'local' (in-process LRU, takes max_size/ttl), 'django' (settings.CACHES, takes alias/ttl) or
+# 'auto' ('django' when run.py starts more than one worker, 'local' otherwise). A rating only invalidates
+# the local cache of the worker that saved it, so multi-worker deployments need a cache shared by the
+# workers: the 'recommend' alias below is file based, point it at Redis/Memcached where available
+
+RECOMMEND_CACHE = {
+    'backend': 'auto',
+    'alias': 'recommend',
+    'max_size': 10000,
+    'ttl': 300,
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'recommend': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': Path(tempfile.gettempdir()) / 'recommend-cache',
+    },
+}
+
+# Precomputed recommendations written by `manage.py precompute_recommendations`
+# max_age: rows older than max_age seconds are ignored and the request is scored live
+
+RECOMMEND_PRECOMPUTED = {
+    'max_age': 86400,
+}
+
+# Batch recommendation endpoint (POST /api/recommend/batch, NDJSON response)
+# chunk_size: users scored per batched recall pass; max_users: largest accepted request
+
+RECOMMEND_BATCH = {
+    'chunk_size': 1000,
+    'max_users': 1000000,
+}
+
+# In-memory popularity index used by cold-start and fallback paths
+# window: trending window in seconds, counted in slots of `slot` seconds
+
+RECOMMEND_POPULARITY = {
+    'window': 7 * 86400,
+    'slot': 3600,
+}
+
+# Movie search index
+# backend: 'ngram' (in-process character n-gram inverted index, takes n) or 'fts5'
+# (SQLite FTS5 table with the trigram tokenizer, falls back to 'ngram' when unavailable)
+
+RECOMMEND_SEARCH = {
+    'backend': 'ngram',
+    'n': 2,
+}
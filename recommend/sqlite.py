@@ -0,0 +1,16 @@
+""" SQLite连接参数
+每个新连接建立时执行`settings.SQLITE_PRAGMAS`中的PRAGMA：
+    journal_mode=wal    写入不阻塞读取，多个worker进程可以同时读
+    synchronous=normal  WAL模式下只在检查点时fsync，断电最多丢失最近的事务，不会损坏数据库
+    mmap_size           读取时直接映射数据库文件，减少系统调用和内存拷贝
+    cache_size          每个连接的页缓存，负数表示KiB
+"""
+from django.conf import settings
+
+
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        for name, value in getattr(settings, "SQLITE_PRAGMAS", {}).items():
+            cursor.execute(f"PRAGMA {name} = {value}")
@@ -1,19 +1,260 @@
+""" 启动推荐服务
+开发环境：python run.py --reload
+生产环境：python run.py --workers 4
+    父进程先加载Django和推荐模型，再fork出多个worker共享同一个监听socket，
+    模型在worker之间以写时复制的方式共享；
+    SIGHUP 重新加载模型并逐个替换worker，SIGTERM/SIGINT 等待worker处理完请求后退出
+模型只在父进程中重新构建：按`RECOMMEND_REGISTRY`的interval定时，或者评分表的变化达到max_changes条且
+debounce秒内没有新的变化时，重新加载模型并替换全部worker，worker中不启动刷新线程。
+worker中随信号增量更新的评分快照、热门、检索和标签索引只能看到本worker处理的写入，
+其他worker的写入在下一次替换worker时生效；结果缓存在多worker时使用进程间共享的后端
+"""
+import argparse
+import gc
 import os
+import signal
+import time
 
 import uvicorn
+from loguru import logger
+
+APP = "recommend.asgi:application"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run the recommend ASGI server")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WEB_CONCURRENCY", 1)))
+    parser.add_argument("--reload", action="store_true", help="development mode: single process, restart on code changes")
+    parser.add_argument("--log-level", default="info")
+    parser.add_argument("--stats-interval", type=float, default=60,
+                        help="seconds between per-worker memory reports, 0 to disable")
+    return parser.parse_args()
+
+
+def preload(force=False):
+    """ 在父进程中加载Django和推荐模型，fork后的worker共享这部分内存
+    :param force: 重新加载，父进程不处理请求、收不到写入信号，已经加载的索引全部丢弃后重新读取
+    """
+    import django
+    from django.db import connections
+
+    django.setup()
+    from movie.algorithm.popularity import popularity_store
+    from movie.algorithm.registry import model_registry
+    from movie.algorithm.search import search_store
+    from movie.algorithm.tags import tag_store
+
+    if force:
+        for store in (popularity_store, search_store, tag_store):
+            store.reset()
+    model_registry.build(force=force)
+    # 数据库连接不能跨进程共享
+    connections.close_all()
+    # 把已有对象移出GC的跟踪范围，避免worker中的垃圾回收改写这些页面而触发复制
+    gc.collect()
+    gc.freeze()
+
+
+def memory_usage(pid):
+    """ 进程的内存占用(MB)，Pss为按共享进程数分摊后的内存 """
+    usage = {}
+    for name, fields in (("status", ("VmRSS",)), ("smaps_rollup", ("Pss", "Shared_Clean", "Private_Dirty"))):
+        try:
+            with open(f"/proc/{pid}/{name}") as file:
+                for line in file:
+                    key, _, value = line.partition(":")
+                    if key in fields:
+                        usage[key] = int(value.split()[0]) / 1024
+        except OSError:
+            continue
+    return usage
+
+
+def rating_stamp():
+    """ 评分表的(条数, 最大ID)，查询后关闭连接，数据库连接不能被fork出的worker继承 """
+    from django.db import connections
+    from movie.algorithm.registry import model_registry
+
+    try:
+        return model_registry.store.stamp()
+    finally:
+        connections.close_all()
+
+
+class RefreshSchedule:
+    """ 父进程中重新构建模型的时机，与`ModelRegistry`后台线程的判断一致
+    评分的写入发生在worker中，父进程收不到信号，改为每debounce秒比较一次评分表的(条数, 最大ID)
+    """
+
+    def __init__(self, interval: float = 3600, max_changes: int = 100, debounce: float = 30):
+        self.interval = interval
+        self.max_changes = max_changes
+        self.debounce = debounce
+        self.failed_at = 0.0
+        self.reset()
+
+    def reset(self):
+        """ 模型刚刚重新构建 """
+        self.built_at = self.checked_at = time.time()
+        self.stamp = self.last_stamp = rating_stamp()
+
+    def changes(self, stamp):
+        """ 上次构建以来新增和删除的评分数 """
+        inserted = stamp[1] - self.stamp[1]
+        deleted = self.stamp[0] + inserted - stamp[0]
+        return inserted + max(deleted, 0)
+
+    def due(self):
+        now = time.time()
+        if now - self.failed_at < self.debounce:
+            return False
+        if now - self.built_at >= self.interval:
+            return True
+        if now - self.checked_at < self.debounce:
+            return False
+        self.checked_at = now
+        stamp = rating_stamp()
+        # 与上一次检查相比没有变化，说明已经静默了debounce秒
+        quiet, self.last_stamp = stamp == self.last_stamp, stamp
+        return quiet and self.changes(stamp) >= self.max_changes
+
+
+class Arbiter:
+    """ 管理worker进程 """
+
+    def __init__(self, config: uvicorn.Config, workers: int, stats_interval: float):
+        from django.conf import settings
+
+        self.config = config
+        self.num_workers = workers
+        self.stats_interval = stats_interval
+        self.socket = config.bind_socket()
+        self.workers = {}  # pid -> 启动时间
+        self.retiring = set()
+        self._signals = []
+        options = getattr(settings, "RECOMMEND_REGISTRY", {})
+        self.schedule = RefreshSchedule(**{key: options[key] for key in ("interval", "max_changes", "debounce")
+                                           if key in options})
+
+    def spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            self._run_worker()
+        self.workers[pid] = time.time()
+        logger.info(f"Started worker {pid}")
+
+    def _run_worker(self):
+        for sig in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT, signal.SIGCHLD):
+            signal.signal(sig, signal.SIG_DFL)
+        try:
+            uvicorn.Server(self.config).run(sockets=[self.socket])
+        finally:
+            os._exit(0)
+
+    def terminate(self, pids):
+        for pid in pids:
+            self.retiring.add(pid)
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def reload(self):
+        """ 重新加载模型，先启动新的worker再让旧的worker处理完请求后退出 """
+        logger.info("Reloading models and workers")
+        preload(force=True)
+        self.schedule.reset()
+        old = list(self.workers)
+        for _ in range(self.num_workers):
+            self.spawn()
+        self.terminate(old)
+
+    def refresh(self):
+        """ 到了重新构建的时间时重新加载模型并替换worker，失败时旧的worker继续服务 """
+        try:
+            if self.schedule.due():
+                self.reload()
+        except Exception as e:
+            self.schedule.failed_at = time.time()
+            logger.exception(f"Failed to reload models, keep serving the current workers: {e}")
+
+    def reap(self, stopping):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            self.workers.pop(pid, None)
+            if pid in self.retiring:
+                self.retiring.discard(pid)
+            elif not stopping:
+                logger.warning(f"Worker {pid} exited with status {status}, restarting")
+                self.spawn()
+
+    def report_memory(self):
+        for pid in self.workers:
+            usage = ", ".join(f"{key}={value:.1f}MB" for key, value in memory_usage(pid).items())
+            logger.info(f"Worker {pid}: {usage}")
+
+    def run(self):
+        for sig in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+            signal.signal(sig, lambda signum, frame: self._signals.append(signum))
+
+        logger.info(f"Master {os.getpid()} listening on {self.config.host}:{self.config.port}")
+        for _ in range(self.num_workers):
+            self.spawn()
+        self.report_memory()
+
+        last_report = time.time()
+        while True:
+            time.sleep(0.5)
+            while self._signals:
+                signum = self._signals.pop(0)
+                if signum == signal.SIGHUP:
+                    self.reload()
+                else:
+                    return self.stop()
+            self.reap(stopping=False)
+            self.refresh()
+            if self.stats_interval and time.time() - last_report >= self.stats_interval:
+                self.report_memory()
+                last_report = time.time()
+
+    def stop(self):
+        logger.info("Shutting down workers")
+        self.terminate(list(self.workers))
+        while self.workers:
+            time.sleep(0.2)
+            self.reap(stopping=True)
+        self.socket.close()
 
 
 def main():
     os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'recommend.settings')
+    args = parse_args()
+
+    if args.reload:
+        uvicorn.run(
+            APP,
+            host=args.host,
+            port=args.port,
+            log_level="debug",
+            reload=True,
+        )
+        return
 
-    uvicorn.run(
-        "recommend.asgi:application",
-        host="0.0.0.0",
-        port=8000,
-        log_level="debug",
-        reload=True,
-    )
+    # 结果缓存等按worker数选择进程内或进程间共享的实现，需要在加载Django之前设置
+    os.environ["WEB_CONCURRENCY"] = str(args.workers)
+    # 由父进程负责重新构建模型，worker中不启动刷新线程
+    os.environ["RECOMMEND_REFRESH"] = "master"
+    preload()
+    config = uvicorn.Config(APP, host=args.host, port=args.port, log_level=args.log_level)
+    Arbiter(config, args.workers, args.stats_interval).run()
 
 
-if __name__ == "main":
+if __name__ == "__main__":
     main()